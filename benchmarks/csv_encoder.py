@@ -0,0 +1,82 @@
+"""
+    benchmarks.csv_encoder
+    ~~~~~~~~~~~~~~~~~~~~~~
+
+    Compares the per cell csv generator previously used by the data views with
+    croplands_api.utils.csv_encoder.encode_rows on synthetic export rows.
+
+    python -m benchmarks.csv_encoder [rows]
+"""
+from croplands_api.utils.csv_encoder import encode_rows
+import random
+import sys
+import time
+
+HEADERS = ['id', 'year', 'month', 'lat', 'lon', 'country', 'land_use_type', 'crop_primary',
+           'crop_secondary', 'water', 'intensity', 'source_type', 'source_class',
+           'source_description', 'use_validation']
+TEXT_COLUMNS = [5, 11, 12, 13]
+
+
+def safe_for_csv(value):
+    escape_chars = ["'", "\""]
+
+    try:
+        value = value.replace(",", "_")
+    except AttributeError:
+        pass
+
+    if value is None:
+        return ""
+    elif any((c in str(value) for c in escape_chars)):
+        return "\"" + str(value) + "\""
+    else:
+        return str(value)
+
+
+def legacy_result_generator(results):
+    for i, r in enumerate(results):
+        if i == 0:
+            yield ','.join(HEADERS) + '\n'
+        yield ','.join([safe_for_csv(c) for c in r]) + '\n'
+
+
+def synthetic_rows(n):
+    countries = [u'United States of America', u'Brazil', u'India', u"C\xf4te d'Ivoire"]
+    descriptions = [None, u'field visit', u'from "survey", 2015', u'derived']
+    rows = []
+    for i in xrange(n):
+        rows.append((i, 2015, random.randint(1, 12), round(random.uniform(-60, 60), 8),
+                     round(random.uniform(-180, 180), 8), random.choice(countries),
+                     random.randint(0, 7), random.randint(0, 25), random.randint(0, 25),
+                     random.randint(0, 2), random.randint(0, 4), u'ground', None,
+                     random.choice(descriptions), False))
+    return rows
+
+
+def run(name, generator):
+    start = time.time()
+    size = 0
+    for block in generator:
+        size += len(block)
+    elapsed = time.time() - start
+    print('%-10s %8.2fs %12d bytes' % (name, elapsed, size))
+    return elapsed
+
+
+def main(n=1000000):
+    rows = synthetic_rows(n)
+    print('%d rows' % n)
+
+    # the legacy generator calls str() on unicode, keep it to ascii rows
+    ascii_rows = [r[:5] + ('Brazil',) + r[6:13] + ('field visit',) + r[14:] for r in rows]
+    legacy = run('legacy', legacy_result_generator(ascii_rows))
+    encoder = run('encoder', encode_rows(ascii_rows, headers=HEADERS,
+                                         text_columns=TEXT_COLUMNS))
+    print('speedup    %8.2fx' % (legacy / encoder))
+
+    run('unicode', encode_rows(rows, headers=HEADERS, text_columns=TEXT_COLUMNS))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000000)
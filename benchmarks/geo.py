@@ -0,0 +1,77 @@
+"""
+    benchmarks.geo
+    ~~~~~~~~~~~~~~
+
+    Compares the per point geopy and math loops previously used by
+    croplands_api.utils.geo with the array functions on random points. The loops are timed
+    on a sample and scaled up, the arrays are timed on every point.
+
+    python -m benchmarks.geo [points]
+"""
+from croplands_api.utils.geo import vincenty_distances, haversine_distances, destinations, \
+    bearings, degrees_to_tile_numbers
+from geopy.distance import vincenty, Point, VincentyDistance
+import math
+import numpy as np
+import sys
+import time
+
+LOOP_SAMPLE = 20000
+
+
+def legacy_bearing(lat1, lon1, lat2, lon2):
+    lat1, lat2 = math.radians(lat1), math.radians(lat2)
+    diff_lon = math.radians(lon2 - lon1)
+    x = math.sin(diff_lon) * math.cos(lat2)
+    y = math.cos(lat1) * math.sin(lat2) - math.sin(lat1) * math.cos(lat2) * math.cos(diff_lon)
+    return (math.degrees(math.atan2(x, y)) + 360) % 360
+
+
+def legacy_tile(lat, lon, zoom):
+    lat_rad = math.radians(lat)
+    n = 2.0 ** zoom
+    return (int((lon + 180.0) / 360.0 * n),
+            int((1.0 - math.log(math.tan(lat_rad) + (1 / math.cos(lat_rad))) / math.pi) / 2.0 * n))
+
+
+def time_loop(fn, n, *columns):
+    sample = [c[:LOOP_SAMPLE] for c in columns]
+    start = time.time()
+    for args in zip(*sample):
+        fn(*args)
+    return (time.time() - start) * n / len(sample[0])
+
+
+def time_array(fn, *columns):
+    start = time.time()
+    fn(*columns)
+    return time.time() - start
+
+
+def main(n=1000000):
+    lat1, lat2 = np.random.uniform(-60, 60, n), np.random.uniform(-60, 60, n)
+    lon1, lon2 = np.random.uniform(-180, 180, n), np.random.uniform(-180, 180, n)
+    bearing, km = np.random.uniform(0, 360, n), np.random.uniform(0, 50, n)
+    zoom = np.full(n, 17)
+    print('%d points' % n)
+
+    cases = [
+        ('vincenty', lambda *a: vincenty(a[:2], a[2:]).meters, vincenty_distances,
+         (lat1, lon1, lat2, lon2)),
+        ('haversine', lambda *a: vincenty(a[:2], a[2:]).meters, haversine_distances,
+         (lat1, lon1, lat2, lon2)),
+        ('destination', lambda lat, lon, b, d: VincentyDistance(kilometers=d).destination(
+            Point(lat, lon), b), destinations, (lat1, lon1, bearing, km)),
+        ('bearing', legacy_bearing, bearings, (lat1, lon1, lat2, lon2)),
+        ('tile', legacy_tile, degrees_to_tile_numbers, (lat1, lon1, zoom)),
+    ]
+
+    for name, loop, array, columns in cases:
+        looped = time_loop(loop, n, *columns)
+        vectorized = time_array(array, *columns)
+        print('%-12s loop %8.2fs  array %6.2fs  %7.1fx' % (name, looped, vectorized,
+                                                          looped / vectorized))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000000)
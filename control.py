@@ -99,6 +99,29 @@ def get_image_from_csv(path):
 
 
 
+@manager.command
+def import_locations(path, batch_size=5000):
+    """
+    Imports locations from a csv with lat and lon columns. Neighbor use is resolved per
+    batch rather than with a query for every row.
+    :param path: csv file
+    :param batch_size: locations per commit
+    :return: None
+    """
+    import csv
+    from croplands_api.models import Location
+
+    with manager.app.app_context():
+        with open(path) as f:
+            rows = [{'lat': row['lat'], 'lon': row['lon']} for row in csv.DictReader(f)]
+
+        batch_size = int(batch_size)
+        for i in range(0, len(rows), batch_size):
+            locations = Location.create_many(rows[i:i + batch_size])
+            db.session.commit()
+            print("Imported %d locations" % (i + len(locations)))
+
+
 @manager.command
 def random(n=10000000):
     import csv
@@ -170,14 +193,15 @@ def coverage():
 def classification():
     with manager.app.app_context():
         from croplands_api.tasks.classifications import build_classifications_result, compute_image_classification_statistics
-        build_classifications_result.delay()
+        build_classifications_result.delay(force=True)
         # compute_image_classification_statistics(30986)
 
 @manager.command
 def clear_mapids():
     """
-    Clears all map ids from the cache. Map ids and tokens are currently stored for
-    between 12 and 24 hours to speed retrieval of tiles from Google Earth Engine.
+    Clears all map ids from the cache. Map ids and tokens are stored for MAP_ID_TIMEOUT and
+    rebuilt in the background after MAP_ID_REFRESH to speed retrieval of tiles from Google
+    Earth Engine.
     :return: None
     """
     with manager.app.app_context():
@@ -186,42 +210,59 @@ def clear_mapids():
             print 'deleting %s' % key
             redis_client.delete(key)
 
+        from croplands_api.tasks.maps import prewarm_maps
+        prewarm_maps.delay()
+
 
 @manager.command
 def ndvi():
     from croplands_api.models import Record
-    from croplands_api.tasks.records import get_ndvi
+    from croplands_api.tasks.records import get_ndvi_batch
+
+    with manager.app.app_context():
+        batch_size = app.config['NDVI_BATCH_SIZE']
+        ids = [r.id for r in db.session.query(Record.id).filter(Record.ndvi == None)]
+        for i in range(0, len(ids), batch_size):
+            get_ndvi_batch.delay(ids[i:i + batch_size])
+            print("Called get_ndvi_batch.delay for %d records" % len(ids[i:i + batch_size]))
+
+
+@manager.command
+def rebuild_record_search():
+    """
+    Rebuilds the denormalized record_search table used by the data api from record and
+    location. It is normally kept up to date by triggers.
+    :return: None
+    """
+    from croplands_api.models import RecordSearch
 
     with manager.app.app_context():
-        for r in db.session.query(Record).filter(Record.ndvi == None).all():
-            get_ndvi.delay(r.id)
-            print("Called get_ndvi.delay(%d)" % r.id)
+        RecordSearch.rebuild()
 
 
 @manager.command
 def reference_data_coverage():
     """
-    Clears all map ids from the cache. Map ids and tokens are currently stored for
-    between 12 and 24 hours to speed retrieval of tiles from Google Earth Engine.
+    Rebuilds the reference data coverage summary now, even if the data has not changed.
     :return: None
     """
     with manager.app.app_context():
         from croplands_api.tasks.reference_data_coverage import reference_data_coverage_task
 
-        reference_data_coverage_task()
+        reference_data_coverage_task(force=True)
 
 
 @manager.command
 def fusion():
     """
-    Clears all map ids from the cache. Map ids and tokens are currently stored for
-    between 12 and 24 hours to speed retrieval of tiles from Google Earth Engine.
+    Uploads the training, validation and public records to their fusion tables now, even if
+    the records have not changed.
     :return: None
     """
     with manager.app.app_context():
         from croplands_api.tasks.records import build_fusion_tables
 
-        build_fusion_tables()
+        build_fusion_tables(force=True)
 
 
 if __name__ == '__main__':
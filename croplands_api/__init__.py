@@ -160,6 +160,9 @@ def create_app(config='Testing'):
     import croplands_api.tasks.classifications
     import croplands_api.tasks.reference_data_coverage
     import croplands_api.tasks.records
+    import croplands_api.tasks.snapshots
+    import croplands_api.tasks.images
+    import croplands_api.tasks.maps
 
     return app
 
@@ -1,4 +1,5 @@
 import os
+import tempfile
 from datetime import timedelta
 import base64
 from flask import json
@@ -16,6 +17,31 @@ class Default(object):
     GOOGLE_SERVICE_ACCOUNT = json.loads(base64.b64decode(os.environ.get('GOOGLE_SERVICE_ACCOUNT_ENC')).decode('utf-8'))
     GOOGLE_SERVICE_ACCOUNT_SCOPES = ['https://www.googleapis.com/auth/fusiontables',
                                      'https://www.googleapis.com/auth/earthengine']
+    NDVI_BACKEND = 'earthengine'
+    NDVI_BATCH_SIZE = 200  # getInfo returns at most 5000 features, 23 per record
+    NDVI_REFRESH_BATCHES = 10  # batches dispatched per refresh_ndvi run
+    NDVI_REFRESH_INCOMPLETE = timedelta(days=10)
+    NDVI_REFRESH_COMPLETE = timedelta(days=150)
+    NDVI_REFRESH_TIMEOUT = timedelta(hours=2)  # claims older than this are dispatched again
+    IMAGE_PENDING_TIMEOUT = timedelta(minutes=30)  # pending images older than this are requeued
+    IMAGE_REQUEUE_LIMIT = 500  # images requeued per requeue_pending_images run
+    MAP_ID_TIMEOUT = 60 * 60 * 12
+    MAP_ID_REFRESH = 60 * 60 * 10  # maps older than this are rebuilt in the background
+    MAP_ID_LOCK_TIMEOUT = 60
+    # tiles are only prewarmed into a shared, redis, tile cache
+    MAP_PREWARM_ZOOMS = range(0, 6)
+    MAP_PREWARM_REGIONS = [(-60, -180, 80, 180)]  # south, west, north, east
+    MAP_PREWARM_MAX_TILES = 5000
+    MAP_PREWARM_CONCURRENCY = 4
+    TIME_SERIES_GRID_SIZE = 0.002  # degrees, about one MODIS 250m pixel
+    TIME_SERIES_CACHE_TIMEOUT = 60 * 60 * 24 * 7
+    TIME_SERIES_MAX_POINTS = 100
+    TILE_CACHE_BACKEND = 'disk'  # disk, redis or None
+    TILE_CACHE_DIR = os.environ.get('TILE_CACHE_DIR',
+                                    os.path.join(tempfile.gettempdir(), 'croplands_tiles'))
+    TILE_CACHE_MAX_BYTES = 2 * 1024 * 1024 * 1024
+    TILE_CACHE_MAX_AGE = 60 * 60 * 24 * 7
+    TILE_CACHE_LOCK_TIMEOUT = 30  # seconds a redis tile fetch may hold its lock
 
     # Amazon
     AWS_ACCESS_KEY_ID = os.environ.get('AWS_ACCESS_KEY_ID')
@@ -25,6 +51,9 @@ class Default(object):
     BUCKET = 'croplands-public'
     GS_ACCESS_KEY = os.environ.get("GS_ACCESS_KEY")
     GS_SECRET = os.environ.get("GS_SECRET")
+    STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'boto')  # boto or local
+    STORAGE_ROOT = os.environ.get('STORAGE_ROOT',
+                                  os.path.join(tempfile.gettempdir(), 'croplands_storage'))
 
 
     # Auth and JWT Settings
@@ -55,7 +84,9 @@ class Default(object):
     DG_EV_CONNECT_ID = os.environ.get('DG_EV_CONNECT_ID')
     DG_EV_USERNAME = os.environ.get('DG_EV_USERNAME')
     DG_EV_PASSWORD = os.environ.get('DG_EV_PASSWORD')
-    VHRI_TILE_MAX_THREADS = os.environ.get('VHRI_TILE_MAX_THREADS', 5)
+    DG_EV_URL = os.environ.get('DG_EV_URL',
+                               'https://evwhs.digitalglobe.com/earthservice/wmtsaccess')
+    VHRI_TILE_MAX_THREADS = int(os.environ.get('VHRI_TILE_MAX_THREADS', 5))
 
     # Misc
     ALLOWED_IMG_EXTENSIONS = ['jpg', 'png']
@@ -63,7 +94,15 @@ class Default(object):
     CSRF_ENABLED = False
     DATA_DOWNLOAD_LINK_EXPIRATION = 60*5
     DATA_DOWNLOAD_MAX_PAGE_SIZE = 50000
+    DATA_DOWNLOAD_STREAM_BATCH_SIZE = 5000
+    DATA_DOWNLOAD_CURSOR_TIMEOUT = 60*60*24
+    DATA_COUNT_CACHE_TIMEOUT = 60*5
+    DATA_COUNT_TOTAL_CACHE_TIMEOUT = 60*60*24
+    DATA_IMAGE_CACHE_TIMEOUT = 60*60
     DATA_QUERY_DELAY = timedelta(0)  # how long until data is publicly available
+    DATA_SNAPSHOT_URL = 'https://storage.googleapis.com/%(bucket)s/%(key)s'
+    DATA_SNAPSHOT_MAX_AGE = 60*60
+    FUSION_TABLE_SPOOL_SIZE = 16 * 1024 * 1024  # bytes kept in memory per csv before disk
 
 
 class Testing(Default):
@@ -73,6 +112,10 @@ class Testing(Default):
 
     # Amazon
     BUCKET = 'croplands-test'
+    STORAGE_BACKEND = 'local'
+
+    # Google
+    NDVI_BACKEND = 'fake'
 
     # Celery and Tasks
     CELERY_ALWAYS_EAGER = False
@@ -110,6 +153,7 @@ class Production(Development):
 
     # Amazon
     AWS_S3_BUCKET = 'gfsad30'
+    STORAGE_BACKEND = 'boto'
 
     # Redis, Cache Etc.
     CACHE_TYPE = 'redis'
@@ -135,6 +179,26 @@ class Production(Development):
             'schedule': timedelta(minutes=30),
             'options': {'queue': CELERY_DEFAULT_QUEUE}
         },
+        'refresh_ndvi': {
+            'task': 'croplands_api.tasks.records.refresh_ndvi',
+            'schedule': timedelta(minutes=30),
+            'options': {'queue': CELERY_DEFAULT_QUEUE}
+        },
+        'build_snapshots': {
+            'task': 'croplands_api.tasks.snapshots.build_snapshots',
+            'schedule': timedelta(hours=1),
+            'options': {'queue': CELERY_DEFAULT_QUEUE}
+        },
+        'requeue_pending_images': {
+            'task': 'croplands_api.tasks.images.requeue_pending_images',
+            'schedule': timedelta(minutes=30),
+            'options': {'queue': CELERY_DEFAULT_QUEUE}
+        },
+        'prewarm_maps': {
+            'task': 'croplands_api.tasks.maps.prewarm_maps',
+            'schedule': timedelta(hours=12),
+            'options': {'queue': CELERY_DEFAULT_QUEUE}
+        },
         'build_data_coverage': {
             'task': 'croplands_api.tasks.reference_data_coverage.reference_data_coverage_task',
             'schedule': timedelta(days=1),
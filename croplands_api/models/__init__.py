@@ -8,3 +8,5 @@ from croplands_api.models.user import User
 from croplands_api.models.location import Location, Image, ImageClassification, ImageClassificationProvider
 from croplands_api.models.point import Point
 from croplands_api.models.record import Record, RecordHistory, RecordRating
+from croplands_api.models.record_search import RecordSearch
+from croplands_api.models.export_state import ExportState
@@ -0,0 +1,15 @@
+from croplands_api.models import db
+from croplands_api.models.base import BaseModel
+
+
+class ExportState(BaseModel):
+    """
+    Fingerprint of the source rows each partition of a periodic export was last built from.
+    See croplands_api.utils.exports.
+    """
+    __tablename__ = 'export_state'
+
+    name = db.Column(db.String, primary_key=True)
+    partition = db.Column(db.String, primary_key=True)
+    fingerprint = db.Column(db.String, nullable=False)
+    date_built = db.Column(db.DateTime, default=db.func.now(), onupdate=db.func.now())
@@ -1,8 +1,8 @@
 from croplands_api.models import db
 from croplands_api.models.base import BaseModel
-from croplands_api.utils.geo import get_destination
+from croplands_api.utils.geo import get_destination, neighbors_within
 from sqlalchemy.orm import relationship
-from sqlalchemy import ForeignKey, UniqueConstraint, CheckConstraint
+from sqlalchemy import ForeignKey, UniqueConstraint, CheckConstraint, DDL, event
 from sqlalchemy.sql import text
 import random
 
@@ -60,6 +60,9 @@ class Location(BaseModel):
     use_invalid_reason = db.Column(db.String)
 
     def __init__(self, *args, **kwargs):
+        # create_many resolves neighbor use for a whole batch instead
+        check_neighbors = kwargs.pop('check_neighbors', True)
+
         # convert to float if str
         self.lat = float(kwargs['lat'])
         self.lon = float(kwargs['lon'])
@@ -80,7 +83,8 @@ class Location(BaseModel):
             if self.use_validation:
                 self.use_validation_locked = random.choice([True, False])
 
-        self.check_neighbor_use()
+        if check_neighbors:
+            self.check_neighbor_use()
         # self.check_neighbor_field()
 
     def check_neighbor_use(self, threshold=1000):
@@ -107,25 +111,36 @@ class Location(BaseModel):
         # get nearby locations to this location
         nearby_locations = Location.within(self.lat, self.lon, threshold)
 
-        # if there are nearby locations
-        if len(nearby_locations) > 0:
-            use_validation = 0
-            use_training = 0
+        use_validation = 0
+        use_training = 0
 
-            # get neighbors use
-            for location in nearby_locations:
+        # get neighbors use
+        for location in nearby_locations:
 
-                # don't worry about these locations
-                if location.use_invalid or location.use_deleted:
-                    continue
+            # don't worry about these locations
+            if location.use_invalid or location.use_deleted:
+                continue
 
-                if location.use_validation:
-                    use_validation += 1
-                else:
-                    use_training += 1
+            if location.use_validation:
+                use_validation += 1
+            else:
+                use_training += 1
+
+        self.apply_neighbor_use(use_validation, use_training, len(nearby_locations))
 
+    def apply_neighbor_use(self, use_validation, use_training, total):
+        """
+        Applies the use of neighboring samples to this sample, see check_neighbor_use.
+
+        :param use_validation: number of valid neighbors used for validation
+        :param use_training: number of valid neighbors used for training
+        :param total: number of neighbors including invalid and deleted ones
+        :return: None
+        """
+        # if there are nearby locations
+        if total > 0:
             # check if there is a mix of uses nearby
-            if abs(use_training - use_validation) == len(nearby_locations):
+            if abs(use_training - use_validation) == total:
                 # apply the use to this sample
                 self.use_validation = use_validation > use_training
 
@@ -168,12 +183,92 @@ class Location(BaseModel):
         assert abs(lat) < 90, 'lat exceeds bounds'
         assert abs(lon) < 180, 'lon exceeds bounds'
 
-        # TODO paramterize
-        sql = "select * from (SELECT * FROM location WHERE abs(lon - %f) < %f and abs(lat - %f) < %f) as pt where st_distance_sphere(st_makepoint(pt.lon, pt.lat), st_makepoint(%f,%f)) " % (
-        float(lon), 0.1, float(lat), 0.1, float(lon), float(lat))
-        sql += "< %d " % meters
+        # spherical distance like st_distance_sphere so the gist index on geog can be used
+        sql = text("SELECT * FROM location WHERE ST_DWithin(geog, "
+                   "ST_SetSRID(ST_MakePoint(:lon, :lat), 4326)::geography, :meters, false)")
+
+        return db.session.query(Location).from_statement(sql)\
+            .params(lat=float(lat), lon=float(lon), meters=float(meters)).all()
+
+    @classmethod
+    def create_many(cls, rows, threshold=1000):
+        """
+        Creates many locations at once with the same neighbor use as creating and flushing
+        them one at a time in order.
+
+        Neighbors already in the database are counted for the whole batch with a single
+        spatial join. Neighbors within the batch are found with a kd-tree and each location
+        only sees those before it.
+
+        :param rows: list of dicts of Location arguments, each with lat and lon
+        :param threshold: Integer in meters
+        :return: list of Location added to the session
+        """
+        assert threshold > 0
+
+        locations = [cls(check_neighbors=False, **row) for row in rows]
+        if not locations:
+            return locations
+
+        lats = [location.lat for location in locations]
+        lons = [location.lon for location in locations]
 
-        return db.session.query(Location).from_statement(text(sql)).all()
+        existing = cls.count_neighbor_use(lats, lons, threshold)
+        batch = neighbors_within(lats, lons, threshold)
+
+        for i, location in enumerate(locations):
+            use_validation, use_training, total = existing.get(i, (0, 0, 0))
+
+            for j in batch[i]:
+                if j >= i:
+                    continue
+
+                total += 1
+                neighbor = locations[j]
+
+                # don't worry about these locations
+                if neighbor.use_invalid or neighbor.use_deleted:
+                    continue
+
+                if neighbor.use_validation:
+                    use_validation += 1
+                else:
+                    use_training += 1
+
+            location.apply_neighbor_use(use_validation, use_training, total)
+
+        db.session.add_all(locations)
+        return locations
+
+    @classmethod
+    def count_neighbor_use(cls, lats, lons, meters):
+        """
+        Counts the use of existing locations within a radius of each lat lon pair.
+        :param lats: list of floats
+        :param lons: list of floats
+        :param meters: radius
+        :return: dict of index to tuple of validation, training and total counts
+        """
+        sql = text("""
+            SELECT pt.i AS i,
+                   sum(CASE WHEN coalesce(l.use_invalid, false) OR coalesce(l.use_deleted, false)
+                            THEN 0 WHEN l.use_validation THEN 1 ELSE 0 END) AS use_validation,
+                   sum(CASE WHEN coalesce(l.use_invalid, false) OR coalesce(l.use_deleted, false)
+                            THEN 0 WHEN l.use_validation THEN 0 ELSE 1 END) AS use_training,
+                   count(*) AS total
+            FROM unnest(CAST(:i AS integer[]), CAST(:lats AS double precision[]),
+                        CAST(:lons AS double precision[])) AS pt(i, lat, lon)
+            JOIN location l
+              ON ST_DWithin(l.geog, ST_SetSRID(ST_MakePoint(pt.lon, pt.lat), 4326)::geography,
+                            :meters, false)
+            GROUP BY pt.i
+            """)
+
+        result = db.session.execute(sql, {'i': range(len(lats)), 'lats': list(lats),
+                                          'lons': list(lons), 'meters': float(meters)})
+
+        return dict((row['i'], (row['use_validation'], row['use_training'], row['total']))
+                    for row in result)
 
     def offset(self, bearing, meters):
         """
@@ -187,6 +282,33 @@ class Location(BaseModel):
         self.lat, self.lon = get_destination(self.lat, self.lon, bearing, km)
 
 
+# geography point kept in sync with lat lon by postgres, it is not mapped so the api never sees it
+GEOGRAPHY_SQL = """
+    ALTER TABLE location ADD COLUMN geog geography(Point, 4326);
+
+    CREATE INDEX ix_location_geog ON location USING gist (geog);
+
+    CREATE OR REPLACE FUNCTION location_set_geog()
+        RETURNS trigger
+        AS
+        $location_set_geog$
+        BEGIN
+            NEW.geog := ST_SetSRID(ST_MakePoint(NEW.lon, NEW.lat), 4326)::geography;
+            RETURN NEW;
+        END;
+        $location_set_geog$
+        LANGUAGE plpgsql;
+
+    CREATE TRIGGER location_geog_trigger
+        BEFORE INSERT OR UPDATE OF lat, lon ON location
+        FOR EACH ROW
+        EXECUTE PROCEDURE location_set_geog();
+    """
+
+event.listen(Location.__table__, 'after_create',
+             DDL(GEOGRAPHY_SQL).execute_if(dialect='postgresql'))
+
+
 class Image(BaseModel):
     __tablename__ = 'image'
     id = db.Column(db.Integer, primary_key=True)
@@ -209,6 +331,11 @@ class Image(BaseModel):
 
     url = db.Column(db.String, unique=True, nullable=False)
     copyright = db.Column(db.String)
+
+    # uploads are pending until tasks.images.process_image has stored them at url
+    STATUS_CHOICES = ['pending', 'ready', 'failed']
+    status = db.Column(db.String, default='ready', server_default='ready', nullable=False,
+                       index=True)
     image_type = db.Column(db.String, index=True)
 
     date_modified = db.Column(db.DateTime, default=db.func.now(), onupdate=db.func.now())
@@ -1,4 +1,5 @@
 from werkzeug.exceptions import BadRequest
+from croplands_api import cache
 from croplands_api.models import db
 from croplands_api.models.base import BaseModel
 from sqlalchemy.orm import relationship, foreign
@@ -6,6 +7,9 @@ from sqlalchemy import ForeignKey, UniqueConstraint, CheckConstraint, and_, func
 from sqlalchemy.dialects import postgresql
 from location import Image
 from hashlib import sha256
+from itertools import chain
+
+RECORD_COUNT_CACHE_KEY = 'data_count_total'
 
 
 class Record(BaseModel):
@@ -50,6 +54,12 @@ class Record(BaseModel):
     ndvi = db.Column(postgresql.ARRAY(db.Integer))
     ndvi_mean = db.Column(db.Integer, index=True)
 
+    # when the series was last fetched, if it covered the whole year and when a refresh
+    # was last dispatched, see tasks.records.refresh_ndvi
+    ndvi_updated = db.Column(db.DateTime, index=True)
+    ndvi_complete = db.Column(db.Boolean, default=False)
+    ndvi_requested = db.Column(db.DateTime)
+
     # fields that vary by year
     land_use_type = db.Column(db.Integer, default=0, index=True)
     intensity = db.Column(db.Integer, default=0, index=True)
@@ -69,6 +79,10 @@ class Record(BaseModel):
 
     scale = db.Column(db.Integer, default=-1)
 
+    # uniform random value fixed when the record is created, indexed on record_search so
+    # random samples are a range scan, see views.data.sample
+    random_key = db.Column(db.Float, server_default=db.text('random()'), nullable=False)
+
     # sub models
     history = relationship("RecordHistory", cascade="all, delete-orphan")
     ratings = relationship("RecordRating", cascade="all, delete-orphan")
@@ -120,4 +134,22 @@ class RecordRating(BaseModel):
     # partner: -5 to 5
     # team: -10 to 10
     rating = db.Column(db.Integer, nullable=False)
-    stale = db.Column(db.BOOLEAN, default=False)
\ No newline at end of file
+    stale = db.Column(db.BOOLEAN, default=False)
+
+
+@event.listens_for(db.session, 'after_flush')
+def flag_record_count(session, flush_context):
+    """
+    Notes that the number of records changed in this transaction.
+    """
+    if any(isinstance(obj, Record) for obj in chain(session.new, session.deleted)):
+        session.info['record_count_changed'] = True
+
+
+@event.listens_for(db.session, 'after_commit')
+def invalidate_record_count(session):
+    """
+    Drops the cached record count once inserts or deletes are committed.
+    """
+    if session.info.pop('record_count_changed', False):
+        cache.delete(RECORD_COUNT_CACHE_KEY)
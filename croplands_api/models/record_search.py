@@ -0,0 +1,211 @@
+from croplands_api.models import db
+from croplands_api.models.base import BaseModel
+from sqlalchemy import ForeignKey, Index, DDL, event, func, cast, literal_column
+from sqlalchemy.dialects import postgresql
+
+# ndvi composites per season in the envelope, 23 composites make 4 buckets
+NDVI_ENVELOPE_BUCKET = 6
+NDVI_ENVELOPE_BUCKETS = 4
+
+# envelope values of a bucket without data, inside any query box so never pruned
+NDVI_ENVELOPE_EMPTY_MIN = 32767
+NDVI_ENVELOPE_EMPTY_MAX = -32768
+NDVI_ENVELOPE_UNBOUNDED = 1e9
+
+
+class RecordSearch(BaseModel):
+    """
+    Denormalized copy of each record joined to its location holding the columns the data
+    api filters on and exports. Rows are maintained by triggers on record and location and
+    should never be written by the application.
+    """
+    __tablename__ = 'record_search'
+    __table_args__ = (
+        Index('ix_record_search_country_land_use_type_year', 'country', 'land_use_type', 'year'),
+        Index('ix_record_search_crop_primary_lat_lon', 'crop_primary', 'lat', 'lon'),
+        Index('ix_record_search_lat_lon_brin', 'lat', 'lon', postgresql_using='brin'),
+    )
+
+    id = db.Column(db.Integer, ForeignKey('record.id', ondelete='CASCADE'), primary_key=True)
+    location_id = db.Column(db.Integer, ForeignKey('location.id', ondelete='CASCADE'),
+                            index=True, nullable=False)
+
+    # record
+    year = db.Column(db.Integer, nullable=False, index=True)
+    month = db.Column(db.Integer)
+    land_use_type = db.Column(db.Integer, index=True)
+    crop_primary = db.Column(db.Integer)
+    crop_secondary = db.Column(db.Integer, index=True)
+    water = db.Column(db.Integer, index=True)
+    intensity = db.Column(db.Integer, index=True)
+    source_type = db.Column(db.String, index=True)
+    source_class = db.Column(db.String)
+    source_description = db.Column(db.String)
+    ndvi = db.Column(postgresql.ARRAY(db.Integer))
+    date_created = db.Column(db.DateTime, index=True)
+    random_key = db.Column(db.Float, index=True)
+
+    # location
+    lat = db.Column(db.Float, nullable=False)
+    lon = db.Column(db.Float, nullable=False)
+    country = db.Column(db.String)
+    use_validation = db.Column(db.Boolean, index=True)
+
+    @classmethod
+    def ndvi_envelope_filter(cls, upper, lower):
+        """
+        Index backed filter that prunes records which cannot pass array_bounds(ndvi, upper,
+        lower). Each record stores the min and max ndvi of every season bucket in the
+        unmapped ndvi_envelope cube column. A series within the bounds has every bucket min
+        at or above the lowest lower bound of the bucket and every bucket max at or below
+        the highest upper bound, so the envelope must lie inside that box. The exact
+        array_bounds check is still needed afterwards.
+        :param upper: list of 23 ints
+        :param lower: list of 23 ints
+        :return: sqlalchemy expression
+        """
+        def buckets(values):
+            return [values[i:i + NDVI_ENVELOPE_BUCKET]
+                    for i in range(0, NDVI_ENVELOPE_BUCKET * NDVI_ENVELOPE_BUCKETS,
+                                   NDVI_ENVELOPE_BUCKET)]
+
+        low = [float(min(b)) for b in buckets(lower)] + \
+              [-NDVI_ENVELOPE_UNBOUNDED] * NDVI_ENVELOPE_BUCKETS
+        high = [NDVI_ENVELOPE_UNBOUNDED] * NDVI_ENVELOPE_BUCKETS + \
+               [float(max(b)) for b in buckets(upper)]
+
+        box = func.cube(cast(low, postgresql.ARRAY(db.Float)),
+                        cast(high, postgresql.ARRAY(db.Float)))
+        return literal_column('record_search.ndvi_envelope').op('<@')(box)
+
+    @classmethod
+    def rebuild(cls):
+        """
+        Replaces all rows from record and location. Only needed if the triggers were bypassed.
+        :return: None
+        """
+        db.session.execute(REBUILD_SQL)
+        db.session.commit()
+
+
+REBUILD_SQL = """
+    TRUNCATE record_search;
+    INSERT INTO record_search (id, location_id, year, month, land_use_type, crop_primary,
+                               crop_secondary, water, intensity, source_type, source_class,
+                               source_description, ndvi, date_created, random_key,
+                               lat, lon, country, use_validation)
+    SELECT r.id, r.location_id, r.year, r.month, r.land_use_type, r.crop_primary,
+           r.crop_secondary, r.water, r.intensity, r.source_type, r.source_class,
+           r.source_description, r.ndvi, r.date_created, r.random_key,
+           l.lat, l.lon, l.country, l.use_validation
+    FROM record r
+    JOIN location l ON l.id = r.location_id;
+    """
+
+# deletes cascade through the foreign keys, inserts and updates of the copied columns are
+# copied by these triggers
+TRIGGERS_SQL = """
+    CREATE OR REPLACE FUNCTION record_search_sync_record()
+        RETURNS trigger
+        AS
+        $record_search_sync_record$
+        BEGIN
+            DELETE FROM record_search WHERE id = NEW.id;
+            INSERT INTO record_search (id, location_id, year, month, land_use_type,
+                                       crop_primary, crop_secondary, water, intensity,
+                                       source_type, source_class, source_description, ndvi,
+                                       date_created, random_key, lat, lon, country,
+                                       use_validation)
+            SELECT NEW.id, NEW.location_id, NEW.year, NEW.month, NEW.land_use_type,
+                   NEW.crop_primary, NEW.crop_secondary, NEW.water, NEW.intensity,
+                   NEW.source_type, NEW.source_class, NEW.source_description, NEW.ndvi,
+                   NEW.date_created, NEW.random_key, l.lat, l.lon, l.country, l.use_validation
+            FROM location l WHERE l.id = NEW.location_id;
+            RETURN NULL;
+        END;
+        $record_search_sync_record$
+        LANGUAGE plpgsql;
+
+    CREATE TRIGGER record_search_record_trigger
+        AFTER INSERT OR UPDATE OF location_id, year, month, land_use_type, crop_primary,
+                                  crop_secondary, water, intensity, source_type,
+                                  source_class, source_description, ndvi, date_created
+        ON record
+        FOR EACH ROW
+        EXECUTE PROCEDURE record_search_sync_record();
+
+    CREATE OR REPLACE FUNCTION record_search_sync_location()
+        RETURNS trigger
+        AS
+        $record_search_sync_location$
+        BEGIN
+            UPDATE record_search
+            SET lat = NEW.lat, lon = NEW.lon, country = NEW.country,
+                use_validation = NEW.use_validation
+            WHERE location_id = NEW.id;
+            RETURN NULL;
+        END;
+        $record_search_sync_location$
+        LANGUAGE plpgsql;
+
+    CREATE TRIGGER record_search_location_trigger
+        AFTER UPDATE OF lat, lon, country, use_validation ON location
+        FOR EACH ROW
+        EXECUTE PROCEDURE record_search_sync_location();
+    """
+
+DROP_TRIGGERS_SQL = """
+    DROP TRIGGER IF EXISTS record_search_record_trigger ON record;
+    DROP TRIGGER IF EXISTS record_search_location_trigger ON location;
+    """
+
+# min and max of each season bucket of ndvi, the first NDVI_ENVELOPE_BUCKETS dimensions are
+# minimums and the rest maximums
+NDVI_ENVELOPE_SQL = """
+    CREATE EXTENSION IF NOT EXISTS cube;
+
+    ALTER TABLE record_search ADD COLUMN ndvi_envelope cube;
+
+    CREATE INDEX ix_record_search_ndvi_envelope ON record_search USING gist (ndvi_envelope);
+
+    CREATE OR REPLACE FUNCTION ndvi_envelope(ndvi integer[])
+        RETURNS cube
+        AS
+        $ndvi_envelope$
+            SELECT cube(array_agg(s.low ORDER BY s.bucket) || array_agg(s.high ORDER BY s.bucket))
+            FROM (
+                SELECT b.bucket,
+                       CAST(coalesce(min(t.value), %(empty_min)d) AS float8) AS low,
+                       CAST(coalesce(max(t.value), %(empty_max)d) AS float8) AS high
+                FROM generate_series(0, %(buckets)d - 1) AS b (bucket)
+                LEFT JOIN unnest(ndvi) WITH ORDINALITY AS t (value, i)
+                    ON (t.i - 1) / %(bucket)d = b.bucket
+                GROUP BY b.bucket
+            ) s
+        $ndvi_envelope$
+        LANGUAGE sql IMMUTABLE;
+
+    CREATE OR REPLACE FUNCTION record_search_set_ndvi_envelope()
+        RETURNS trigger
+        AS
+        $record_search_set_ndvi_envelope$
+        BEGIN
+            NEW.ndvi_envelope := ndvi_envelope(NEW.ndvi);
+            RETURN NEW;
+        END;
+        $record_search_set_ndvi_envelope$
+        LANGUAGE plpgsql;
+
+    CREATE TRIGGER record_search_ndvi_envelope_trigger
+        BEFORE INSERT OR UPDATE OF ndvi ON record_search
+        FOR EACH ROW
+        EXECUTE PROCEDURE record_search_set_ndvi_envelope();
+    """ % {'buckets': NDVI_ENVELOPE_BUCKETS, 'bucket': NDVI_ENVELOPE_BUCKET,
+           'empty_min': NDVI_ENVELOPE_EMPTY_MIN, 'empty_max': NDVI_ENVELOPE_EMPTY_MAX}
+
+event.listen(RecordSearch.__table__, 'after_create',
+             DDL(TRIGGERS_SQL).execute_if(dialect='postgresql'))
+event.listen(RecordSearch.__table__, 'after_create',
+             DDL(NDVI_ENVELOPE_SQL).execute_if(dialect='postgresql'))
+event.listen(RecordSearch.__table__, 'before_drop',
+             DDL(DROP_TRIGGERS_SQL).execute_if(dialect='postgresql'))
@@ -1,11 +1,11 @@
 from croplands_api import celery
 from croplands_api.models import db, Image
-import StringIO
 import datetime
-import csv
 from flask import json
-from croplands_api.utils.s3 import upload_file_to_s3
+from croplands_api.utils.s3 import upload_stream_to_s3
+from croplands_api.utils.csv_encoder import encode_rows
 from croplands_api.utils.misc import strftime
+from croplands_api.utils.exports import incremental_export
 
 @celery.task
 def compute_image_classification_statistics(image_id):
@@ -32,8 +32,100 @@ def compute_image_classification_statistics(image_id):
     db.session.commit()
 
 
+CLASSIFICATIONS_FINGERPRINT = """
+    SELECT 'all', count(*), sum(image.classifications_count), max(image.id),
+           max(image.date_modified), max(location.date_edited)
+    FROM image
+    JOIN location on image.location_id = location.id
+    WHERE image.classifications_count > 0 and image.source = 'VHRI'
+    """
+
+
 @celery.task(rate_limit="6/h")
-def build_classifications_result():
+def build_classifications_result(force=False):
+    """
+    Uploads the classification csv and json files when classified images changed since the
+    last build.
+    :param force: rebuild even if nothing changed
+    :return: list of partitions built
+    """
+    return incremental_export('classifications', CLASSIFICATIONS_FINGERPRINT,
+                              upload_classifications_result, force=force)
+
+
+CLASSIFICATIONS_COLUMNS = ['id', 'lat', 'lon', 'country', 'classifications_count',
+                           'classifications_majority_class',
+                           'classifications_majority_agreement', 'date_acquired',
+                           'date_acquired_earliest', 'date_acquired_latest', 'url',
+                           'use_validation']
+
+CLASSIFICATIONS_QUERY = """
+      SELECT
+      image.id,
+      location.lat,
+      location.lon,
+      location.country,
+      image.classifications_count,
+      image.classifications_majority_class,
+      image.classifications_majority_agreement,
+      image.date_acquired,
+      image.date_acquired_earliest,
+      image.date_acquired_latest,
+      image.url,
+      location.use_validation
+
+      FROM image
+      JOIN location on image.location_id = location.id
+      WHERE image.classifications_count > 0 and image.source = 'VHRI'
+      """
+
+
+def classification_rows(training=False):
+    """
+    Streams classified images from a server side cursor.
+    :param training: only images that are not held back for validation
+    :return: generator of lists in the order of CLASSIFICATIONS_COLUMNS
+    """
+    cmd = CLASSIFICATIONS_QUERY
+    if training:
+        cmd += " and location.use_validation IS NOT TRUE"
+
+    connection = db.engine.connect().execution_options(stream_results=True)
+    try:
+        for row in connection.execute(cmd):
+            yield [
+                row['id'],
+                row['lat'], row['lon'], row['country'],
+                row['classifications_count'],
+                row['classifications_majority_class'],
+                row['classifications_majority_agreement'],
+                strftime(row['date_acquired']),
+                strftime(row['date_acquired_earliest']),
+                strftime(row['date_acquired_latest']),
+                "http://images.croplands.org" + row['url'].replace("images",""),
+                row['use_validation']
+            ]
+    finally:
+        connection.close()
+
+
+def classifications_json(rows, meta):
+    """
+    Encodes rows as a json document one row at a time. The count is only known at the end
+    so num_results is the last key.
+    :param rows: iterable of lists
+    :param meta: dict
+    :return: generator of strings
+    """
+    yield '{"meta": %s, "objects": [' % json.dumps(meta)
+    count = 0
+    for row in rows:
+        yield (', ' if count else '') + json.dumps(row)
+        count += 1
+    yield '], "num_results": %d}' % count
+
+
+def upload_classifications_result(partition='all'):
     LICENSE = """This data is made available under the Open Database License:
     http://opendatacommons.org/licenses/odbl/1.0/. Any rights in individual
     contents of the database are licensed under the Database Contents License:
@@ -47,99 +139,27 @@ def build_classifications_result():
         {'id': 3, 'order': 3, 'label': 'Not Cropland'},
         {'id': 4, 'order': 4, 'label': 'Maybe Cropland'}
     ]
-    cmd = """
-          SELECT
-          image.id,
-          location.lat,
-          location.lon,
-          location.country,
-          image.classifications_count,
-          image.classifications_majority_class,
-          image.classifications_majority_agreement,
-          image.date_acquired,
-          image.date_acquired_earliest,
-          image.date_acquired_latest,
-          image.url,
-          location.use_validation
-
-          FROM image
-          JOIN location on image.location_id = location.id
-          WHERE image.classifications_count > 0 and image.source = 'VHRI'
-          """
-
-    result = db.engine.execute(cmd)
-    columns = result.keys()
-    print(columns)
-
-    training = []
-    all_data = []
-    for row in result:
-        data = [
-            row['id'],
-            row['lat'], row['lon'], row['country'],
-            row['classifications_count'],
-            row['classifications_majority_class'],
-            row['classifications_majority_agreement'],
-            strftime(row['date_acquired']),
-            strftime(row['date_acquired_earliest']),
-            strftime(row['date_acquired_latest']),
-            "http://images.croplands.org" + row['url'].replace("images",""),
-            row['use_validation']
-        ]
-
-        if not row['use_validation']:
-            training.append(data)
-
-        all_data.append(data)
-    print("length: ", len(all_data))
-    training_content = {
-        'num_results': len(training),
-        'meta': {
-            'created': datetime.datetime.utcnow().isoformat(),
-            'columns': columns,
-            'class_mapping': [c['label'] for c in classes],
-            'license': LICENSE,
-            'attribution': ATTRIBUTION
-        },
-        'objects': training
-    }
 
-    all_data_content = {
-        'num_results': len(all_data),
-        'meta': {
-            'created': datetime.datetime.utcnow().isoformat(),
-            'columns': columns,
-            'class_mapping': [c['label'] for c in classes],
-            'license': LICENSE,
-            'attribution': ATTRIBUTION
-        },
-        'objects': all_data
+    meta = {
+        'created': datetime.datetime.utcnow().isoformat(),
+        'columns': CLASSIFICATIONS_COLUMNS,
+        'class_mapping': [c['label'] for c in classes],
+        'license': LICENSE,
+        'attribution': ATTRIBUTION
     }
 
-    # make csv file
-    csv_file_training = StringIO.StringIO()
-    csv_file_all_data = StringIO.StringIO()
-
-    writer = csv.writer(csv_file_training)
-    writer.writerow(columns)
-    for row in training:
-        writer.writerow(row)
-
-    upload_file_to_s3(csv_file_training.getvalue(), '/public/csv/classifications.csv',
-                      'text/csv; charset=utf-8; header=present')
-
-    writer = csv.writer(csv_file_all_data)
-    writer.writerow(columns)
-    for row in all_data:
-        writer.writerow(row)
+    # each file is a separate pass over the images so no file is ever held in memory
+    upload_stream_to_s3(encode_rows(classification_rows(training=True),
+                                    headers=CLASSIFICATIONS_COLUMNS),
+                        '/public/csv/classifications.csv',
+                        'text/csv; charset=utf-8; header=present')
 
-    upload_file_to_s3(csv_file_all_data.getvalue(), '/public/csv/classifications_all.csv',
-                      'text/csv; charset=utf-8; header=present')
+    upload_stream_to_s3(encode_rows(classification_rows(), headers=CLASSIFICATIONS_COLUMNS),
+                        '/public/csv/classifications_all.csv',
+                        'text/csv; charset=utf-8; header=present')
 
-    # upload to s3
-    upload_file_to_s3(json.dumps(training_content), '/public/json/classifications.json',
-                      'application/javascript')
+    upload_stream_to_s3(classifications_json(classification_rows(training=True), meta),
+                        '/public/json/classifications.json', 'application/javascript')
 
-    # upload to s3
-    upload_file_to_s3(json.dumps(all_data_content), '/public/json/classifications_all.json',
-                      'application/javascript')
+    upload_stream_to_s3(classifications_json(classification_rows(), meta),
+                        '/public/json/classifications_all.json', 'application/javascript')
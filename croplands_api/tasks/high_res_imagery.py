@@ -3,14 +3,15 @@ from flask import current_app
 import StringIO
 import requests
 from PIL import Image as Img
-import boto
-from boto.s3.key import Key
 from bs4 import BeautifulSoup
 from pyproj import Proj, transform as _transform
 from croplands_api.models import Image, db, Location
+from croplands_api.exceptions import TileNotFound
+from croplands_api.utils.storage import get_storage
+from croplands_api.utils.tile_cache import Tile, cached_tile, tile_key, http_session
 import datetime
 from croplands_api.utils.geo import (
-    distance,
+    spaced_along,
     decode_google_polyline,
     calculate_plane_perpendicular_to_travel,
     get_destination,
@@ -19,13 +20,17 @@ from croplands_api.utils.geo import (
 import uuid
 from flask import json
 import random
+import os
 
 from multiprocessing.pool import ThreadPool
 
+_pools = {}
+
 
 def _build_dg_url(x, y, zoom, connect_id, request="GetTile",
                   layer="DigitalGlobe:ImageryTileService",
-                  profile="Consumer_Profile"):
+                  profile="Consumer_Profile",
+                  base_url="https://evwhs.digitalglobe.com/earthservice/wmtsaccess"):
     """
     Function builds a url for use with Digital Globe Enhanced View
     :param x: tile col
@@ -35,10 +40,11 @@ def _build_dg_url(x, y, zoom, connect_id, request="GetTile",
     :param request: wmts request type
     :param layer:
     :param profile: https://www.digitalglobe.com/sites/default/files/dgcs/DGCS_DeveloperGuide_WMTS.pdf
+    :param base_url: wmts endpoint
     :return: url
     """
 
-    url = "https://evwhs.digitalglobe.com/earthservice/wmtsaccess?connectid=%s" % connect_id
+    url = "%s?connectid=%s" % (base_url, connect_id)
     url += "&request=%s" % request
     url += "&version=1.0.0&LAYER=%s&FORMAT=image/jpeg" % layer
     url += "&TileRow=%d&TileCol=%d&TileMatrixSet=EPSG:3857&TileMatrix=EPSG:3857:%d" % (y, x, zoom)
@@ -85,8 +91,44 @@ def get_image_data(img):
         }
 
 
-def download_image(x, y, zoom, profile):
-    url = _build_dg_url(x, y, zoom, profile)
+def download_tile(x, y, zoom, profile="MyDG_Color_Consumer_Profile",
+                  layer="DigitalGlobe:ImageryTileService"):
+    """
+    Returns a Digital Globe tile from the tile cache, downloading it on a miss. Tiles are
+    shared by the mosaics of nearby locations so a bulk run downloads each one once.
+    Blank tiles, which the service returns as a few hundred bytes, are not cached.
+    :param x: tile col
+    :param y: tile row
+    :param zoom: zoom level
+    :param profile: feature profile
+    :param layer:
+    :return: Tile
+    """
+    def fetch():
+        url = _build_dg_url(x, y, zoom, current_app.config['DG_EV_CONNECT_ID'], layer=layer,
+                            profile=profile, base_url=current_app.config['DG_EV_URL'])
+        response = http_session().get(url, auth=(current_app.config['DG_EV_USERNAME'],
+                                                 current_app.config['DG_EV_PASSWORD']),
+                                      timeout=30)
+        if response.status_code != 200 or len(response.content) < 1000:
+            raise TileNotFound(error='Tile Not Found',
+                               description='Tile %d/%d/%d is not available.' % (zoom, x, y),
+                               status_code=404 if response.status_code in (200, 404) else 502)
+        return Tile(response.content, response.headers.get('content-type', 'image/jpeg'))
+
+    return cached_tile(tile_key('digitalglobe', profile, layer, zoom, x, y), fetch)
+
+
+def _download_pool():
+    """
+    Thread pool kept for the life of the worker process so the keep-alive session of each
+    thread is reused by every mosaic.
+    """
+    pid = os.getpid()
+    if pid not in _pools:
+        _pools.clear()
+        _pools[pid] = ThreadPool(current_app.config['VHRI_TILE_MAX_THREADS'])
+    return _pools[pid]
 
 
 @celery.task(rate_limit="20/m")
@@ -103,41 +145,31 @@ def get_image(lat, lon, zoom, location_id=None, layer="DigitalGlobe:ImageryTileS
     # convert lat lon to tile
     x, y = degree_to_tile_number(lat, lon, zoom)
 
-    # build url
-    url = _build_dg_url(x, y, zoom, current_app.config['DG_EV_CONNECT_ID'],
-                        profile=profile)
-
-    # get tile
-    auth = current_app.config['DG_EV_USERNAME'], current_app.config['DG_EV_PASSWORD']
-    id = current_app.config['DG_EV_CONNECT_ID']
-
     m, n = 5,5
     mosaic = Img.new('RGB', (256 * m, 256 * n))
 
     tile_matrix = [[None for i in range(m)] for j in range(n)]
+    app = current_app._get_current_object()
 
     def download(args):
         i, j = args
-        img_url = _build_dg_url(x + i - m/2, y + j - n/2, zoom, id, profile=profile)
-        r = requests.get(img_url, auth=auth)
-
-        if r.status_code != 200 or int(r.headers['content-length']) < 1000:
-            if int(r.headers['content-length']) > 1000:
-                print(r.text)
-            return False
+        with app.app_context():
+            try:
+                content = download_tile(x + i - m/2, y + j - n/2, zoom, profile=profile,
+                                        layer=layer).content
+            except Exception as e:
+                print(e)
+                return False
 
-        f = StringIO.StringIO(r.content)
-        tile = Img.open(f)
+        tile = Img.open(StringIO.StringIO(content))
 
         mosaic.paste(tile, (i * 256, j * 256))
         tile_matrix[i][j] = {'tile': tile, 'data': get_image_data(tile)}
         return True
 
-    pool = ThreadPool(min(current_app.config.get('VHRI_TILE_MAX_THREADS'), m * n))
-    results = pool.map(download,
-                       [(i, j) for i, row in enumerate(tile_matrix) for j, col in enumerate(row)])
-    pool.close()
-    pool.join()
+    results = _download_pool().map(download,
+                                   [(i, j) for i, row in enumerate(tile_matrix)
+                                    for j, col in enumerate(row)])
 
     if sum(results) < m * n:
         print('some tiles failed to download')
@@ -202,21 +234,10 @@ def get_image(lat, lon, zoom, location_id=None, layer="DigitalGlobe:ImageryTileS
     db.session.add(image)
 
     # save image to s3
-    gs = boto.connect_gs(current_app.config['GS_ACCESS_KEY'],
-                         current_app.config['GS_SECRET'])
-
-    # Get bucket
-    bucket = gs.get_bucket(current_app.config['BUCKET'])
-
-    cache_control = 'max-age=2000000'
-    content_type = 'image/jpeg'
-
-    s3_file = Key(bucket)
-    s3_file.key = data['url']
-    s3_file.set_metadata('cache-control', cache_control)
-    s3_file.set_metadata('content-type', content_type)
-    s3_file.set_contents_from_string(out.getvalue())
-    s3_file.make_public()
+    get_storage().put(data['url'], out.getvalue(),
+                      metadata={'cache-control': 'max-age=2000000',
+                                'content-type': 'image/jpeg'},
+                      public=True)
 
     # save information to database
     db.session.commit()
@@ -285,18 +306,16 @@ def get_directions(origin_lat, origin_lon, destination_lat, destination_lon):
                 "coordinates": []
             }]
     }
-    previous = polyline[0]
-    for i in range(1, len(polyline) - 1):
-        if distance(previous[0], previous[1], polyline[i][0], polyline[i][1]) > 2000:
-            bearing = calculate_plane_perpendicular_to_travel(polyline[i - 1], polyline[i],
-                                                              polyline[i + 1])
-            if random.choice([True, False]):
-                bearing += 180
-
-            offset = get_destination(polyline[i][0], polyline[i][1], bearing, 0.05)  # km
-            geo_json['geometries'][1]['coordinates'].append([offset[1], offset[0]])
-            previous = polyline[i]
-            has_street_view_image(polyline[i][0], polyline[i][1], bearing)
+    # a point every 2km driven
+    for i in spaced_along([pt[0] for pt in polyline], [pt[1] for pt in polyline], 2000):
+        bearing = calculate_plane_perpendicular_to_travel(polyline[i - 1], polyline[i],
+                                                          polyline[i + 1])
+        if random.choice([True, False]):
+            bearing += 180
+
+        offset = get_destination(polyline[i][0], polyline[i][1], bearing, 0.05)  # km
+        geo_json['geometries'][1]['coordinates'].append([offset[1], offset[0]])
+        has_street_view_image(polyline[i][0], polyline[i][1], bearing)
 
     print json.dumps(geo_json)
 
@@ -326,18 +345,6 @@ def get_street_view_coverage(x, y, z=21):
     img = Img.open(f)
 
     # save image to s3
-    gs = boto.connect_gs(current_app.config['GS_ACCESS_KEY'],
-                         current_app.config['GS_SECRET'])
-
-    # Get bucket
-    bucket = gs.get_bucket(current_app.config['BUCKET'])
-
-    cache_control = 'max-age=200'
-    content_type = 'image/png'
-
-    s3_file = Key(bucket)
-    s3_file.key = 'temp/google_street_view_tiles/%d/%d/%d.PNG' % (z, x, y)
-    s3_file.set_metadata('cache-control', cache_control)
-    s3_file.set_metadata('content-type', content_type)
-    s3_file.set_contents_from_string(f.getvalue())
-    s3_file.make_public()
\ No newline at end of file
+    get_storage().put('temp/google_street_view_tiles/%d/%d/%d.PNG' % (z, x, y), f.getvalue(),
+                      metadata={'cache-control': 'max-age=200', 'content-type': 'image/png'},
+                      public=True)
\ No newline at end of file
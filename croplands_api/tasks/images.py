@@ -0,0 +1,127 @@
+from croplands_api import celery
+from flask import current_app
+from croplands_api.models import db, Image
+from croplands_api.utils.s3 import upload_image
+from croplands_api.utils.storage import get_storage
+import requests
+import cStringIO
+import uuid
+
+
+def raw_image_key(url):
+    """
+    Key the original of an uploaded image is kept under until it is processed.
+    :param url: key of the processed image
+    :return: String
+    """
+    return 'raw/' + url
+
+
+def store_raw_image(contents, url):
+    """
+    Stores the original bytes of an upload so the request can return before processing.
+    :param contents: String
+    :param url: key of the processed image
+    :return: None
+    """
+    get_storage().put(raw_image_key(url), contents)
+
+
+def queue_image(image_id):
+    """
+    Queues processing of a pending image. The request does not fail if the broker is down,
+    requeue_pending_images picks the image up later.
+    :param image_id: int
+    :return: None
+    """
+    try:
+        process_image.delay(image_id)
+    except Exception as e:
+        print e
+
+
+@celery.task(rate_limit="60/m")
+def process_image(image_id):
+    """
+    Shrinks and re-encodes a pending image, uploads it and marks it ready. Uploads are read
+    from raw storage, images posted with a remote url, e.g. street view, are fetched and
+    given a key in the bucket. Images that cannot be processed are marked failed and their
+    original is kept.
+    :param image_id: int
+    :return: None
+    """
+    image = Image.query.get(image_id)
+    if image is None or image.status != 'pending':
+        return
+
+    remote = image.url.startswith('http')
+    try:
+        if remote:
+            response = requests.get(image.url, timeout=30)
+            response.raise_for_status()
+            contents = response.content
+            url = 'images/streetview/' + str(uuid.uuid4()) + '.jpg'
+        else:
+            contents = get_storage().get(raw_image_key(image.url))
+            if contents is None:
+                raise IOError('Missing original of image %d' % image_id)
+            url = image.url
+
+        upload_image(cStringIO.StringIO(contents), encoded_image=False, filename=url)
+    except Exception as e:
+        print "Processing image #%d failed: %s" % (image_id, e)
+        image.status = 'failed'
+        db.session.commit()
+        return
+
+    image.url = url
+    image.status = 'ready'
+    db.session.commit()
+
+    if not remote:
+        get_storage().delete(raw_image_key(url))
+
+
+def claim_pending_images(limit):
+    """
+    Returns the ids of up to limit images left pending for longer than
+    IMAGE_PENDING_TIMEOUT, e.g. because queueing failed or the task was lost, and touches
+    them so they are not claimed again until the timeout passes once more.
+    :param limit: maximum number of images
+    :return: list of image ids
+    """
+    result = db.session.execute(
+        """
+        UPDATE image SET date_modified = now()
+        WHERE id IN (
+            SELECT id FROM image
+            WHERE status = 'pending'
+              AND date_modified < now() - :timeout * interval '1 second'
+            ORDER BY date_modified
+            LIMIT :limit
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING id
+        """,
+        {
+            'timeout': current_app.config['IMAGE_PENDING_TIMEOUT'].total_seconds(),
+            'limit': limit
+        }
+    )
+    ids = [row[0] for row in result]
+    db.session.commit()
+    return ids
+
+
+@celery.task(time_limit=300)
+def requeue_pending_images():
+    """
+    Periodic task queueing the images that have been pending too long.
+    :return: number of images queued
+    """
+    ids = claim_pending_images(current_app.config['IMAGE_REQUEUE_LIMIT'])
+    for image_id in ids:
+        process_image.delay(image_id)
+
+    print("Requeued %d pending images" % len(ids))
+    return len(ids)
@@ -0,0 +1,130 @@
+from flask import current_app
+from croplands_api import celery, cache
+from croplands_api.exceptions import TileNotFound
+from croplands_api.utils.google.gee import ASSETS, build_cache_key, build_map, get_map, get_tile
+from croplands_api.utils.geo import degree_to_tile_number
+from multiprocessing.pool import ThreadPool
+from itertools import islice
+import time
+
+# web mercator tiles end here
+MAX_TILE_LATITUDE = 85.0511
+
+
+@celery.task(rate_limit="30/m")
+def refresh_map(map_args):
+    """
+    Rebuilds a cached map before it expires so tile requests never wait for earth engine.
+    The caller holds the map's lock, see utils.google.gee.get_map.
+    :param map_args: dict of get_map arguments
+    :return: None
+    """
+    key = build_cache_key(**map_args)
+    try:
+        map_id = build_map(**map_args)
+        cache.set(key, (time.time(), map_id), timeout=current_app.config['MAP_ID_TIMEOUT'])
+    finally:
+        cache.delete(key + '_lock')
+
+
+def region_tiles(region, zoom):
+    """
+    Tiles covering a region at a zoom.
+    :param region: tuple of south, west, north and east (decimal degrees)
+    :param zoom: int
+    :return: generator of x, y tuples
+    """
+    south, west, north, east = region
+    south = max(south, -MAX_TILE_LATITUDE)
+    north = min(north, MAX_TILE_LATITUDE)
+
+    last = 2 ** zoom - 1
+    x0, y0 = degree_to_tile_number(north, west, zoom)
+    x1, y1 = degree_to_tile_number(south, east, zoom)
+    for x in range(max(x0, 0), min(x1, last) + 1):
+        for y in range(max(y0, 0), min(y1, last) + 1):
+            yield x, y
+
+
+def prewarm_tiles(assets, zooms, regions):
+    """
+    Map arguments and tile numbers to pre-fetch, lowest zooms first since every map view
+    starts there.
+    :param assets: list of asset names
+    :param zooms: list of int
+    :param regions: list of south, west, north and east tuples
+    :return: generator of map_args, x, y, z tuples
+    """
+    for z in sorted(zooms):
+        seen = set()
+        for region in regions:
+            for x, y in region_tiles(region, z):
+                if (x, y) in seen:
+                    continue
+                seen.add((x, y))
+                for asset in assets:
+                    yield {'asset': asset}, x, y, z
+
+
+@celery.task(rate_limit="2/h", time_limit=60 * 60)
+def prewarm_maps():
+    """
+    Builds the map of every asset and fetches the tiles of MAP_PREWARM_ZOOMS over
+    MAP_PREWARM_REGIONS into the tile cache, at most MAP_PREWARM_MAX_TILES tiles with
+    MAP_PREWARM_CONCURRENCY requests at a time. Cached maps and tiles are not fetched again
+    so the first users after a deploy or clear_mapids do not wait for earth engine.
+
+    Tiles are only prewarmed when TILE_CACHE_BACKEND is redis. The disk cache is local to
+    the worker and the app servers answering /gee/tiles never read it, so only maps, which
+    are always in the shared cache, are built. A map or tile that cannot be built is
+    counted as failed and the run carries on.
+    :return: dict of maps and tiles built and failed
+    """
+    app = current_app._get_current_object()
+    stats = {'maps': 0, 'maps_failed': 0, 'tiles': 0, 'tiles_failed': 0}
+
+    assets = []
+    for asset in sorted(ASSETS):
+        try:
+            get_map(asset=asset)
+        except Exception as e:
+            print("Prewarming map %s failed: %s" % (asset, e))
+            stats['maps_failed'] += 1
+        else:
+            assets.append(asset)
+            stats['maps'] += 1
+
+    if app.config.get('TILE_CACHE_BACKEND') != 'redis':
+        print("Tile cache %s is not shared with the app servers, prewarmed %d maps only, "
+              "%d failed" % (app.config.get('TILE_CACHE_BACKEND'), stats['maps'],
+                             stats['maps_failed']))
+        return stats
+
+    tiles = islice(prewarm_tiles(assets, app.config['MAP_PREWARM_ZOOMS'],
+                                 app.config['MAP_PREWARM_REGIONS']),
+                   app.config['MAP_PREWARM_MAX_TILES'])
+
+    def fetch(tile):
+        map_args, x, y, z = tile
+        with app.app_context():
+            try:
+                get_tile(map_args, x, y, z)
+                return True
+            except Exception as e:
+                if not isinstance(e, TileNotFound):
+                    print("Prewarming tile %s %d/%d/%d failed: %s" %
+                          (map_args['asset'], z, x, y, e))
+                return False
+
+    pool = ThreadPool(app.config['MAP_PREWARM_CONCURRENCY'])
+    try:
+        results = pool.map(fetch, list(tiles))
+    finally:
+        pool.close()
+        pool.join()
+
+    stats['tiles'] = sum(results)
+    stats['tiles_failed'] = len(results) - stats['tiles']
+    print("Prewarmed %(maps)d maps, %(maps_failed)d failed, and %(tiles)d tiles, "
+          "%(tiles_failed)d failed" % stats)
+    return stats
@@ -1,13 +1,15 @@
 from flask import current_app
 from croplands_api import celery
-from croplands_api.models import db, Record
+from croplands_api.models import db, Record, Location
 from croplands_api.utils.google.fusion import replace_rows
-from croplands_api.utils.google.gee import extract, ee
+from croplands_api.utils.google.gee import get_ndvi_backend
+from croplands_api.utils.csv_encoder import utf8
+from croplands_api.utils.exports import incremental_export
 from croplands_api.utils.mappings import get_crop_label, get_intensity_label, get_land_cover_label, \
     get_water_label
-import StringIO
+import tempfile
 import csv
-from datetime import datetime, timedelta
+from datetime import datetime
 
 def status(so_far, total):
     print '%d bytes transferred out of %d' % (so_far, total)
@@ -45,44 +47,164 @@ def mean(A):
     return total / count
 
 
+def to_series23(values):
+    """
+    Scales raw MODIS values and pads the series to 23 elements, one per 16 day composite.
+    :param values: list of raw NDVI values in time order
+    :return: tuple of series and whether the year was complete
+    """
+    series23 = [(int(v) / 10) if v is not None else None for v in values][:23]
+    complete = len(series23) == 23
+
+    if not complete:
+        series23 += [None for i in range(23 - len(series23))]
+
+    return series23, complete
+
+
+def update_ndvi(series):
+    """
+    Writes ndvi, ndvi_mean and the refresh markers for many records in a single
+    UPDATE ... FROM (VALUES ...).
+    :param series: dict of record id to tuple of 23 element series and completeness
+    :return: None
+    """
+    if not series:
+        return
+
+    values, params = [], {}
+    for i, (record_id, (series23, complete)) in enumerate(series.items()):
+        values.append('(:id_%d, CAST(:ndvi_%d AS integer[]), :mean_%d, :complete_%d)'
+                      % (i, i, i, i))
+        params['id_%d' % i] = record_id
+        params['ndvi_%d' % i] = series23
+        params['mean_%d' % i] = int(mean(series23))
+        params['complete_%d' % i] = complete
+
+    db.session.execute(
+        """
+        UPDATE record
+        SET ndvi = v.ndvi, ndvi_mean = v.ndvi_mean, ndvi_complete = v.ndvi_complete,
+            ndvi_updated = now() at time zone 'utc', ndvi_requested = NULL
+        FROM (VALUES %s) AS v (id, ndvi, ndvi_mean, ndvi_complete)
+        WHERE record.id = v.id
+        """ % ', '.join(values),
+        params
+    )
+
+
 @celery.task(rate_limit="120/m", time_limit=300)
 def get_ndvi(id=None, record=None):
     """
     Gets the ndvi time series for a record and insert into array(23 elements) for record.
-    Also computes the mean ndvi.
+    Also computes the mean ndvi. Later refreshes are dispatched by refresh_ndvi.
 
     :param id: record.id optional
     :param record: Record
     :return: None
     """
-    eta = datetime.utcnow() + timedelta(days=150)
-
     if id is not None and record is None:
         record = db.session.query(Record).filter(Record.id == id).first()
 
-    geometry = ee.Geometry.Point(record.location.lon, record.location.lat)
-    start, end = str(record.year) + "-01-01", str(record.year) + "-12-31"
-    collection = ee.ImageCollection('MODIS/MOD13Q1').filterDate(start, end).select(['NDVI'])
-    results = extract(geometry, collection)
-
-    series23 = [(row['NDVI'] / 10) if row['NDVI'] is not None else None for row in results]
-
-    if len(series23) < 23:
-        series23 += [None for i in range(23 - len(series23))]
-        eta = datetime.utcnow() + timedelta(days=10)
+    point = (record.id, record.location.lat, record.location.lon, record.year)
+    series23, complete = to_series23(get_ndvi_backend().series([point])[record.id])
 
     assert len(series23) == 23
 
     record.ndvi_mean = int(mean(series23))
     record.ndvi = series23
+    record.ndvi_complete = complete
+    record.ndvi_updated = datetime.utcnow()
+    record.ndvi_requested = None
 
     print("Record #%d NDVI Series Updated. Mean: %d" % (record.id, record.ndvi_mean))
 
     db.session.commit()
 
-    # todo fix for testing...
-    if current_app.config['ENV'] != 'TESTING':
-        get_ndvi.apply_async(args=[id, record], eta=eta)
+
+@celery.task(rate_limit="10/m", time_limit=600)
+def get_ndvi_batch(ids):
+    """
+    Gets the ndvi time series for many records with one request to the ndvi backend and
+    updates them in a single statement. Keep len(ids) at or below NDVI_BATCH_SIZE.
+
+    :param ids: list of record ids
+    :return: list of ids whose series was incomplete
+    """
+    rows = db.session.query(Record.id, Location.lat, Location.lon, Record.year) \
+        .join(Location, Location.id == Record.location_id) \
+        .filter(Record.id.in_(ids)).all()
+
+    results = get_ndvi_backend().series([tuple(row) for row in rows])
+
+    series = dict((record_id, to_series23(values)) for record_id, values in results.items())
+
+    update_ndvi(series)
+    db.session.commit()
+
+    print("%d Record NDVI Series Updated" % len(series))
+    return [record_id for record_id, (series23, complete) in series.items() if not complete]
+
+
+def claim_ndvi_refresh(limit, now=None):
+    """
+    Marks up to limit records whose series is missing or stale as requested and returns
+    their ids. Incomplete series are refreshed after NDVI_REFRESH_INCOMPLETE, complete
+    ones after NDVI_REFRESH_COMPLETE. Claims older than NDVI_REFRESH_TIMEOUT are assumed
+    lost and claimed again. Rows locked by a concurrent claim are skipped.
+
+    :param limit: maximum number of records
+    :param now: datetime, defaults to utcnow
+    :return: list of record ids
+    """
+    config = current_app.config
+    now = now or datetime.utcnow()
+
+    result = db.session.execute(
+        """
+        UPDATE record SET ndvi_requested = :now
+        WHERE id IN (
+            SELECT id FROM record
+            WHERE (ndvi_requested IS NULL OR ndvi_requested < :expired)
+              AND (ndvi_updated IS NULL
+                   OR (ndvi_complete IS NOT TRUE AND ndvi_updated < :incomplete)
+                   OR ndvi_updated < :complete)
+            ORDER BY ndvi_updated NULLS FIRST
+            LIMIT :limit
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING id
+        """,
+        {
+            'now': now,
+            'expired': now - config['NDVI_REFRESH_TIMEOUT'],
+            'incomplete': now - config['NDVI_REFRESH_INCOMPLETE'],
+            'complete': now - config['NDVI_REFRESH_COMPLETE'],
+            'limit': limit
+        }
+    )
+    ids = [row[0] for row in result]
+    db.session.commit()
+    return ids
+
+
+@celery.task(time_limit=300)
+def refresh_ndvi():
+    """
+    Periodic task that claims records with a missing or stale ndvi series and dispatches
+    them to get_ndvi_batch. At most NDVI_REFRESH_BATCHES batches are queued per run so the
+    broker only ever holds a bounded number of short lived messages.
+
+    :return: number of records dispatched
+    """
+    batch_size = current_app.config['NDVI_BATCH_SIZE']
+    ids = claim_ndvi_refresh(batch_size * current_app.config['NDVI_REFRESH_BATCHES'])
+
+    for i in range(0, len(ids), batch_size):
+        get_ndvi_batch.delay(ids[i:i + batch_size])
+
+    print("Dispatched NDVI refresh for %d records" % len(ids))
+    return len(ids)
 
 
 @celery.task()
@@ -104,67 +226,118 @@ def sum_ratings_for_record(id):
         pass
 
 
-@celery.task(rate_limit="15/h", time_limit=300)
-def build_fusion_tables():
-    cmd = """
-          SELECT  record.id as id,
-                  location.id AS location_id,
-                  location.lat AS lat,
-                  location.lon AS lon,
-                  record.rating as rating,
-                  record.year as year,
-                  record.month as month,
-                  record.land_use_type as land_cover,
-                  record.crop_primary as crop_primary,
-                  record.crop_secondary as crop_secondary,
-                  record.water as water_source,
-                  record.intensity as intensity,
-                  location.country as country,
-                  record.source_description as source_description,
-                  record.source_type as source_type,
-                  record.source_id as source_id,
-                  record.source_class as source_class,
-                  images.image_1 as image_1,
-                  images.image_2 as image_2,
-                  images.image_3 as image_3,
-                  location.use_validation as use_validation,
-                  location.use_private as use_private
-          FROM record
-          LEFT JOIN location ON location.id = record.location_id
-          LEFT JOIN (select s.location_id, s.images[1] as image_1, s.images[2] as image_2, s.images[3] as image_3 from (select location_id, (array_agg(replace(url, 'images/', 'https://images.croplands.org/'))) as images from image group by location_id) s) images on location.id = images.location_id
-          WHERE location.use_deleted is false AND location.use_invalid is false
-          """
-
-    result = db.engine.execute(cmd)
-    columns = result.keys()
+FUSION_TABLE_QUERY = """
+      SELECT  record.id as id,
+              location.id AS location_id,
+              location.lat AS lat,
+              location.lon AS lon,
+              record.rating as rating,
+              record.year as year,
+              record.month as month,
+              record.land_use_type as land_cover,
+              record.crop_primary as crop_primary,
+              record.crop_secondary as crop_secondary,
+              record.water as water_source,
+              record.intensity as intensity,
+              location.country as country,
+              record.source_description as source_description,
+              record.source_type as source_type,
+              record.source_id as source_id,
+              record.source_class as source_class,
+              images.image_1 as image_1,
+              images.image_2 as image_2,
+              images.image_3 as image_3,
+              location.use_validation as use_validation,
+              location.use_private as use_private
+      FROM record
+      LEFT JOIN location ON location.id = record.location_id
+      LEFT JOIN (select s.location_id, s.images[1] as image_1, s.images[2] as image_2, s.images[3] as image_3 from (select location_id, (array_agg(replace(url, 'images/', 'https://images.croplands.org/'))) as images from image group by location_id) s) images on location.id = images.location_id
+      WHERE location.use_deleted is false AND location.use_invalid is false
+      """
+
+
+def write_fusion_table_csvs(result):
+    """
+    Writes the fusion table export in one pass over result into spooled temporary files, so
+    memory is bounded by FUSION_TABLE_SPOOL_SIZE rather than the number of rows.
+    The last two columns, use_validation and use_private, only route rows and are not written.
 
-    all_results = [convert_to_labels(dict(row.items())) for row in result]
+    :param result: ResultProxy, ideally from a server side cursor
+    :return: tuple of training, validation and public files positioned at the start
+    """
+    columns = result.keys()
+    max_size = current_app.config['FUSION_TABLE_SPOOL_SIZE']
 
-    training = StringIO.StringIO()
-    validation = StringIO.StringIO()
-    public = StringIO.StringIO()
+    training, validation, public = [tempfile.SpooledTemporaryFile(max_size=max_size)
+                                    for i in range(3)]
 
     writer_training = csv.DictWriter(training, fieldnames=columns[0:-2], extrasaction='ignore')
-    writer_validation = csv.DictWriter(validation, fieldnames=columns[0:-2], extrasaction='ignore')
+    writer_validation = csv.DictWriter(validation, fieldnames=columns[0:-2],
+                                       extrasaction='ignore')
     writer_public = csv.DictWriter(public, fieldnames=columns[0:-2], extrasaction='ignore')
 
     writer_training.writeheader()
     writer_validation.writeheader()
     writer_public.writeheader()
 
-    print len(all_results)
-
-    for row in all_results:
-        try:
-            if not row['use_private']:
-                writer_public.writerow(row)
-            if row['use_validation']:
-                writer_validation.writerow(row)
-            else:
-                writer_training.writerow(row)
-        except UnicodeEncodeError as e:
-            print e, row
-
-    replace_rows('1C_gFvQmd3AGtB0Q0XgnKk5ESUARSH79FB9Un8sF2', training, startLine=1)
-    replace_rows('12WLGpk7o1ic_j88NQfmrUEILVWDlrJaqZCAqEDeo', validation, startLine=1)
-    replace_rows('1jQjTg7zXhwmLGJdfPCavgdifnyNTqJGi3Bn3RwWF', public, startLine=1)
+    count = 0
+    for row in result:
+        row = convert_to_labels(dict((k, utf8(v)) for k, v in row.items()))
+        if not row['use_private']:
+            writer_public.writerow(row)
+        if row['use_validation']:
+            writer_validation.writerow(row)
+        else:
+            writer_training.writerow(row)
+        count += 1
+
+    print("Fusion table export wrote %d records" % count)
+
+    for f in (training, validation, public):
+        f.seek(0)
+
+    return training, validation, public
+
+
+# the whole table is replaced so there is a single partition, rating is updated with raw sql
+# so is summed rather than relying on date_updated
+FUSION_TABLE_FINGERPRINT = """
+    SELECT 'all', count(*), sum(record.rating), max(record.date_updated),
+           max(location.date_edited),
+           (SELECT count(*) FROM image), (SELECT max(id) FROM image)
+    FROM record
+    JOIN location ON location.id = record.location_id
+    """
+
+
+@celery.task(rate_limit="15/h", time_limit=300)
+def build_fusion_tables(force=False):
+    """
+    Replaces the training, validation and public fusion tables when records, locations or
+    images changed since the last build.
+    :param force: rebuild even if nothing changed
+    :return: list of partitions built
+    """
+    return incremental_export('fusion_tables', FUSION_TABLE_FINGERPRINT, upload_fusion_tables,
+                              force=force)
+
+
+def upload_fusion_tables(partition='all'):
+    connection = db.engine.connect().execution_options(stream_results=True)
+    try:
+        result = connection.execute(FUSION_TABLE_QUERY)
+        training, validation, public = write_fusion_table_csvs(result)
+    finally:
+        connection.close()
+
+    # a failed upload raises so the export state is not recorded and the next run retries
+    try:
+        replace_rows('1C_gFvQmd3AGtB0Q0XgnKk5ESUARSH79FB9Un8sF2', training, startLine=1,
+                     resumable=True)
+        replace_rows('12WLGpk7o1ic_j88NQfmrUEILVWDlrJaqZCAqEDeo', validation, startLine=1,
+                     resumable=True)
+        replace_rows('1jQjTg7zXhwmLGJdfPCavgdifnyNTqJGi3Bn3RwWF', public, startLine=1,
+                     resumable=True)
+    finally:
+        for f in (training, validation, public):
+            f.close()
@@ -1,19 +1,33 @@
 from flask import current_app
 from croplands_api import celery
 from croplands_api.models import db
-import boto
-from boto.s3.key import Key
+from croplands_api.utils.exports import incremental_export
+from croplands_api.utils.storage import get_storage
 import StringIO
 import gzip
 from flask import json
 
 
-def status(so_far, total):
-    print '%d bytes transferred out of %d' % (so_far, total)
+REFERENCE_DATA_COVERAGE_FINGERPRINT = """
+    SELECT 'all', count(*), max(r.date_updated), max(l.date_edited)
+    FROM record r
+    JOIN location l on l.id = r.location_id
+    """
 
 
 @celery.task(rate_limit="1/h")
-def reference_data_coverage_task():
+def reference_data_coverage_task(force=False):
+    """
+    Uploads the per country reference data coverage when records changed since the last
+    build.
+    :param force: rebuild even if nothing changed
+    :return: list of partitions built
+    """
+    return incremental_export('reference_data_coverage', REFERENCE_DATA_COVERAGE_FINGERPRINT,
+                              upload_reference_data_coverage, force=force)
+
+
+def upload_reference_data_coverage(partition='all'):
     cmd = """
           Select
         c.geom_json As geometry,
@@ -55,31 +69,17 @@ def reference_data_coverage_task():
     }
     print "Converted features"
 
-    # Connect to S3
-    s3 = boto.connect_s3(current_app.config['AWS_ACCESS_KEY_ID'],
-                         current_app.config['AWS_SECRET_ACCESS_KEY'])
-
-    # Get bucket
-    bucket = s3.get_bucket(current_app.config['AWS_S3_BUCKET'])
-
     # fake a file for gzip
     out = StringIO.StringIO()
 
-    k = Key(bucket)
-
-    k.key = 'public/json/reference_data_coverage.json'
-
-    k.set_metadata('content-type', 'application/javascript')
-    k.set_metadata('cache-control', 'max-age=3000000')
-    k.set_metadata('content-encoding', 'gzip')
-
     with gzip.GzipFile(fileobj=out, mode="w") as outfile:
         outfile.write(json.dumps(fc))
 
-    if current_app.testing:
-        k.set_contents_from_string(out.getvalue(), cb=status, num_cb=10)
-    else:
-        k.set_contents_from_string(out.getvalue(), cb=status, num_cb=10)
-    k.make_public()
+    get_storage(current_app.config['AWS_S3_BUCKET'], provider='s3').put(
+        'public/json/reference_data_coverage.json', out.getvalue(),
+        metadata={'content-type': 'application/javascript',
+                  'cache-control': 'max-age=3000000',
+                  'content-encoding': 'gzip'},
+        public=True)
 
 
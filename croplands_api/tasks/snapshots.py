@@ -0,0 +1,44 @@
+from flask import current_app
+from croplands_api import celery
+from croplands_api.utils.exports import incremental_export
+from croplands_api.utils.s3 import upload_stream_to_s3, delete_file_from_s3
+from croplands_api.utils.snapshots import SNAPSHOT_EXPORT, SNAPSHOT_FINGERPRINT, snapshot_key
+from croplands_api.views.data import query, result_generator, export_columns
+from datetime import datetime
+
+
+def build_snapshot(partition):
+    """
+    Uploads the gzip csv of the public records of a country, or of a country and year, in
+    the same order and columns as /data/download.
+    :param partition: String from utils.snapshots.snapshot_partition
+    :return: None
+    """
+    country, year = partition.rsplit('|', 1)
+
+    filters = {'country': [country], 'use_validation': [False], 'delay': True}
+    if year != 'all':
+        filters['year'] = [int(year)]
+
+    meta = {'offset': 0, 'limit': None, 'order_by': 'id', 'order_by_direction': 'desc'}
+    results = query(meta=meta, filters=filters, columns=export_columns, stream=True)
+
+    upload_stream_to_s3(result_generator(results), snapshot_key(partition),
+                        'text/csv; charset=utf-8; header=present',
+                        max_age=current_app.config['DATA_SNAPSHOT_MAX_AGE'])
+
+
+def remove_snapshot(partition):
+    delete_file_from_s3(snapshot_key(partition))
+
+
+@celery.task(rate_limit="4/h", time_limit=60 * 60)
+def build_snapshots(force=False):
+    """
+    Rebuilds the download snapshots of every country and year whose public records changed.
+    :param force: rebuild every snapshot
+    :return: list of partitions built
+    """
+    before = datetime.utcnow() - current_app.config['DATA_QUERY_DELAY']
+    return incremental_export(SNAPSHOT_EXPORT, SNAPSHOT_FINGERPRINT, build_snapshot,
+                              remove=remove_snapshot, params={'before': before}, force=force)
@@ -0,0 +1,139 @@
+from itertools import islice
+from sqlalchemy.dialects import postgresql
+import sqlalchemy as sa
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+# ndvi has one value per 16 day composite
+NDVI_LENGTH = 23
+
+
+class _Sink(object):
+    """
+    Write only file that hands back what was written since the last drain, so arrow and
+    parquet writers can be streamed out of a response.
+    """
+    closed = False
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def write(self, data):
+        data = bytes(data)
+        self.chunks.append(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        del self.chunks[:]
+        return data
+
+
+def arrow_type(column):
+    """
+    Arrow type of a RecordSearch column. Integer arrays, the ndvi series, become fixed size
+    lists of int16.
+    :param column: sqlalchemy column
+    :return: pyarrow DataType
+    """
+    column_type = column.property.columns[0].type
+    if isinstance(column_type, postgresql.ARRAY):
+        return pa.list_(pa.int16(), NDVI_LENGTH)
+    if isinstance(column_type, sa.Boolean):
+        return pa.bool_()
+    if isinstance(column_type, sa.Integer):
+        return pa.int32()
+    if isinstance(column_type, sa.Float):
+        return pa.float64()
+    if isinstance(column_type, sa.DateTime):
+        return pa.timestamp('us')
+    return pa.string()
+
+
+def schema(columns):
+    return pa.schema([pa.field(c.key, arrow_type(c)) for c in columns])
+
+
+def _array(values, data_type):
+    if isinstance(data_type, pa.FixedSizeListType):
+        # missing series are stored as NDVI_LENGTH nulls
+        flat = []
+        for series in values:
+            series = list(series or [])[:NDVI_LENGTH]
+            flat.extend(series + [None] * (NDVI_LENGTH - len(series)))
+        return pa.FixedSizeListArray.from_arrays(pa.array(flat, type=data_type.value_type),
+                                                 NDVI_LENGTH)
+    return pa.array(values, type=data_type)
+
+
+def record_batches(rows, columns, batch_size=5000):
+    """
+    Converts rows to arrow record batches of batch_size rows.
+    :param rows: iterable of tuples in the order of columns
+    :param columns: list of RecordSearch columns
+    :param batch_size: rows per batch
+    :return: generator of RecordBatch
+    """
+    arrow_schema = schema(columns)
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, batch_size))
+        if not chunk:
+            break
+        arrays = [_array(values, field.type) for values, field in zip(zip(*chunk), arrow_schema)]
+        yield pa.RecordBatch.from_arrays(arrays, schema=arrow_schema)
+
+
+def encode_arrow(rows, columns, batch_size=5000):
+    """
+    Encodes rows in the arrow ipc stream format one record batch at a time.
+    :param rows: iterable of tuples in the order of columns
+    :param columns: list of RecordSearch columns
+    :param batch_size: rows per record batch
+    :return: generator of bytes
+    """
+    sink = _Sink()
+    writer = pa.RecordBatchStreamWriter(pa.PythonFile(sink, mode='w'), schema(columns))
+
+    for batch in record_batches(rows, columns, batch_size):
+        writer.write_batch(batch)
+        yield sink.drain()
+
+    writer.close()
+    yield sink.drain()
+
+
+def encode_parquet(rows, columns, batch_size=5000):
+    """
+    Encodes rows as parquet with one row group per batch. The footer is written last so
+    the file is only readable once complete.
+    :param rows: iterable of tuples in the order of columns
+    :param columns: list of RecordSearch columns
+    :param batch_size: rows per row group
+    :return: generator of bytes
+    """
+    sink = _Sink()
+    writer = pq.ParquetWriter(pa.PythonFile(sink, mode='w'), schema(columns),
+                              compression='snappy')
+
+    for batch in record_batches(rows, columns, batch_size):
+        writer.write_table(pa.Table.from_batches([batch]))
+        yield sink.drain()
+
+    writer.close()
+    yield sink.drain()
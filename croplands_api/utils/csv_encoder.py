@@ -0,0 +1,56 @@
+import csv
+import cStringIO
+from itertools import islice
+
+
+def utf8(value):
+    """
+    Encodes unicode for the python 2 csv module, leaves everything else alone.
+    :param value: anything
+    :return: anything
+    """
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return value
+
+
+def encode_rows(rows, headers=None, chunk_size=10000, text_columns=None):
+    """
+    Encodes rows as csv in blocks of chunk_size rows. Each block is written through a single
+    csv.writer into a reused buffer so quoting and escaping follow the csv module.
+    :param rows: iterable of tuples or lists
+    :param headers: optional list of column names written first
+    :param chunk_size: number of rows per yielded block
+    :param text_columns: indexes of columns that may hold unicode, None to check every column
+    :return: generator of strings
+    """
+    out = cStringIO.StringIO()
+    writer = csv.writer(out, lineterminator='\n')
+
+    if headers is not None:
+        writer.writerow([utf8(h) for h in headers])
+
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            break
+
+        if text_columns is None:
+            chunk = [[utf8(v) for v in row] for row in chunk]
+        elif text_columns:
+            chunk = [list(row) for row in chunk]
+            for row in chunk:
+                for i in text_columns:
+                    if isinstance(row[i], unicode):
+                        row[i] = row[i].encode('utf-8')
+
+        writer.writerows(chunk)
+        yield out.getvalue()
+
+        out.seek(0)
+        out.truncate()
+
+    # headers only
+    if out.tell():
+        yield out.getvalue()
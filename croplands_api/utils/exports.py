@@ -0,0 +1,69 @@
+from croplands_api.models import db, ExportState
+
+
+def fingerprints(sql, params=None):
+    """
+    Runs a query returning one row per partition, the partition name first followed by any
+    values that change when the partition's source rows do, e.g. count(*) and
+    max(date_updated). Counts catch deletes that a high-water mark alone would miss.
+    :param sql: String
+    :param params: dict of bind parameters
+    :return: dict of partition to fingerprint string
+    """
+    return dict((unicode(row[0]), u'|'.join(unicode(v) for v in row[1:]))
+                for row in db.session.execute(sql, params or {}))
+
+
+def changed_partitions(name, current):
+    """
+    Compares fingerprints with those stored when each partition was last built.
+    :param name: export name
+    :param current: dict of partition to fingerprint
+    :return: tuple of changed or new partitions and partitions that no longer exist
+    """
+    built = dict((s.partition, s.fingerprint)
+                 for s in ExportState.query.filter_by(name=name))
+
+    changed = sorted(p for p, f in current.items() if built.get(p) != f)
+    removed = sorted(p for p in built if p not in current)
+    return changed, removed
+
+
+def incremental_export(name, sql, build, remove=None, params=None, force=False):
+    """
+    Builds only the partitions of an export whose fingerprint changed since the last build.
+    Each partition's state is committed after it is built so a failure part way through
+    only rebuilds the remaining partitions on the next run.
+
+    :param name: export name
+    :param sql: fingerprint query, see fingerprints
+    :param build: callable taking a partition name
+    :param remove: optional callable taking the name of a partition that no longer exists
+    :param params: dict of bind parameters for sql
+    :param force: rebuild every partition
+    :return: list of partitions built
+    """
+    current = fingerprints(sql, params)
+    changed, removed = changed_partitions(name, current)
+
+    if force:
+        changed = sorted(current)
+
+    if not changed and not removed:
+        print("Export %s unchanged, skipping" % name)
+        return []
+
+    for partition in changed:
+        build(partition)
+        db.session.merge(ExportState(name=name, partition=partition,
+                                     fingerprint=current[partition]))
+        db.session.commit()
+
+    for partition in removed:
+        if remove is not None:
+            remove(partition)
+        ExportState.query.filter_by(name=name, partition=partition).delete()
+        db.session.commit()
+
+    print("Export %s built %d, removed %d partitions" % (name, len(changed), len(removed)))
+    return changed
@@ -1,8 +1,241 @@
-from geopy.distance import vincenty, Point, VincentyDistance
 import math
 import numpy as np
+from scipy.spatial import cKDTree
 from shapely.ops import triangulate
 
+# mean earth radius in meters, what postgis uses for spherical distances
+EARTH_RADIUS = 6371008.7714
+
+# WGS-84 ellipsoid
+WGS84_A = 6378137.0
+WGS84_F = 1 / 298.257223563
+WGS84_B = (1 - WGS84_F) * WGS84_A
+
+# The array functions below take scalars or numpy arrays that broadcast together and
+# return arrays. The scalar functions further down wrap them.
+
+
+def _radians(*values):
+    return np.broadcast_arrays(*[np.radians(np.asarray(v, dtype=float)) for v in values])
+
+
+def haversine_distances(lat1, lon1, lat2, lon2):
+    """
+    Great circle distance on a sphere of radius EARTH_RADIUS.
+    :param lat1: array (decimal degrees)
+    :param lon1: array (decimal degrees)
+    :param lat2: array (decimal degrees)
+    :param lon2: array (decimal degrees)
+    :return: array (meters)
+    """
+    lat1, lon1, lat2, lon2 = _radians(lat1, lon1, lat2, lon2)
+    h = np.sin((lat2 - lat1) / 2) ** 2 + \
+        np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.minimum(h, 1)))
+
+
+def vincenty_distances(lat1, lon1, lat2, lon2, iterations=200, tolerance=1e-12):
+    """
+    Distance on the WGS-84 ellipsoid using Vincenty's inverse formula. Pairs that do not
+    converge, nearly antipodal points, are nan.
+    :param lat1: array (decimal degrees)
+    :param lon1: array (decimal degrees)
+    :param lat2: array (decimal degrees)
+    :param lon2: array (decimal degrees)
+    :param iterations: maximum iterations
+    :param tolerance: convergence of lambda in radians
+    :return: array (meters)
+    """
+    lat1, lon1, lat2, lon2 = _radians(lat1, lon1, lat2, lon2)
+    f = WGS84_F
+
+    L = lon2 - lon1
+    u1 = np.arctan((1 - f) * np.tan(lat1))
+    u2 = np.arctan((1 - f) * np.tan(lat2))
+    sin_u1, cos_u1 = np.sin(u1), np.cos(u1)
+    sin_u2, cos_u2 = np.sin(u2), np.cos(u2)
+
+    shape = L.shape
+    L, sin_u1, cos_u1, sin_u2, cos_u2 = [v.ravel() for v in (L, sin_u1, cos_u1, sin_u2, cos_u2)]
+
+    # only the pairs that have not converged stay in the arrays between iterations
+    meters = np.full(L.shape, np.nan)
+    index = np.arange(L.size)
+    lam = L
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for i in range(iterations):
+            if not index.size:
+                break
+
+            sin_lam, cos_lam = np.sin(lam), np.cos(lam)
+            sin_sigma = np.sqrt((cos_u2 * sin_lam) ** 2 +
+                                (cos_u1 * sin_u2 - sin_u1 * cos_u2 * cos_lam) ** 2)
+            cos_sigma = sin_u1 * sin_u2 + cos_u1 * cos_u2 * cos_lam
+            sigma = np.arctan2(sin_sigma, cos_sigma)
+            sin_alpha = np.where(sin_sigma == 0, 0, cos_u1 * cos_u2 * sin_lam / sin_sigma)
+            cos_sq_alpha = 1 - sin_alpha ** 2
+            # equatorial lines have cos_sq_alpha of 0
+            cos_2sigma_m = np.where(cos_sq_alpha == 0, 0,
+                                    cos_sigma - 2 * sin_u1 * sin_u2 / cos_sq_alpha)
+            c = f / 16 * cos_sq_alpha * (4 + f * (4 - 3 * cos_sq_alpha))
+
+            lam_previous = lam
+            lam = L + (1 - c) * f * sin_alpha * (
+                sigma + c * sin_sigma * (
+                    cos_2sigma_m + c * cos_sigma * (-1 + 2 * cos_2sigma_m ** 2)))
+
+            done = np.abs(lam - lam_previous) <= tolerance
+            if done.any():
+                u_sq = cos_sq_alpha[done] * (WGS84_A ** 2 - WGS84_B ** 2) / WGS84_B ** 2
+                a = 1 + u_sq / 16384 * (4096 + u_sq * (-768 + u_sq * (320 - 175 * u_sq)))
+                b = u_sq / 1024 * (256 + u_sq * (-128 + u_sq * (74 - 47 * u_sq)))
+                s2m, ss, cs = cos_2sigma_m[done], sin_sigma[done], cos_sigma[done]
+                delta_sigma = b * ss * (s2m + b / 4 * (
+                    cs * (-1 + 2 * s2m ** 2) -
+                    b / 6 * s2m * (-3 + 4 * ss ** 2) * (-3 + 4 * s2m ** 2)))
+                meters[index[done]] = WGS84_B * a * (sigma[done] - delta_sigma)
+
+                remaining = ~done
+                index, L, lam = index[remaining], L[remaining], lam[remaining]
+                sin_u1, cos_u1 = sin_u1[remaining], cos_u1[remaining]
+                sin_u2, cos_u2 = sin_u2[remaining], cos_u2[remaining]
+
+    return meters.reshape(shape)
+
+
+def destinations(lat, lon, bearing, km, iterations=200, tolerance=1e-12):
+    """
+    Destination on the WGS-84 ellipsoid using Vincenty's direct formula.
+    :param lat: array (decimal degrees)
+    :param lon: array (decimal degrees)
+    :param bearing: array (degrees)
+    :param km: array (kilometers)
+    :param iterations: maximum iterations
+    :param tolerance: convergence of sigma in radians
+    :return: tuple of lat and lon arrays (decimal degrees)
+    """
+    lat, lon, bearing = _radians(lat, lon, bearing)
+    s = np.broadcast_to(np.asarray(km, dtype=float) * 1000, lat.shape)
+    f = WGS84_F
+
+    sin_alpha1, cos_alpha1 = np.sin(bearing), np.cos(bearing)
+    tan_u1 = (1 - f) * np.tan(lat)
+    cos_u1 = 1 / np.sqrt(1 + tan_u1 ** 2)
+    sin_u1 = tan_u1 * cos_u1
+    sigma1 = np.arctan2(tan_u1, cos_alpha1)
+    sin_alpha = cos_u1 * sin_alpha1
+    cos_sq_alpha = 1 - sin_alpha ** 2
+
+    u_sq = cos_sq_alpha * (WGS84_A ** 2 - WGS84_B ** 2) / WGS84_B ** 2
+    a = 1 + u_sq / 16384 * (4096 + u_sq * (-768 + u_sq * (320 - 175 * u_sq)))
+    b = u_sq / 1024 * (256 + u_sq * (-128 + u_sq * (74 - 47 * u_sq)))
+
+    sigma = s / (WGS84_B * a)
+    for i in range(iterations):
+        cos_2sigma_m = np.cos(2 * sigma1 + sigma)
+        sin_sigma, cos_sigma = np.sin(sigma), np.cos(sigma)
+        delta_sigma = b * sin_sigma * (cos_2sigma_m + b / 4 * (
+            cos_sigma * (-1 + 2 * cos_2sigma_m ** 2) -
+            b / 6 * cos_2sigma_m * (-3 + 4 * sin_sigma ** 2) * (-3 + 4 * cos_2sigma_m ** 2)))
+
+        sigma_previous = sigma
+        sigma = s / (WGS84_B * a) + delta_sigma
+        if (np.abs(sigma - sigma_previous) <= tolerance).all():
+            break
+
+    cos_2sigma_m = np.cos(2 * sigma1 + sigma)
+    sin_sigma, cos_sigma = np.sin(sigma), np.cos(sigma)
+
+    tmp = sin_u1 * sin_sigma - cos_u1 * cos_sigma * cos_alpha1
+    lat2 = np.arctan2(sin_u1 * cos_sigma + cos_u1 * sin_sigma * cos_alpha1,
+                      (1 - f) * np.sqrt(sin_alpha ** 2 + tmp ** 2))
+    lam = np.arctan2(sin_sigma * sin_alpha1,
+                     cos_u1 * cos_sigma - sin_u1 * sin_sigma * cos_alpha1)
+    c = f / 16 * cos_sq_alpha * (4 + f * (4 - 3 * cos_sq_alpha))
+    L = lam - (1 - c) * f * sin_alpha * (
+        sigma + c * sin_sigma * (cos_2sigma_m + c * cos_sigma * (-1 + 2 * cos_2sigma_m ** 2)))
+
+    lon2 = (lon + L + 3 * math.pi) % (2 * math.pi) - math.pi
+    return np.degrees(lat2), np.degrees(lon2)
+
+
+def bearings(origin_lat, origin_lon, destination_lat, destination_lon):
+    """
+    Initial compass bearing from origin to destination.
+    :param origin_lat: array (decimal degrees)
+    :param origin_lon: array (decimal degrees)
+    :param destination_lat: array (decimal degrees)
+    :param destination_lon: array (decimal degrees)
+    :return: array (degrees 0 to 360)
+    """
+    lat1, lon1, lat2, lon2 = _radians(origin_lat, origin_lon, destination_lat, destination_lon)
+    diff_lon = lon2 - lon1
+
+    x = np.sin(diff_lon) * np.cos(lat2)
+    y = np.cos(lat1) * np.sin(lat2) - np.sin(lat1) * np.cos(lat2) * np.cos(diff_lon)
+
+    return (np.degrees(np.arctan2(x, y)) + 360) % 360
+
+
+def spaced_along(lats, lons, meters):
+    """
+    Indexes of the interior points of a path where more than meters have been travelled
+    along it since the start or the previous point picked.
+    :param lats: sequence of latitudes (decimal degrees)
+    :param lons: sequence of longitudes (decimal degrees)
+    :param meters: spacing in meters
+    :return: list of ints
+    """
+    lats = np.asarray(lats, dtype=float)
+    lons = np.asarray(lons, dtype=float)
+    if len(lats) < 3:
+        return []
+
+    travelled = np.concatenate([[0], np.cumsum(
+        haversine_distances(lats[:-1], lons[:-1], lats[1:], lons[1:]))])
+
+    picked = []
+    i = 0
+    while True:
+        i = int(np.searchsorted(travelled, travelled[i] + meters, side='right'))
+        if i >= len(lats) - 1:
+            return picked
+        picked.append(i)
+
+
+def degrees_to_tile_numbers(lat_deg, lon_deg, zoom):
+    """
+    Converts latitudes, longitudes and zooms to web mercator tile numbers.
+    :param lat_deg: array (decimal degrees)
+    :param lon_deg: array (decimal degrees)
+    :param zoom: array of int
+    :return: tuple of column and row int arrays
+    """
+    lat_rad, lon_deg, zoom = np.broadcast_arrays(np.radians(np.asarray(lat_deg, dtype=float)),
+                                                 np.asarray(lon_deg, dtype=float),
+                                                 np.asarray(zoom))
+    n = 2.0 ** zoom
+    x = ((lon_deg + 180.0) / 360.0 * n).astype(int)
+    y = ((1.0 - np.log(np.tan(lat_rad) + (1 / np.cos(lat_rad))) / math.pi) / 2.0 * n).astype(int)
+    return x, y
+
+
+def tile_numbers_to_degrees(x, y, zoom):
+    """
+    Converts web mercator tile numbers to the latitude and longitude of their north west corner.
+    :param x: array of int
+    :param y: array of int
+    :param zoom: array of int
+    :return: tuple of lat and lon arrays (decimal degrees)
+    """
+    x, y, zoom = np.broadcast_arrays(np.asarray(x, dtype=float), np.asarray(y, dtype=float),
+                                     np.asarray(zoom))
+    n = 2.0 ** zoom
+    lon_deg = x / n * 360.0 - 180.0
+    lat_deg = np.degrees(np.arctan(np.sinh(math.pi * (1 - 2 * y / n))))
+    return lat_deg, lon_deg
+
 
 def distance(lat1, lon1, lat2, lon2):
     """
@@ -13,7 +246,10 @@ def distance(lat1, lon1, lat2, lon2):
     :param lon2:
     :return: Integer (meters)
     """
-    return vincenty((lat1, lon1), (lat2, lon2)).meters
+    meters = float(vincenty_distances(lat1, lon1, lat2, lon2))
+    if math.isnan(meters):
+        raise ValueError('Vincenty formula failed to converge')
+    return meters
 
 
 def decode_google_polyline(encoded):
@@ -79,25 +315,7 @@ def calculate_bearing(origin_lat, origin_lon, destination_lat, destination_lon):
     :param destination_lon: float (decimal degrees)
     :return: float
     """
-
-    lat1 = math.radians(origin_lat)
-    lat2 = math.radians(destination_lat)
-
-    diffLong = math.radians(destination_lon - origin_lon)
-
-    x = math.sin(diffLong) * math.cos(lat2)
-    y = math.cos(lat1) * math.sin(lat2) - (math.sin(lat1)
-                                           * math.cos(lat2) * math.cos(diffLong))
-
-    initial_bearing = math.atan2(x, y)
-
-    # Now we have the initial bearing but math.atan2 return values
-    # The solution is to normalize the initial bearing as shown below
-
-    initial_bearing = math.degrees(initial_bearing)
-    compass_bearing = (initial_bearing + 360) % 360
-
-    return compass_bearing
+    return float(bearings(origin_lat, origin_lon, destination_lat, destination_lon))
 
 
 def calculate_plane_perpendicular_to_travel(origin, current, destination):
@@ -117,9 +335,8 @@ def calculate_plane_perpendicular_to_travel(origin, current, destination):
 
 
 def get_destination(lat, lon, bearing, km):
-    origin = Point(lat, lon)
-    destination = VincentyDistance(kilometers=km).destination(origin, bearing)
-    return destination.latitude, destination.longitude
+    lat, lon = destinations(lat, lon, bearing, km)
+    return float(lat), float(lon)
 
 
 def degree_to_tile_number(lat_deg, lon_deg, zoom):
@@ -130,11 +347,8 @@ def degree_to_tile_number(lat_deg, lon_deg, zoom):
     :param zoom:
     :return: Tuple of column and row
     """
-    lat_rad = math.radians(lat_deg)
-    n = 2.0 ** zoom
-    x = int((lon_deg + 180.0) / 360.0 * n)
-    y = int((1.0 - math.log(math.tan(lat_rad) + (1 / math.cos(lat_rad))) / math.pi) / 2.0 * n)
-    return x, y
+    x, y = degrees_to_tile_numbers(lat_deg, lon_deg, zoom)
+    return int(x), int(y)
 
 
 def tile_number_to_degree(x, y, zoom):
@@ -145,11 +359,8 @@ def tile_number_to_degree(x, y, zoom):
     :param zoom:
     :return:
     """
-    n = 2.0 ** zoom
-    lon_deg = x / n * 360.0 - 180.0
-    lat_rad = math.atan(math.sinh(math.pi * (1 - 2 * y / n)))
-    lat_deg = math.degrees(lat_rad)
-    return lat_deg, lon_deg
+    lat_deg, lon_deg = tile_numbers_to_degrees(x, y, zoom)
+    return float(lat_deg), float(lon_deg)
 
 
 def uniform_sample(poly, n=100):
@@ -198,4 +409,22 @@ def uniform_sample(poly, n=100):
          c1[:, np.newaxis] * v[1][t_inds,:] +
          c2[:, np.newaxis] * v[2][t_inds,:])
 
-    return P
\ No newline at end of file
+    return P
+
+
+def neighbors_within(lats, lons, meters):
+    """
+    Finds all pairs of points within a spherical distance of each other using a kd-tree
+    over unit vectors, where the chord length is monotonic in great circle distance.
+
+    :param lats: sequence of latitudes (decimal degrees)
+    :param lons: sequence of longitudes (decimal degrees)
+    :param meters: radius in meters
+    :return: list with the indexes of the neighbors of each point, including itself
+    """
+    lat = np.radians(np.asarray(lats, dtype=float))
+    lon = np.radians(np.asarray(lons, dtype=float))
+    xyz = np.column_stack((np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)))
+
+    chord = 2 * math.sin(min(float(meters) / EARTH_RADIUS, math.pi) / 2)
+    return list(cKDTree(xyz).query_ball_point(xyz, chord))
@@ -1,23 +1,26 @@
-from googleapiclient.http import MediaIoBaseUpload, HttpError
+from googleapiclient.http import MediaIoBaseUpload
 from croplands_api.utils.google import build_service
 
+UPLOAD_CHUNK_SIZE = 4 * 1024 * 1024
 
-def replace_rows(table_id, fd, startLine=None):
+
+def replace_rows(table_id, fd, startLine=None, resumable=False):
     """
     Replaces all rows in a fusion table with the fd of a csv.
     :param table_id: string
     :param fd: file descriptor
+    :param startLine: first line of the csv to import
+    :param resumable: upload in chunks of UPLOAD_CHUNK_SIZE instead of reading fd at once
     :return: None
+    :raises HttpError: if the upload fails, the table is left as it was
     """
 
-    media_body = MediaIoBaseUpload(fd, mimetype='application/octet-stream')
+    media_body = MediaIoBaseUpload(fd, mimetype='application/octet-stream',
+                                   chunksize=UPLOAD_CHUNK_SIZE, resumable=resumable)
 
     service = build_service("fusiontables", "v2")
     table = service.table()
     command = table.replaceRows(tableId=table_id,
                                 media_body=media_body,
                                 startLine=startLine)
-    try:
-        command.execute()
-    except HttpError as e:
-        print(e)
\ No newline at end of file
+    command.execute()
@@ -2,6 +2,15 @@ from flask import current_app
 from croplands_api.exceptions import TileNotFound
 import ee
 from croplands_api import cache
+from croplands_api.utils.tile_cache import Tile, SingleFlight, cached_tile, tile_key, \
+    http_session
+import datetime
+import hashlib
+import math
+import time
+import uuid
+
+_flight = SingleFlight()
 
 BASE_URL = 'https://earthengine.googleapis.com/'
 
@@ -48,6 +57,183 @@ def extract(geometry, collection=None, scale=231.65):
             for row in data[1:]]
 
 
+def extract_many(points, collection=None, scale=231.65):
+    """
+    Extracts the values of every image at many points with one getRegion request. Rows
+    come back per pixel, each point gets the rows of the nearest pixel returned.
+    :param points: dict of key to (lat, lon)
+    :param collection: image stack
+    :param scale: appropriate scale for image
+    :return: dict of key to list of dicts for each image, as returned by extract
+    """
+    if not points:
+        return {}
+
+    if collection is None:
+        collection = ee.ImageCollection('MODIS/MOD13Q1')
+
+    collection = collection.sort('system:time_start', True)
+
+    geometry = ee.Geometry.MultiPoint([[lon, lat] for lat, lon in points.values()])
+    data = collection.getRegion(geometry, scale).getInfo()
+
+    header = data[0]
+    lon_index, lat_index = header.index('longitude'), header.index('latitude')
+    pixels = {}
+    for row in data[1:]:
+        pixels.setdefault((row[lon_index], row[lat_index]), []).append(
+            dict((header[i], val) for i, val in enumerate(row)))
+
+    results = {}
+    for key, (lat, lon) in points.items():
+        if not pixels:
+            results[key] = []
+            continue
+        nearest = min(pixels, key=lambda p: (p[0] - lon) ** 2 + (p[1] - lat) ** 2)
+        results[key] = pixels[nearest]
+    return results
+
+
+def snap_to_grid(lat, lon, size):
+    """
+    Centre of the grid cell of size degrees holding a point.
+    :param lat: float
+    :param lon: float
+    :param size: cell size (decimal degrees)
+    :return: tuple of lat and lon
+    """
+    return (round((math.floor(lat / size) + 0.5) * size, 6),
+            round((math.floor(lon / size) + 0.5) * size, 6))
+
+
+def time_series_cache_key(collection, start, end, cell):
+    """
+    Cache key of the series of a grid cell, end is None for series up to today so the key
+    does not change every day.
+    """
+    canonical = u'%s|%s|%s|%f|%f' % (collection, start, end, cell[0], cell[1])
+    return 'time_series_' + hashlib.sha1(canonical.encode('utf-8')).hexdigest()
+
+
+def time_series(points, collection, start, end=None):
+    """
+    Returns the time series of many points. Points in the same cell of TIME_SERIES_GRID_SIZE
+    degrees share the series extracted at the centre of the cell. Series are cached and
+    the cells missing from the cache are extracted with a single earth engine request.
+    Series ending today or later are cached as open ended and gain new images once their
+    cache entry expires.
+    :param points: list of (lat, lon) tuples
+    :param collection: image collection id
+    :param start: String date
+    :param end: String date, None for today
+    :return: list of series in the order of points, see extract
+    """
+    today = datetime.date.today()
+    if end is not None and end >= today.isoformat():
+        end = None
+
+    size = current_app.config['TIME_SERIES_GRID_SIZE']
+    cells = [snap_to_grid(lat, lon, size) for lat, lon in points]
+    unique = list(set(cells))
+    keys = [time_series_cache_key(collection, start, end, cell) for cell in unique]
+
+    found = dict((cell, series) for cell, series in zip(unique, cache.get_many(*keys))
+                 if series is not None)
+
+    missing = dict((cell, cell) for cell in unique if cell not in found)
+    if missing:
+        until = end or (today + datetime.timedelta(days=1)).isoformat()
+        extracted = extract_many(missing,
+                                 ee.ImageCollection(collection).filterDate(start, until))
+        cache.set_many(dict((time_series_cache_key(collection, start, end, cell), series)
+                            for cell, series in extracted.items()),
+                       timeout=current_app.config['TIME_SERIES_CACHE_TIMEOUT'])
+        found.update(extracted)
+
+    return [found[cell] for cell in cells]
+
+
+class EarthEngineNDVI(object):
+    """
+    Samples MODIS NDVI for many points in a single Earth Engine request. Points are grouped
+    by year, each image of the year is reduced over the points with reduceRegions and the
+    resulting feature collections are merged so only one getInfo call is made. Earth Engine
+    limits getInfo to 5000 features so keep points * 23 below that.
+    """
+    collection = 'MODIS/MOD13Q1'
+
+    def __init__(self, scale=231.65):
+        self.scale = scale
+
+    def sample(self, year, features):
+        collection = ee.ImageCollection(self.collection) \
+            .filterDate('%d-01-01' % year, '%d-12-31' % year).select(['NDVI'])
+        reducer = ee.Reducer.first().setOutputs(['NDVI'])
+        scale = self.scale
+
+        def reduce_image(image):
+            return image.reduceRegions(features, reducer, scale) \
+                .map(lambda f: f.set('time', image.get('system:time_start')))
+
+        return collection.map(reduce_image).flatten()
+
+    def series(self, points):
+        """
+        Returns the raw NDVI values of each point in time order.
+        :param points: list of (key, lat, lon, year) tuples
+        :return: dict of key to list of values, None where the pixel is masked
+        """
+        by_year = {}
+        for key, lat, lon, year in points:
+            by_year.setdefault(year, []).append(ee.Feature(ee.Geometry.Point(lon, lat),
+                                                           {'key': key}))
+
+        samples = None
+        for year, features in by_year.items():
+            sample = self.sample(year, ee.FeatureCollection(features))
+            samples = sample if samples is None else samples.merge(sample)
+
+        if samples is None:
+            return {}
+
+        features = [f['properties'] for f in samples.getInfo()['features']]
+
+        series = dict((key, []) for key, lat, lon, year in points)
+        for properties in sorted(features, key=lambda p: p['time']):
+            series[properties['key']].append(properties.get('NDVI'))
+
+        return series
+
+
+class FakeNDVI(object):
+    """
+    Local stand in for EarthEngineNDVI. Returns 23 deterministic values per point derived
+    from its coordinates and year, without calling Earth Engine.
+    """
+
+    def series(self, points):
+        series = {}
+        for key, lat, lon, year in points:
+            seed = int(abs(lat * 1000) + abs(lon * 1000) + year)
+            series[key] = [(seed * (i + 7)) % 9000 if (seed + i) % 11 else None
+                           for i in range(23)]
+        return series
+
+
+NDVI_BACKENDS = {
+    'earthengine': EarthEngineNDVI,
+    'fake': FakeNDVI,
+}
+
+
+def get_ndvi_backend():
+    """
+    Returns the ndvi backend named by the NDVI_BACKEND setting.
+    :return: EarthEngineNDVI or FakeNDVI
+    """
+    return NDVI_BACKENDS[current_app.config.get('NDVI_BACKEND', 'earthengine')]()
+
+
 def add_ndvi_band(image):
     ndvi = image.normalizedDifference(['B5', 'B4'])
     image = image.addBands(ndvi, ['NDVI'])
@@ -83,28 +269,78 @@ def add_tassel_cap_band(image):
 
 def build_cache_key(**kwargs):
     """
-    Builds a unique key for the map to go into the cache.
+    Builds a unique key for the map to go into the cache. Arguments are sorted by name and
+    values compared as strings so the same map always has the same key.
     :param kwargs:
-    :return:
+    :return: String
     """
-    # todo may return different order
-    return "map_" + ".".join([str(v) for k, v in kwargs.items()])
+    canonical = u'&'.join(u'%s=%s' % (k, kwargs[k]) for k in sorted(kwargs))
+    return "map_" + hashlib.sha1(canonical.encode('utf-8')).hexdigest()
 
 
 def get_map(**kwargs):
     """
-    Gets map from cache if it exists or calls method to build it.
+    Gets map from cache if it exists or calls method to build it. Maps older than
+    MAP_ID_REFRESH are rebuilt in the background by tasks.maps.refresh_map so they are
+    replaced before they expire.
     :param kwargs:
     :return:
     """
     key = build_cache_key(**kwargs)
-    map_id = cache.get(key)
-    if map_id is None:
-        map_id = build_map(**kwargs)
-        cache.set(key, map_id, timeout=60 * 60 * 12)
+    entry = cache.get(key)
+    if entry is None:
+        return _flight.do(key, lambda: build_cached_map(key, **kwargs))
+
+    built, map_id = entry
+    if time.time() - built > current_app.config['MAP_ID_REFRESH'] and \
+            cache.add(key + '_lock', True, timeout=current_app.config['MAP_ID_LOCK_TIMEOUT']):
+        from croplands_api.tasks.maps import refresh_map
+        try:
+            refresh_map.delay(kwargs)
+        except Exception as e:
+            print e
+            cache.delete(key + '_lock')
     return map_id
 
 
+def build_cached_map(key, **kwargs):
+    """
+    Builds a map and caches it. One process builds a map at a time, the others wait for
+    its result instead of calling earth engine too. A caller that has waited
+    MAP_ID_LOCK_TIMEOUT assumes the build failed and builds the map without the lock.
+    :param key: String from build_cache_key
+    :param kwargs: build_map arguments
+    :return: mapid object
+    """
+    lock = key + '_lock'
+    token = uuid.uuid4().hex
+    timeout = current_app.config['MAP_ID_LOCK_TIMEOUT']
+    deadline = time.time() + timeout
+    locked = cache.add(lock, token, timeout=timeout)
+    while not locked:
+        time.sleep(0.1)
+        entry = cache.get(key)
+        if entry is not None:
+            return entry[1]
+        if time.time() > deadline:
+            break
+        locked = cache.add(lock, token, timeout=timeout)
+
+    try:
+        # built while waiting for the lock
+        entry = cache.get(key)
+        if entry is not None:
+            return entry[1]
+
+        map_id = build_map(**kwargs)
+        cache.set(key, (time.time(), map_id), timeout=current_app.config['MAP_ID_TIMEOUT'])
+        return map_id
+    finally:
+        # only release a lock this call holds, it may have expired and been taken since
+        if locked and cache.get(lock) == token:
+            cache.delete(lock)
+
+
 def build_map(**kwargs):
     """
     Creates a map in Google Earth Engine using the python api and returns the map id and token.
@@ -150,4 +386,27 @@ def build_url(map_id, token, x, y, z):
     :param z: int
     :return: String
     """
-    return '%s/map/%s/%d/%d/%d?token=%s' % (BASE_URL, map_id, z, x, y, token)
\ No newline at end of file
+    return '%s/map/%s/%d/%d/%d?token=%s' % (BASE_URL, map_id, z, x, y, token)
+
+
+def get_tile(map_args, x, y, z):
+    """
+    Returns a map tile from the tile cache, fetching it from earth engine on a miss. The map
+    is only looked up on a miss so cached tiles never call earth engine.
+    :param map_args: dict of get_map arguments
+    :param x: int
+    :param y: int
+    :param z: int
+    :return: Tile
+    """
+    def fetch():
+        map_id = get_map(**map_args)
+        response = http_session().get(build_url(map_id['mapid'], map_id['token'], x, y, z),
+                                      timeout=30)
+        if response.status_code != 200:
+            raise TileNotFound(error='Tile Not Found',
+                               description='Tile %d/%d/%d is not available.' % (z, x, y),
+                               status_code=404 if response.status_code == 404 else 502)
+        return Tile(response.content, response.headers.get('content-type', 'image/png'))
+
+    return cached_tile(tile_key('gee', build_cache_key(**map_args), z, x, y), fetch)
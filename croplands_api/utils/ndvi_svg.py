@@ -0,0 +1,97 @@
+import numpy as np
+
+NDVI_LENGTH = 23
+INTERVAL_WIDTH = 52.17
+
+# "x y" of every vertex, indexed by composite * 1001 + y
+_X = [int(i * INTERVAL_WIDTH) for i in range(NDVI_LENGTH)]
+_VERTICES = np.array(['%d %d' % (x, y) for x in _X for y in range(1001)], dtype=object)
+
+SVG_TEMPLATE = '''<svg viewbox="0 0 1500 1210" preserveAspectRatio="xMidYMid meet">
+                <g transform="translate(20,20)">
+                    <g class="paths" fill="none" stroke="black" stroke-width="2" transform="translate(150,0)">%s</g>
+                    <g class="y labels" font-size="45">
+                        <text x="90" y="40"  text-anchor="end" alignment-baseline="start">1</text>
+                        <text x="90" y="280" text-anchor="end" alignment-baseline="start">0.75</text>
+                        <text x="90" y="530" text-anchor="end" alignment-baseline="start">0.5</text>
+                        <text x="90" y="780" text-anchor="end" alignment-baseline="start">0.25</text>
+                        <text x="90" y="1010" text-anchor="end" alignment-baseline="start">0</text>
+                    </g>
+                    <polyline class="axis" fill="none" stroke="#000000" points="110,10 110,1000 1330,1000 "></polyline>
+                    <g class="y labels" font-size="45">
+                        <text x="115" y="1050" alignment-baseline="start">Jan</text>
+                        <text x="215" y="1050" alignment-baseline="start">Feb</text>
+                        <text x="315" y="1050" alignment-baseline="start">Mar</text>
+                        <text x="415" y="1050" alignment-baseline="start">Apr</text>
+                        <text x="515" y="1050" alignment-baseline="start">May</text>
+                        <text x="615" y="1050" alignment-baseline="start">Jun</text>
+                        <text x="715" y="1050" alignment-baseline="start">Jul</text>
+                        <text x="815" y="1050" alignment-baseline="start">Aug</text>
+                        <text x="915" y="1050" alignment-baseline="start">Sep</text>
+                        <text x="1015" y="1050" alignment-baseline="start">Oct</text>
+                        <text x="1115" y="1050" alignment-baseline="start">Nov</text>
+                        <text x="1215" y="1050" alignment-baseline="start">Dec</text>
+                    </g>
+                </g>
+                <g data-temporal-bounds transform="translate(150,0)" data-intervals="23" data-interval-width="52.17"></g>
+                  Sorry, your browser does not support inline SVG.
+            </svg>'''
+
+
+def to_matrix(series):
+    """
+    Stacks ndvi series into a float matrix with nan for missing values. Missing series are
+    skipped and short series padded.
+    :param series: iterable of lists of ints or None
+    :return: numpy array of shape (n, 23)
+    """
+    rows = [[np.nan if v is None else v for v in s] for s in series if s is not None]
+    matrix = np.full((len(rows), NDVI_LENGTH), np.nan)
+    for i, row in enumerate(rows):
+        matrix[i, :len(row)] = row[:NDVI_LENGTH]
+    return matrix
+
+
+def render_paths(series):
+    """
+    Builds one svg path for every run of consecutive values of every series. Vertices are
+    computed for the whole matrix at once and looked up from a table of strings.
+    :param series: iterable of lists of ints or None
+    :return: String
+    """
+    matrix = to_matrix(series)
+    if not matrix.size:
+        return ''
+
+    valid = ~np.isnan(matrix)
+    y = 1000 - np.clip(np.where(valid, matrix, 0), 3, 1000).astype(int)
+    vertices = _VERTICES[np.arange(NDVI_LENGTH) * 1001 + y]
+
+    # runs of valid values, a column of False between rows keeps runs within a series
+    padded = np.zeros((valid.shape[0], NDVI_LENGTH + 1), dtype=bool)
+    padded[:, :NDVI_LENGTH] = valid
+    edges = np.diff(np.concatenate([[False], padded.ravel()]).astype(np.int8))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+
+    flat = np.zeros(padded.shape, dtype=object)
+    flat[:, :NDVI_LENGTH] = vertices
+    flat = flat.ravel()
+
+    paths = []
+    for start, end in zip(starts, ends):
+        run = flat[start:end]
+        d = 'M' + run[0]
+        if len(run) > 1:
+            d += 'L' + ' '.join(run[1:])
+        paths.append('<path d="' + d + '"/>')
+    return ''.join(paths)
+
+
+def render_svg(series):
+    """
+    Renders ndvi series as an svg chart.
+    :param series: iterable of lists of ints or None
+    :return: String
+    """
+    return SVG_TEMPLATE % render_paths(series)
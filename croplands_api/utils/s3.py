@@ -1,12 +1,9 @@
 import cStringIO
 import base64
-import boto
-from boto.s3.key import Key
 from PIL import Image
 from flask import current_app
+from croplands_api.utils.storage import get_storage, gzip_chunks
 import uuid
-import StringIO
-import gzip
 
 
 def upload_image(img=None, encoded_image=True, filename='images/' + str(uuid.uuid4()) + '.JPG', public=True,
@@ -22,6 +19,19 @@ def upload_image(img=None, encoded_image=True, filename='images/' + str(uuid.uui
     :param content_type: http content type
     :return:
     """
+    return get_storage().put(filename, resize_image(img, encoded_image),
+                             metadata={'cache-control': cache_control,
+                                       'content-type': content_type},
+                             public=public)
+
+
+def resize_image(img, encoded_image=True):
+    """
+    Shrinks an image to fit in 1200 by 1200 and re-encodes it as jpeg.
+    :param img: data for image
+    :param encoded_image: if base64 encoded image
+    :return: String of jpeg bytes
+    """
     # in memory file
     f = cStringIO.StringIO()
 
@@ -31,29 +41,11 @@ def upload_image(img=None, encoded_image=True, filename='images/' + str(uuid.uui
         img = Image.open(cStringIO.StringIO(img))
     else:
         img = Image.open(img)
-        
-    img.convert("RGB")
+
+    img = img.convert("RGB")
     img.thumbnail((1200, 1200))
     img.save(f, 'JPEG', quality=75)
-
-    # Connect to google storage
-    gs = boto.connect_gs(current_app.config['GS_ACCESS_KEY'],
-                         current_app.config['GS_SECRET'])
-
-    # Get bucket
-    bucket = gs.get_bucket(current_app.config['BUCKET'])
-
-    # create file
-    gs_file = Key(bucket)
-    gs_file.key = filename
-    gs_file.set_metadata('cache-control', cache_control)
-    gs_file.set_metadata('content-type', content_type)
-    gs_file.set_contents_from_string(f.getvalue())
-
-    if public:
-        gs_file.make_public()
-
-    return gs_file
+    return f.getvalue()
 
 
 def delete_image(key):
@@ -62,18 +54,16 @@ def delete_image(key):
     :param key:
     :return: None
     """
-    # Connect to S3
-    gs = boto.connect_gs(current_app.config['GS_ACCESS_KEY'],
-                         current_app.config['GS_SECRET'])
+    get_storage(current_app.config['AWS_S3_BUCKET']).delete(key)
 
-    # Get bucket
-    bucket = gs.get_bucket(current_app.config['AWS_S3_BUCKET'])
 
-    gs_file = Key(bucket)
-
-    gs_file.key = key
-
-    bucket.delete_key(gs_file)
+def delete_file_from_s3(key):
+    """
+    Deletes a key (file) from the bucket files are uploaded to by upload_file_to_s3.
+    :param key: string filename
+    :return: None
+    """
+    get_storage().delete(key)
 
 
 def upload_file_to_s3(contents, key, content_type, do_gzip=True, max_age=300, public=True):
@@ -86,33 +76,25 @@ def upload_file_to_s3(contents, key, content_type, do_gzip=True, max_age=300, pu
     :param public: boolean
     :return:
     """
+    return upload_stream_to_s3([contents], key, content_type, do_gzip=do_gzip,
+                               max_age=max_age, public=public)
 
-    # fake a file for gzip
-    out = StringIO.StringIO()
 
+def upload_stream_to_s3(chunks, key, content_type, do_gzip=True, max_age=300, public=True):
+    """
+    Puts a file in s3 as it is produced, compressing on the fly. Only one upload part is
+    held in memory so exports can stream straight from a database cursor.
+    :param chunks: iterable of strings
+    :param key: string filename to use
+    :param content_type:
+    :param do_gzip: boolean
+    :param max_age: int for cache max age
+    :param public: boolean
+    :return:
+    """
+    metadata = {'content-type': content_type, 'cache-control': 'max-age=%d' % max_age}
     if do_gzip:
-        with gzip.GzipFile(fileobj=out, mode="w") as outfile:
-            outfile.write(contents)
-    else:
-        out.write(contents)
-
-    gs = boto.connect_gs(current_app.config['GS_ACCESS_KEY'],
-                         current_app.config['GS_SECRET'])
-
-    # Get bucket
-    bucket = gs.get_bucket(current_app.config['BUCKET'])
-
-    # Create key
-    k = Key(bucket)
-    k.key = key
-
-    # metadata
-    k.set_metadata('content-type', content_type)
-    k.set_metadata('cache-control', 'max-age=%d' % max_age)
-    k.set_metadata('content-encoding', 'gzip')
-
-    # upload file
-    k.set_contents_from_string(out.getvalue())
+        metadata['content-encoding'] = 'gzip'
+        chunks = gzip_chunks(chunks)
 
-    if public:
-        k.make_public()
\ No newline at end of file
+    return get_storage().put_stream(key, chunks, metadata=metadata, public=public)
@@ -0,0 +1,62 @@
+from flask import current_app
+from croplands_api import cache
+from croplands_api.models import ExportState
+import urllib
+
+# snapshots built before keys were stored unquoted are under 'snapshots', this name makes
+# every partition build again and downloads query the database until it has been built
+SNAPSHOT_EXPORT = 'snapshots_unquoted'
+
+# one partition per country and year plus one per country with every year, public rows only
+SNAPSHOT_FINGERPRINT = """
+    SELECT s.country || '|' || coalesce(CAST(s.year AS text), 'all'), count(*), max(s.id),
+           max(r.date_updated), max(l.date_edited)
+    FROM record_search s
+    JOIN record r ON r.id = s.id
+    JOIN location l ON l.id = s.location_id
+    WHERE s.use_validation IS FALSE AND s.country IS NOT NULL AND s.date_created < :before
+    GROUP BY GROUPING SETS ((s.country, s.year), (s.country))
+    """
+
+
+def snapshot_partition(country, year=None):
+    return '%s|%s' % (country, 'all' if year is None else year)
+
+
+def snapshot_key(partition):
+    """
+    Bucket key of a snapshot, the country is not quoted since storage quotes keys itself.
+    :param partition: String from snapshot_partition
+    :return: utf-8 String
+    """
+    country, year = partition.rsplit('|', 1)
+    return (u'public/snapshots/%s/%s.csv' % (country, year)).encode('utf-8')
+
+
+def snapshot_url(partition):
+    """
+    Public url of a snapshot.
+    :param partition: String from snapshot_partition
+    :return: String
+    """
+    return current_app.config['DATA_SNAPSHOT_URL'] % {
+        'bucket': current_app.config['BUCKET'],
+        'key': urllib.quote(snapshot_key(partition), safe='/')
+    }
+
+
+def snapshot_count(partition):
+    """
+    Returns the number of rows in the current snapshot of a partition or None if there is
+    no snapshot. Counts are the first value of the export fingerprint and are cached so
+    serving a snapshot does not query the database.
+    :param partition: String from snapshot_partition
+    :return: int or None
+    """
+    key = 'snapshot_count_' + partition.encode('utf-8').encode('hex')
+    count = cache.get(key)
+    if count is None:
+        state = ExportState.query.get((SNAPSHOT_EXPORT, partition))
+        count = int(state.fingerprint.split('|')[0]) if state is not None else -1
+        cache.set(key, count, timeout=current_app.config['DATA_SNAPSHOT_MAX_AGE'])
+    return count if count >= 0 else None
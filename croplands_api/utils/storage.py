@@ -0,0 +1,306 @@
+from flask import current_app
+import boto
+from boto.s3.key import Key
+import threading
+import abc
+import StringIO
+import errno
+import json
+import zlib
+import os
+
+# credentials of each provider, gs is where uploads have always gone
+PROVIDERS = {
+    'gs': (boto.connect_gs, 'GS_ACCESS_KEY', 'GS_SECRET'),
+    's3': (boto.connect_s3, 'AWS_ACCESS_KEY_ID', 'AWS_SECRET_ACCESS_KEY'),
+}
+
+# s3 multipart parts must be at least 5MB except the last
+UPLOAD_PART_SIZE = 8 * 1024 * 1024
+
+_local = threading.local()
+
+
+def gzip_chunks(chunks, level=6):
+    """
+    Compresses an iterable of strings into gzip as it is consumed.
+    :param chunks: iterable of strings
+    :param level: zlib compression level
+    :return: generator of strings
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def join_chunks(chunks, size):
+    """
+    Joins an iterable of strings into strings of at least size, except the last.
+    :param chunks: iterable of strings
+    :param size: minimum length
+    :return: generator of strings
+    """
+    pending = []
+    length = 0
+    for chunk in chunks:
+        pending.append(chunk)
+        length += len(chunk)
+        if length >= size:
+            yield ''.join(pending)
+            pending = []
+            length = 0
+    if pending:
+        yield ''.join(pending)
+
+
+class ChunkReader(object):
+    """
+    Read only file over an iterable of strings.
+    """
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.pending = ''
+
+    def read(self, size=-1):
+        parts = [self.pending]
+        length = len(self.pending)
+        while size < 0 or length < size:
+            try:
+                chunk = next(self.chunks)
+            except StopIteration:
+                break
+            parts.append(chunk)
+            length += len(chunk)
+
+        data = ''.join(parts)
+        if size < 0:
+            self.pending = ''
+            return data
+        self.pending = data[size:]
+        return data[:size]
+
+
+class Storage(object):
+    """
+    Object storage bucket. Metadata are http headers served with the object.
+    """
+    __metaclass__ = abc.ABCMeta
+
+    @abc.abstractmethod
+    def put(self, key, contents, metadata=None, public=False):
+        """
+        Writes an object, replacing any existing one.
+        :param key: String
+        :param contents: String
+        :param metadata: dict of header to value, e.g. content-type and cache-control
+        :param public: readable without credentials
+        :return: object with the key in its key attribute
+        """
+
+    def put_stream(self, key, chunks, metadata=None, public=False):
+        """
+        Writes an object from an iterable of strings without holding it in memory.
+        :param key: String
+        :param chunks: iterable of strings
+        :param metadata: dict of header to value
+        :param public: readable without credentials
+        :return: object with the key in its key attribute
+        """
+        return self.put(key, ''.join(chunks), metadata=metadata, public=public)
+
+    @abc.abstractmethod
+    def get(self, key):
+        """
+        :param key: String
+        :return: String or None if there is no such object
+        """
+
+    @abc.abstractmethod
+    def delete(self, key):
+        """
+        Deletes an object, missing objects are ignored.
+        :param key: String
+        """
+
+
+class BotoStorage(Storage):
+    """
+    Bucket of google storage or s3. The connection keeps a pool of http connections to the
+    provider so requests after the first reuse an open tls connection, and the bucket
+    handle is created without the HEAD request get_bucket makes to validate it.
+    """
+
+    def __init__(self, connection, bucket_name):
+        self.connection = connection
+        self.bucket = connection.get_bucket(bucket_name, validate=False)
+
+    def put(self, key, contents, metadata=None, public=False):
+        k = Key(self.bucket)
+        k.key = key
+        for name, value in (metadata or {}).items():
+            k.set_metadata(name, value)
+        k.set_contents_from_string(contents)
+        if public:
+            k.make_public()
+        return k
+
+    def put_stream(self, key, chunks, metadata=None, public=False):
+        """
+        Google storage accepts a chunked transfer of unknown length, s3 needs a multipart
+        upload of UPLOAD_PART_SIZE parts.
+        """
+        if not self.connection.provider.supports_chunked_transfer():
+            return self._put_multipart(key, chunks, metadata, public)
+
+        k = Key(self.bucket)
+        k.key = key
+        for name, value in (metadata or {}).items():
+            k.set_metadata(name, value)
+        k.set_contents_from_stream(ChunkReader(chunks))
+        if public:
+            k.make_public()
+        return k
+
+    def _put_multipart(self, key, chunks, metadata, public):
+        # standard headers such as content-type are sent as is, the rest as user metadata
+        headers = {}
+        user_metadata = {}
+        for name, value in (metadata or {}).items():
+            if name.lower() in Key.base_user_settable_fields:
+                headers[name] = value
+            else:
+                user_metadata[name] = value
+
+        upload = self.bucket.initiate_multipart_upload(key, headers=headers,
+                                                       metadata=user_metadata,
+                                                       policy='public-read' if public else None)
+        try:
+            part_number = 0
+            for part in join_chunks(chunks, UPLOAD_PART_SIZE):
+                part_number += 1
+                upload.upload_part_from_file(StringIO.StringIO(part), part_number)
+            if not part_number:
+                upload.upload_part_from_file(StringIO.StringIO(''), 1)
+            upload.complete_upload()
+        except Exception:
+            upload.cancel_upload()
+            raise
+
+        k = Key(self.bucket)
+        k.key = key
+        return k
+
+    def get(self, key):
+        k = self.bucket.get_key(key)
+        return k.get_contents_as_string() if k is not None else None
+
+    def delete(self, key):
+        self.bucket.delete_key(key)
+
+
+class LocalKey(object):
+    def __init__(self, key, path):
+        self.key = key
+        self.path = path
+
+
+class LocalStorage(Storage):
+    """
+    Bucket in a directory of the local filesystem for tests and development. Metadata are
+    kept next to each object in a json file.
+    """
+
+    def __init__(self, root, bucket_name):
+        self.root = os.path.join(root, bucket_name)
+
+    def path(self, key):
+        path = os.path.normpath(os.path.join(self.root, key.lstrip('/')))
+        if not path.startswith(os.path.normpath(self.root) + os.sep):
+            raise ValueError('Key outside of bucket: %s' % key)
+        return path
+
+    def put(self, key, contents, metadata=None, public=False):
+        return self.put_stream(key, [contents], metadata=metadata, public=public)
+
+    def put_stream(self, key, chunks, metadata=None, public=False):
+        path = self.path(key)
+        try:
+            os.makedirs(os.path.dirname(path))
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+        with open(path, 'wb') as f:
+            for chunk in chunks:
+                f.write(chunk)
+        with open(path + '.meta', 'w') as f:
+            json.dump({'metadata': metadata or {}, 'public': public}, f)
+        return LocalKey(key, path)
+
+    def get(self, key):
+        try:
+            with open(self.path(key), 'rb') as f:
+                return f.read()
+        except IOError as e:
+            if e.errno == errno.ENOENT:
+                return None
+            raise
+
+    def metadata(self, key):
+        with open(self.path(key) + '.meta') as f:
+            return json.load(f)['metadata']
+
+    def delete(self, key):
+        for path in (self.path(key), self.path(key) + '.meta'):
+            try:
+                os.remove(path)
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+
+
+def _connection(provider):
+    """
+    Connection to a provider shared by every bucket in this thread. Connections are not
+    shared between threads or inherited by forked worker processes.
+    """
+    if getattr(_local, 'pid', None) != os.getpid():
+        _local.pid = os.getpid()
+        _local.connections = {}
+        _local.buckets = {}
+
+    if provider not in _local.connections:
+        connect, access_key, secret = PROVIDERS[provider]
+        _local.connections[provider] = connect(current_app.config[access_key],
+                                               current_app.config[secret])
+    return _local.connections[provider]
+
+
+def get_storage(bucket=None, provider='gs'):
+    """
+    Returns the storage of a bucket, created once per process and thread. With
+    STORAGE_BACKEND set to local every bucket is a directory in STORAGE_ROOT.
+    :param bucket: bucket name, defaults to BUCKET
+    :param provider: gs or s3
+    :return: Storage
+    """
+    bucket = bucket or current_app.config['BUCKET']
+
+    if current_app.config.get('STORAGE_BACKEND') == 'local':
+        return LocalStorage(current_app.config['STORAGE_ROOT'], bucket)
+
+    connection = _connection(provider)
+    if (provider, bucket) not in _local.buckets:
+        _local.buckets[(provider, bucket)] = BotoStorage(connection, bucket)
+    return _local.buckets[(provider, bucket)]
+
+
+def reset_storage():
+    """
+    Drops the connections and buckets of this thread, e.g. after changing credentials.
+    """
+    _local.pid = None
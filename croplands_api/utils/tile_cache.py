@@ -0,0 +1,286 @@
+from flask import current_app
+from croplands_api import cache
+from requests.adapters import HTTPAdapter
+from contextlib import contextmanager
+import requests
+import threading
+import tempfile
+import hashlib
+import fcntl
+import errno
+import json
+import time
+import uuid
+import os
+
+_local = threading.local()
+
+
+def http_session():
+    """
+    Keep-alive session shared by tile fetches in this process and thread.
+    :return: requests.Session
+    """
+    if getattr(_local, 'pid', None) != os.getpid():
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=8, pool_maxsize=32)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        _local.session = session
+        _local.pid = os.getpid()
+    return _local.session
+
+
+def tile_key(*parts):
+    """
+    Hash of the parts identifying a tile, dicts are hashed independent of key order.
+    :param parts: json serializable values
+    :return: String
+    """
+    return hashlib.sha1(json.dumps(parts, sort_keys=True)).hexdigest()
+
+
+class Tile(object):
+    def __init__(self, content, content_type, created=None):
+        self.content = content
+        self.content_type = content_type
+        self.created = created if created is not None else time.time()
+
+
+class DiskTileCache(object):
+    """
+    Tiles in files under a directory, evicted least recently used first once the directory
+    grows past max_bytes. Reads touch the file so its modification time is the last use.
+    The size is tracked per process and recounted whenever it reaches the limit, several
+    processes sharing a directory only delay eviction.
+    """
+
+    def __init__(self, root, max_bytes, max_age=None):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.size = None
+
+    def path(self, key):
+        return os.path.join(self.root, key[:2], key)
+
+    def get(self, key):
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as f:
+                content_type, created = f.readline().rstrip('\n').rsplit(' ', 1)
+                content = f.read()
+            os.utime(path, None)
+        except (IOError, OSError, ValueError):
+            return None
+
+        if self.max_age is not None and float(created) + self.max_age < time.time():
+            return None
+        return Tile(content, content_type, float(created))
+
+    def set(self, key, tile):
+        path = self.path(key)
+        try:
+            os.makedirs(os.path.dirname(path))
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+        # readers never see a partial file
+        header = '%s %f\n' % (tile.content_type, tile.created)
+        fd, temp = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, 'wb') as f:
+            f.write(header)
+            f.write(tile.content)
+        os.rename(temp, path)
+
+        if self.size is not None:
+            self.size += len(header) + len(tile.content)
+        if self.size is None or self.size > self.max_bytes:
+            self.evict()
+
+    def evict(self):
+        """
+        Deletes the least recently used tiles until the cache is 90% of max_bytes.
+        """
+        files = []
+        for directory, _, names in os.walk(self.root):
+            for name in names:
+                if name.endswith('.lock'):
+                    continue
+                path = os.path.join(directory, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+
+        self.size = sum(f[1] for f in files)
+        if self.size <= self.max_bytes:
+            return
+
+        for _, size, path in sorted(files):
+            if self.size <= self.max_bytes * 0.9:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            self.size -= size
+
+    def lock_path(self, key):
+        # tiles share a fixed set of 4096 lock files so they do not pile up with the tiles
+        return os.path.join(self.root, key[:2], key[:3] + '.lock')
+
+    @contextmanager
+    def lock(self, key):
+        """
+        Lock of a tile held by one process on this machine at a time. Tiles whose keys
+        start with the same three characters share a lock.
+        """
+        path = self.lock_path(key)
+        try:
+            os.makedirs(os.path.dirname(path))
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+        with open(path, 'w') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class RedisTileCache(object):
+    """
+    Tiles in the application cache. Redis bounds its size when configured with maxmemory
+    and an lru eviction policy.
+    """
+
+    def __init__(self, timeout, lock_timeout=30):
+        self.timeout = timeout
+        self.lock_timeout = lock_timeout
+
+    def get(self, key):
+        value = cache.get('tile_' + key)
+        return Tile(*value) if value is not None else None
+
+    def set(self, key, tile):
+        cache.set('tile_' + key, (tile.content, tile.content_type, tile.created),
+                  timeout=self.timeout)
+
+    @contextmanager
+    def lock(self, key):
+        """
+        Lock of a tile held by one process at a time, taken with cache.add. A caller that
+        has waited lock_timeout assumes the holder failed and goes ahead without the lock.
+        """
+        name = 'tile_lock_' + key
+        token = uuid.uuid4().hex
+        deadline = time.time() + self.lock_timeout
+        locked = cache.add(name, token, timeout=self.lock_timeout)
+        while not locked and time.time() < deadline:
+            time.sleep(0.05)
+            locked = cache.add(name, token, timeout=self.lock_timeout)
+
+        try:
+            yield
+        finally:
+            # only release a lock this call holds, it may have expired and been taken since
+            if locked and cache.get(name) == token:
+                cache.delete(name)
+
+
+class SingleFlight(object):
+    """
+    Runs a function once for concurrent calls with the same key in this process, the other
+    callers wait for and share its result.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+
+    def do(self, key, fn):
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = {'done': threading.Event()}
+
+        if not leader:
+            call['done'].wait()
+            if 'error' in call:
+                raise call['error']
+            return call['result']
+
+        try:
+            call['result'] = fn()
+            return call['result']
+        except Exception as e:
+            call['error'] = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call['done'].set()
+
+
+_flight = SingleFlight()
+_caches = {}
+
+
+def get_tile_cache():
+    """
+    Tile cache configured by TILE_CACHE_BACKEND, disk, redis or None to disable caching.
+    :return: DiskTileCache, RedisTileCache or None
+    """
+    backend = current_app.config.get('TILE_CACHE_BACKEND')
+    if backend is None:
+        return None
+
+    settings = (backend,
+                current_app.config['TILE_CACHE_DIR'],
+                current_app.config['TILE_CACHE_MAX_BYTES'],
+                current_app.config['TILE_CACHE_MAX_AGE'])
+    if settings not in _caches:
+        if backend == 'disk':
+            _caches[settings] = DiskTileCache(*settings[1:])
+        elif backend == 'redis':
+            _caches[settings] = RedisTileCache(current_app.config['TILE_CACHE_MAX_AGE'],
+                                               current_app.config['TILE_CACHE_LOCK_TIMEOUT'])
+        else:
+            raise ValueError('Unknown tile cache backend %s' % backend)
+    return _caches[settings]
+
+
+def cached_tile(key, fetch):
+    """
+    Returns a tile from the cache or fetches it. Concurrent misses for the same tile make a
+    single fetch, in this process through SingleFlight and across processes through the
+    cache's lock, a file lock on this machine for disk and a cache.add lock for redis.
+    Only tiles returned by fetch are cached, fetch raises for anything that should not be.
+    :param key: String from tile_key
+    :param fetch: callable returning a Tile
+    :return: Tile
+    """
+    tile_cache = get_tile_cache()
+    if tile_cache is None:
+        return fetch()
+
+    tile = tile_cache.get(key)
+    if tile is not None:
+        return tile
+
+    def load():
+        with tile_cache.lock(key):
+            # filled while waiting for the lock
+            loaded = tile_cache.get(key)
+            if loaded is None:
+                loaded = fetch()
+                tile_cache.set(key, loaded)
+            return loaded
+
+    return _flight.do(key, load)
@@ -1,8 +1,9 @@
 from croplands_api import api
 from croplands_api.models import Image, ImageClassification
 from croplands_api.exceptions import ImageProcessingError
-from croplands_api.utils.s3 import upload_image
+from croplands_api.tasks.images import store_raw_image, queue_image
 from processors import api_roles, add_user_to_posted_data, debug_post
+import base64
 import uuid
 from flask import request
 from croplands_api.tasks.classifications import compute_image_classification_statistics
@@ -26,24 +27,32 @@ def insert_ip(data=None, **kwargs):
 def check_for_base64(data=None, **kwargs):
     """
     Checks if data['image'] is in posted data. If it is a base64 encoded image,
-    it will be processed and uploaded to s3.
+    the original is stored and the image is processed and uploaded to s3 by a task.
 
     :param data:
     :param kwargs:
     :return: None
     """
+    # only set here
+    data.pop('status', None)
 
     if 'image' in data:
         filename = 'img/' + str(uuid.uuid4()) + '.JPG'
         try:
-            upload_image(data['image'], encoded_image=True, filename=filename)
+            store_raw_image(base64.b64decode(data['image']), filename)
         except:
             raise ImageProcessingError()
         else:
             data['url'] = filename
+            data['status'] = 'pending'
         del data['image']
 
 
+def process_pending_image(result=None, **kwargs):
+    if result.get('status') == 'pending':
+        queue_image(result['id'])
+
+
 def create(app):
     api.create_api(Image,
                    app=app,
@@ -55,6 +64,9 @@ def create(app):
                        'PATCH_SINGLE': [api_roles(['mapping', 'validation', 'admin'])],
                        'PATCH_MANY': [api_roles('admin')]
                    },
+                   postprocessors={
+                       'POST': [process_pending_image]
+                   }
     )
 
     api.create_api(ImageClassification,
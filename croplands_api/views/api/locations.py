@@ -2,10 +2,7 @@ from croplands_api import api
 from croplands_api.models import Location
 from processors import api_roles, add_user_to_posted_data, remove_relations, debug_post
 from records import save_record_state_to_history
-from croplands_api.utils.s3 import upload_image
-import requests
-import uuid
-import cStringIO
+from croplands_api.tasks.images import queue_image
 
 def process_records(result=None, **kwargs):
     """
@@ -40,15 +37,17 @@ def check_for_street_view_image(data=None, **kwargs):
     if 'images' not in data:
         return
 
+    # fetched and copied to the bucket by a task, the remote url is kept until then
     for image in data['images']:
+        image.pop('status', None)
         if 'source' in image and image['source'] == 'streetview':
-            try:
-                r = requests.get(image['url'])
-                if r.status_code == 200:
-                    url = 'images/streetview/' + str(uuid.uuid4()) + '.jpg'
-                    image['url'] = upload_image(cStringIO.StringIO(r.content), encoded_image=False, filename=url).key
-            except Exception as e:
-                print(e)
+            image['status'] = 'pending'
+
+
+def process_pending_images(result=None, **kwargs):
+    for image in result.get('images', []):
+        if image.get('status') == 'pending':
+            queue_image(image['id'])
 
 
 def create(app):
@@ -65,7 +64,7 @@ def create(app):
                        'DELETE': [api_roles('admin')]
                    },
                    postprocessors={
-                       'POST': [process_records],
+                       'POST': [process_records, process_pending_images],
                        'PATCH_SINGLE': [],
                        'PATCH_MANY': [],
                        'DELETE': []
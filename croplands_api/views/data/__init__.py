@@ -1,74 +1,231 @@
-from flask import Blueprint, current_app, Response, request, jsonify
-from croplands_api.models import Record, Location
+from flask import Blueprint, current_app, Response, request, jsonify, stream_with_context, \
+    redirect
+from croplands_api.models import RecordSearch
+from croplands_api.models.record import RECORD_COUNT_CACHE_KEY
 from croplands_api import db, cache, limiter
 from croplands_api.exceptions import FieldError
 from requests.models import PreparedRequest
 from flask_jwt import current_user
 from croplands_api.auth import is_anonymous, generate_token
-from sqlalchemy import func, asc, desc
+from croplands_api.utils.csv_encoder import encode_rows
+from croplands_api.utils import arrow_encoder
+from croplands_api.utils.ndvi_svg import render_svg
+from croplands_api.utils.snapshots import snapshot_partition, snapshot_count, snapshot_url
+from sqlalchemy import func, asc, desc, and_, or_
+import base64
+import hashlib
+import json
 import uuid
 import datetime
 
 data_blueprint = Blueprint('data', __name__, url_prefix='/data')
 
-categorical_columns = {"id": Record.id,
-                       "land_use_type": Record.land_use_type,
-                       "crop_primary": Record.crop_primary,
-                       "crop_secondary": Record.crop_secondary,
-                       "water": Record.water,
-                       "intensity": Record.intensity,
-                       "year": Record.year,
-                       "month": Record.month,
-                       "source_type": Record.source_type,
-                       "country": Location.country,
-                       "use_validation": Location.use_validation}
+categorical_columns = {"id": RecordSearch.id,
+                       "land_use_type": RecordSearch.land_use_type,
+                       "crop_primary": RecordSearch.crop_primary,
+                       "crop_secondary": RecordSearch.crop_secondary,
+                       "water": RecordSearch.water,
+                       "intensity": RecordSearch.intensity,
+                       "year": RecordSearch.year,
+                       "month": RecordSearch.month,
+                       "source_type": RecordSearch.source_type,
+                       "country": RecordSearch.country,
+                       "use_validation": RecordSearch.use_validation}
+
+# columns exported by the csv endpoints, in order
+export_columns = [RecordSearch.id, RecordSearch.year, RecordSearch.month, RecordSearch.lat,
+                  RecordSearch.lon, RecordSearch.country, RecordSearch.land_use_type,
+                  RecordSearch.crop_primary, RecordSearch.crop_secondary, RecordSearch.water,
+                  RecordSearch.intensity, RecordSearch.source_type, RecordSearch.source_class,
+                  RecordSearch.source_description, RecordSearch.use_validation]
+export_text_columns = [i for i, c in enumerate(export_columns)
+                       if isinstance(c.property.columns[0].type, db.String)]
+
+# columnar formats are typed and also carry the ndvi series
+columnar_export_columns = export_columns + [RecordSearch.ndvi]
+
+download_formats = {
+    'csv': 'text/csv',
+    'arrow': 'application/vnd.apache.arrow.stream',
+    'parquet': 'application/vnd.apache.parquet'
+}
 
 
 def row_to_list(r, headers=False):
     """
     Flattens query tuple to list
-    :param r: tuple of columns
+    :param r: tuple of export_columns or columnar_export_columns
     :return: list
     """
-
-    # todo should pass columns to this function and have it get the data or headers
-
     if headers:
-        return ['id', 'year', 'month', 'lat', 'lon', 'country', 'land_use_type', 'crop_primary',
-                'crop_secondary',
-                'water', 'intensity', 'source_type', 'source_class', 'source_description',
-                'use_validation']
+        return [c.key for c in export_columns]
 
-    return [r[0].id, r[0].year, r[0].month, round(r[1].lat, 8), round(r[1].lon, 8), r[1].country,
-            r[0].land_use_type,
-            r[0].crop_primary, r[0].crop_secondary,
-            r[0].water, r[0].intensity, r[0].source_type, r[0].source_class,
-            r[0].source_description, r[1].use_validation]
+    r = list(r)
+    r[3], r[4] = round(r[3], 8), round(r[4], 8)
+    return r
 
 
-def safe_for_csv(value):
+def encode_cursor(value, id, order_by, direction):
     """
-    Simple helper for converting to csv value...
-    TODO Find built-in replacement that is more robust
-    :param value: anything
-    :return: string
+    Builds an opaque token marking the last row of a page. The token records the order it
+    was issued for, a cursor only points into the order of the page it came from.
+    :param value: value of the order by column for the last row
+    :param id: record id of the last row
+    :param order_by: name of the order by column
+    :param direction: 'asc' or 'desc'
+    :return: String
     """
-    escape_chars = ["'", "\""]
+    return base64.urlsafe_b64encode(json.dumps([order_by, direction.lower(), value, id]))
+
 
+def decode_cursor(cursor, order_by, direction):
+    """
+    Inverse of encode_cursor, rejecting cursors issued for another order.
+    :param cursor: String
+    :param order_by: name of the order by column of the request
+    :param direction: 'asc' or 'desc' of the request
+    :return: tuple of order by value and record id
+    """
     try:
-        value = value.replace(",", "_")
-    except AttributeError:
-        pass
+        cursor_order_by, cursor_direction, value, id = json.loads(
+            base64.urlsafe_b64decode(str(cursor)))
+        id = int(id)
+    except (TypeError, ValueError):
+        raise FieldError(description="Invalid cursor")
+
+    if cursor_order_by != order_by or cursor_direction != direction.lower():
+        raise FieldError(description="Cursor does not match the order by column or direction")
+    return value, id
+
+
+def cursor_for_row(row, order_by, direction):
+    """
+    Returns the cursor pointing just past a result row.
+    :param row: tuple of export_columns
+    :param order_by: name of the order by column
+    :param direction: 'asc' or 'desc'
+    :return: String
+    """
+    return encode_cursor(getattr(row, categorical_columns[order_by].key), row.id, order_by,
+                         direction)
+
+
+def seek_filter(column, direction, value, id):
+    """
+    Filter selecting the rows after (value, id) in the order (column, id). Nulls sort last
+    when ascending and first when descending, matching postgres.
+    :param column: order by column
+    :param direction: 'asc' or 'desc'
+    :param value: value of the column for the last row seen
+    :param id: record id of the last row seen
+    :return: sqlalchemy expression
+    """
+    if column is RecordSearch.id:
+        return RecordSearch.id < id if direction == 'desc' else RecordSearch.id > id
+
+    if direction == 'desc':
+        if value is None:
+            return or_(column.isnot(None), and_(column.is_(None), RecordSearch.id < id))
+        return or_(column < value, and_(column == value, RecordSearch.id < id))
 
     if value is None:
-        return ""
-    elif any((c in str(value) for c in escape_chars)):
-        return "\"" + str(value) + "\""
-    else:
-        return str(value)
+        return and_(column.is_(None), RecordSearch.id > id)
+    return or_(column > value, and_(column == value, RecordSearch.id > id), column.is_(None))
+
+
+def estimate_count(q):
+    """
+    Returns the postgres planner estimate of the number of rows a query returns.
+    :param q: Query
+    :return: int
+    """
+    statement = q.statement.compile(dialect=db.engine.dialect)
+    cursor = db.session.connection().connection.cursor()
+    try:
+        cursor.execute('EXPLAIN (FORMAT JSON) ' + str(statement), statement.params)
+        plan = cursor.fetchone()[0]
+    finally:
+        cursor.close()
+
+    if isinstance(plan, basestring):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+def sample_start(seed):
+    """
+    Point in [0, 1) of the random key where the sample for a seed starts.
+    :param seed: String
+    :return: float
+    """
+    digest = hashlib.sha1(unicode(seed).encode('utf-8')).hexdigest()
+    return int(digest[:13], 16) / float(16 ** 13)
 
 
-def query(meta=None, filters=None, count_all=False, count_filtered=False):
+def sample(q, seed, offset, limit, stream=False):
+    """
+    Random sample of the rows of a query. Every record has a uniform random key fixed when
+    it was created, so the rows after any point in key order are a random sample. The
+    sample starts at a point chosen by the seed and wraps around to the lowest keys, each
+    part is an index range scan of offset + limit rows instead of sorting every match. The
+    same seed returns the same rows while the records do not change.
+    :param q: filtered query without order
+    :param seed: String
+    :param offset: rows to skip
+    :param limit: rows to return
+    :param stream: return an iterator over server side cursors instead of a list
+    :return: list or iterator
+    """
+    start = sample_start(seed)
+    head = q.filter(RecordSearch.random_key >= start)\
+        .order_by(asc(RecordSearch.random_key), asc(RecordSearch.id))
+    tail = q.filter(RecordSearch.random_key < start)\
+        .order_by(asc(RecordSearch.random_key), asc(RecordSearch.id))
+
+    def fetch(part, part_offset, part_limit):
+        part = part.offset(part_offset).limit(part_limit)
+        if stream:
+            return part.execution_options(stream_results=True)\
+                .yield_per(current_app.config.get('DATA_DOWNLOAD_STREAM_BATCH_SIZE'))
+        return part.all()
+
+    def tail_offset(head_rows):
+        # rows left over from the head only need counting if the offset skipped all of it
+        if head_rows or not offset:
+            return 0
+        return max(0, offset - head.count())
+
+    if not stream:
+        rows = fetch(head, offset, limit)
+        if len(rows) < limit:
+            rows += fetch(tail, tail_offset(len(rows)), limit - len(rows))
+        return rows
+
+    def generate():
+        head_rows = 0
+        for row in fetch(head, offset, limit):
+            head_rows += 1
+            yield row
+        if head_rows < limit:
+            for row in fetch(tail, tail_offset(head_rows), limit - head_rows):
+                yield row
+
+    return generate()
+
+
+def query(meta=None, filters=None, count_all=False, count_filtered=False, columns=None,
+          stream=False, estimate=False):
+    """
+    Queries the denormalized record search table.
+    :param meta: dict of paging and order from get_meta
+    :param filters: dict from get_filters
+    :param count_all: return the count of all records
+    :param count_filtered: return the count of records matching filters
+    :param columns: list of RecordSearch columns to select, defaults to export_columns
+    :param stream: return an iterator over a server side cursor instead of a list
+    :param estimate: counts use the planner estimate instead of count(*)
+    :return: list, iterator or int
+    """
     if filters is None:
         filters = {}
 
@@ -79,23 +236,30 @@ def query(meta=None, filters=None, count_all=False, count_filtered=False):
             "order_by": 'id'
         }
 
-    q = db.session.query(Record, Location)\
-        .join(Location).filter(Location.id == Record.location_id)
+    if columns is None:
+        columns = export_columns
+
+    # single table, record_search is kept in sync with record and location by triggers
+    q = db.session.query(*columns).select_from(RecordSearch)
 
     if count_all:
-        return q.count()
+        return estimate_count(q) if estimate else q.count()
 
     # filter by bounds
     if 'southWestBounds' in filters and 'northEastBounds' in filters:
         south_west = filters['southWestBounds'].split(',')
         north_east = filters['northEastBounds'].split(',')
-        q = q.filter(Location.lat > float(south_west[0]), Location.lon > float(south_west[1]),
-                     Location.lat < float(north_east[0]), Location.lon < float(north_east[1]))
+        q = q.filter(RecordSearch.lat > float(south_west[0]),
+                     RecordSearch.lon > float(south_west[1]),
+                     RecordSearch.lat < float(north_east[0]),
+                     RecordSearch.lon < float(north_east[1]))
 
     if 'ndvi_limit_lower' in filters and 'ndvi_limit_upper' in filters:
         upper = [int(v) for v in filters['ndvi_limit_upper'].split(',')]
         lower = [int(v) for v in filters['ndvi_limit_lower'].split(',')]
-        q = q.filter(func.array_bounds(Record.ndvi, upper, lower))
+        # the envelope prunes with an index, array_bounds is exact
+        q = q.filter(RecordSearch.ndvi_envelope_filter(upper, lower),
+                     func.array_bounds(RecordSearch.ndvi, upper, lower))
 
     for name, column in categorical_columns.iteritems():
         if name not in filters:
@@ -105,37 +269,87 @@ def query(meta=None, filters=None, count_all=False, count_filtered=False):
             q = q.filter(column.in_(values))
 
     if 'delay' in filters and filters['delay']:
-        q = q.filter(Record.date_created < datetime.datetime.utcnow() - current_app.config.get(
-            'DATA_QUERY_DELAY'))
+        q = q.filter(RecordSearch.date_created < datetime.datetime.utcnow() -
+                     current_app.config.get('DATA_QUERY_DELAY'))
         print('delay', datetime.datetime.utcnow() - current_app.config.get(
             'DATA_QUERY_DELAY'))
 
 
     if count_filtered:
-        return q.count()
+        return estimate_count(q) if estimate else q.count()
+
+    if meta.get("order_by_direction", '').lower() == 'rand':
+        return sample(q, meta.get("seed") or uuid.uuid4().hex, meta["offset"], meta["limit"],
+                      stream=stream)
 
-    # order by
-    if meta["order_by"] and meta["order_by"] in categorical_columns or meta[
-        "order_by_direction"] == 'rand':
+    # order by, record id breaks ties so that pages are stable
+    if meta["order_by"] and meta["order_by"] in categorical_columns:
+        column = categorical_columns[meta["order_by"]]
         if meta["order_by_direction"].lower() == 'desc':
-            q = q.order_by(desc(categorical_columns[meta["order_by"]]))
-        elif meta["order_by_direction"].lower() == 'rand':
-            q = q.order_by(func.random())
+            q = q.order_by(desc(column), desc(RecordSearch.id))
         else:
-            q = q.order_by(asc(categorical_columns[meta["order_by"]]))
+            q = q.order_by(asc(column), asc(RecordSearch.id))
     else:
-        q = q.order_by(asc(Record.id))
+        column = RecordSearch.id
+        q = q.order_by(asc(RecordSearch.id))
+
+    # seek past the last row of the previous page instead of scanning the offset
+    if meta.get("cursor") is not None:
+        value, id = meta["cursor"]
+        q = q.filter(seek_filter(column, meta["order_by_direction"].lower(), value, id))
+
+    q = q.offset(meta["offset"]).limit(meta["limit"])
+
+    if stream:
+        # named cursor on the server, rows are fetched in batches as the response is written
+        return q.execution_options(stream_results=True)\
+            .yield_per(current_app.config.get('DATA_DOWNLOAD_STREAM_BATCH_SIZE'))
 
-    results = q.offset(meta["offset"]).limit(meta["limit"]).all()
+    return q.all()
 
-    return results
+
+def filters_hash(filters):
+    """
+    Hash of filters that does not depend on key or value order.
+    :param filters: dict from get_filters
+    :return: String
+    """
+    canonical = dict((k, sorted(v) if isinstance(v, list) else v) for k, v in filters.iteritems())
+    return hashlib.sha256(json.dumps(canonical, sort_keys=True)).hexdigest()
+
+
+def cached_count(filters=None):
+    """
+    Counts all records or those matching filters, memoized in the cache. The total is
+    invalidated when records are inserted or deleted, filtered counts expire.
+    :param filters: dict from get_filters, None for the total
+    :return: int
+    """
+    if filters is None:
+        key = RECORD_COUNT_CACHE_KEY
+        timeout = current_app.config.get('DATA_COUNT_TOTAL_CACHE_TIMEOUT')
+    else:
+        key = 'data_count_' + filters_hash(filters)
+        timeout = current_app.config.get('DATA_COUNT_CACHE_TIMEOUT')
+
+    count = cache.get(key)
+    if count is None:
+        if filters is None:
+            count = query(count_all=True)
+        else:
+            count = query(filters=filters, count_filtered=True)
+        cache.set(key, count, timeout=timeout)
+    return count
 
 
 def result_generator(results):
-    for i, r in enumerate(results):
-        if i == 0:
-            yield ','.join(row_to_list(None, headers=True)) + '\n'
-        yield ','.join([safe_for_csv(c) for c in row_to_list(r)]) + '\n'
+    """
+    Encodes result rows as csv in blocks of rows.
+    :param results: iterable of export_columns tuples
+    :return: generator of strings
+    """
+    return encode_rows((row_to_list(r) for r in results), headers=row_to_list(None, headers=True),
+                       text_columns=export_text_columns)
 
 
 def get_filters():
@@ -186,28 +400,194 @@ def get_meta(page_size=1000):
         raise FieldError(description="Invalid order by column")
     order_by_direction = request.args.get('order_by_direction', 'desc')
 
+    # random samples are repeatable from a seed, pages of one sample share it
+    seed = None
+    if order_by_direction.lower() == 'rand':
+        seed = request.args.get('seed') or uuid.uuid4().hex[:16]
+
+    # keyset paging unless the client asks for a page number or random order
+    cursor = request.args.get('cursor')
+
+    # a download page stores the cursor of the next one once it has been streamed
+    exhausted = False
+    after = request.args.get('after')
+    if after:
+        stored = cache.get(after_cache_key(after))
+        if stored is None:
+            raise FieldError(description="Unknown or unfinished download page")
+        cursor = stored['cursor']
+        exhausted = cursor is None
+
+    if cursor:
+        if order_by_direction.lower() == 'rand':
+            raise FieldError(description="Cursor cannot be used with random order")
+        cursor = decode_cursor(cursor, order_by, order_by_direction)
+        offset = 0
+    else:
+        cursor = None
+
+    if 'page' in request.args or order_by_direction.lower() == 'rand':
+        paging = 'offset'
+    else:
+        paging = 'cursor'
+
+    download_format = request.args.get('format', 'csv')
+    if download_format not in download_formats:
+        raise FieldError(description="Invalid format")
+    if download_format != 'csv' and arrow_encoder.pa is None:
+        raise FieldError(description="Format %s is not available" % download_format)
+
     return {
         "page": page,
         "page_size": page_size,
         "offset": offset,
-        "limit": min(page_size, 1000000),
+        "cursor": cursor,
+        "paging": paging,
+        "count": request.args.get('count', 'exact'),
+        "format": download_format,
+        "limit": 0 if exhausted else min(page_size, 1000000),
         "order_by": order_by,
-        "order_by_direction": order_by_direction
+        "order_by_direction": order_by_direction,
+        "seed": seed
     }
 
 
+def get_next_url(meta, filters, last_row=None, count_filtered=None, after=None):
+    """
+    Builds the url of the next page of results or returns None if this is the last page.
+    In cursor paging the url carries a cursor for the last row, or the token the cursor
+    will be stored under when the last row is not known yet, otherwise the page number.
+    :param meta: dict from get_meta
+    :param filters: dict from get_filters
+    :param last_row: last row of a full page, None if the page is not full
+    :param count_filtered: exact number of rows matching filters if known
+    :param after: token from after_cache_key of a page being streamed
+    :return: String or None
+    """
+    next_url_params = {
+        'page_size': str(meta["limit"]),
+        'order_by': meta["order_by"],
+        'order_by_direction': meta["order_by_direction"]
+    }
+
+    if meta.get("count") == 'estimate':
+        next_url_params['count'] = 'estimate'
+
+    if meta.get("seed") is not None:
+        next_url_params['seed'] = meta["seed"]
+
+    if meta.get("format", 'csv') != 'csv':
+        next_url_params['format'] = meta["format"]
+
+    if meta.get("paging") == 'cursor':
+        if after is not None:
+            next_url_params['after'] = after
+            return build_url(next_url_params, filters)
+        if last_row is None:
+            return None
+        next_url_params['cursor'] = cursor_for_row(last_row, meta["order_by"],
+                                                   meta["order_by_direction"])
+    else:
+        if count_filtered is None and last_row is None:
+            return None
+        if count_filtered is not None and count_filtered <= meta["page"] * meta["limit"]:
+            return None
+        next_url_params['page'] = str(meta["page"] + 1)
+
+    return build_url(next_url_params, filters)
+
+
+def build_url(params, filters):
+    params = dict(params)
+    params.update(filters)
+    next_request = PreparedRequest()
+    next_request.prepare_url(request.base_url, params)
+    return next_request.url
+
+
+def after_cache_key(after):
+    return 'data_after_' + hashlib.sha1(str(after)).hexdigest()
+
+
+def store_cursor_after(rows, meta, after):
+    """
+    Passes rows through and, once the last one has been read, stores the cursor of the next
+    page under the after token. The token of a page shorter than the limit resolves to an
+    empty page. Nothing is stored if the stream is abandoned.
+    :param rows: iterable of export_columns tuples
+    :param meta: dict from get_meta
+    :param after: token given in the Query-Next of the page
+    :return: generator of rows
+    """
+    last_row = None
+    count = 0
+    for row in rows:
+        last_row = row
+        count += 1
+        yield row
+
+    cursor = None
+    if count and count == meta["limit"]:
+        cursor = cursor_for_row(last_row, meta["order_by"], meta["order_by_direction"])
+    cache.set(after_cache_key(after), {'cursor': cursor},
+              timeout=current_app.config.get('DATA_DOWNLOAD_CURSOR_TIMEOUT'))
+
+
+def get_snapshot_url(meta, filters):
+    """
+    Returns the url of the pre-built snapshot holding exactly the rows a download asks for
+    or None if there is none. Snapshots hold the public records of a country, optionally for
+    a single year, ordered by id descending and may lag the database by one build.
+    :param meta: dict from get_meta
+    :param filters: dict from get_filters
+    :return: String or None
+    """
+    if meta.get("format", 'csv') != 'csv':
+        return None
+    if meta["offset"] != 0 or meta.get("cursor") is not None:
+        return None
+    if meta["order_by"] != 'id' or meta["order_by_direction"].lower() != 'desc':
+        return None
+
+    if set(filters) - {'delay'} not in ({'country', 'use_validation'},
+                                         {'country', 'use_validation', 'year'}):
+        return None
+    if filters['use_validation'] != [False] or len(filters['country']) != 1:
+        return None
+    if not filters.get('delay') and current_app.config['DATA_QUERY_DELAY']:
+        return None
+
+    year = None
+    if 'year' in filters:
+        if len(filters['year']) != 1 or not str(filters['year'][0]).isdigit():
+            return None
+        year = int(filters['year'][0])
+
+    partition = snapshot_partition(filters['country'][0], year)
+    count = snapshot_count(partition)
+    if count is None or count > meta["limit"]:
+        return None
+
+    return snapshot_url(partition)
+
+
 @data_blueprint.route('/search')
 @limiter.limit("80 per minute")
 def search():
     meta = get_meta()
     filters = get_filters()
 
-    # get counts
-    count_total = query(count_all=True)
-    count_filtered = query(filters=filters, count_filtered=True)
+    # get counts, estimates are cheap enough for map clients to request every time
+    estimate = meta["count"] == 'estimate'
+    if estimate:
+        count_total = query(count_all=True, estimate=True)
+        count_filtered = query(filters=filters, count_filtered=True, estimate=True)
+    else:
+        count_total = cached_count()
+        count_filtered = cached_count(filters)
 
     # build response
-    results = query(meta=meta, filters=filters)
+    results = query(meta=meta, filters=filters, columns=export_columns)
 
     headers = {
         "Query-Count-Total": str(count_total),
@@ -216,17 +596,10 @@ def search():
         "Access-Control-Expose-Headers": "Query-Count-Total, Query-Count-Filtered, Query-Next"
     }
 
-    if count_filtered > meta["page"] * meta["limit"]:
-        next_url_params = {
-            'page': str(meta["page"] + 1),
-            'page_size': str(meta["limit"]),
-            'order_by': meta["order_by"],
-            'order_by_direction': meta["order_by_direction"]
-        }
-        next_url_params.update(filters)
-        next_request = PreparedRequest()
-        next_request.prepare_url(request.base_url, next_url_params)
-        headers['Query-Next'] = next_request.url
+    last_row = results[-1] if len(results) == meta["limit"] else None
+    next_url = get_next_url(meta, filters, last_row, None if estimate else count_filtered)
+    if next_url is not None:
+        headers['Query-Next'] = next_url
 
     return Response(result_generator(results), headers=[(k, v) for k, v in headers.iteritems()],
                     mimetype='text/csv')
@@ -239,92 +612,81 @@ def image():
     meta = {
         "order_by": "id",
         "order_by_direction": "rand",
+        "seed": filters_hash(filters),
         "limit": 1000,
         "offset": 0
     }
 
-    # build response
-    results = query(meta, filters=filters)
-
     headers = {
         "Cache-Control": "max-age=259200"
     }
 
-    paths = ''
-    for r in results:
-        if r[0].ndvi is None:
-            continue
-
-        path = None
-        segments = 0
-
-        for i, val in enumerate(r[0].ndvi):
-            if val is None:
-                if path is not None:
-                    paths += '<path d="' + path + '"/>'
-                    path = None
-                    segments = 0
-                continue
-
-            x, y = (i * 52.17, 1000 - max(3, min(val, 1000)))
-
-            if path is None:
-                path = "M%d %d" % (x, y)
-            else:
-                if segments == 1:
-                    path += "L%d %d" % (x, y)
-                else:
-                    path += " %d %d" % (x, y)
-
-            if i + 1 == len(r[0].ndvi):
-                paths += '<path d="' + path + '"/>'
-                path = None
-                segments = 0
-                continue
-
-            segments += 1
-
-    svg = '''<svg viewbox="0 0 1500 1210" preserveAspectRatio="xMidYMid meet">
-                <g transform="translate(20,20)">
-                    <g class="paths" fill="none" stroke="black" stroke-width="2" transform="translate(150,0)">''' + paths + '''</g>
-                    <g class="y labels" font-size="45">
-                        <text x="90" y="40"  text-anchor="end" alignment-baseline="start">1</text>
-                        <text x="90" y="280" text-anchor="end" alignment-baseline="start">0.75</text>
-                        <text x="90" y="530" text-anchor="end" alignment-baseline="start">0.5</text>
-                        <text x="90" y="780" text-anchor="end" alignment-baseline="start">0.25</text>
-                        <text x="90" y="1010" text-anchor="end" alignment-baseline="start">0</text>
-                    </g>
-                    <polyline class="axis" fill="none" stroke="#000000" points="110,10 110,1000 1330,1000 "></polyline>
-                    <g class="y labels" font-size="45">
-                        <text x="115" y="1050" alignment-baseline="start">Jan</text>
-                        <text x="215" y="1050" alignment-baseline="start">Feb</text>
-                        <text x="315" y="1050" alignment-baseline="start">Mar</text>
-                        <text x="415" y="1050" alignment-baseline="start">Apr</text>
-                        <text x="515" y="1050" alignment-baseline="start">May</text>
-                        <text x="615" y="1050" alignment-baseline="start">Jun</text>
-                        <text x="715" y="1050" alignment-baseline="start">Jul</text>
-                        <text x="815" y="1050" alignment-baseline="start">Aug</text>
-                        <text x="915" y="1050" alignment-baseline="start">Sep</text>
-                        <text x="1015" y="1050" alignment-baseline="start">Oct</text>
-                        <text x="1115" y="1050" alignment-baseline="start">Nov</text>
-                        <text x="1215" y="1050" alignment-baseline="start">Dec</text>
-                    </g>
-                </g>
-                <g data-temporal-bounds transform="translate(150,0)" data-intervals="23" data-interval-width="52.17"></g>
-                  Sorry, your browser does not support inline SVG.
-            </svg>'''
+    # the sample is seeded by the filters so the rendering only depends on them
+    key = 'data_image_' + filters_hash(filters)
+    svg = cache.get(key)
+    if svg is None:
+        results = query(meta, filters=filters, columns=[RecordSearch.ndvi])
+        svg = render_svg(r.ndvi for r in results)
+        cache.set(key, svg, timeout=current_app.config.get('DATA_IMAGE_CACHE_TIMEOUT'))
 
     return Response(svg, headers=[(k, v) for k, v in headers.iteritems()], mimetype='image/svg+xml')
 
 
+def download_response(meta, filters, headers=None, after=None):
+    """
+    Streams the rows of a download in the format requested in meta, csv or columnar arrow
+    and parquet record batches.
+    :param meta: dict from get_meta
+    :param filters: dict from get_filters
+    :param headers: dict of extra response headers
+    :param after: token to store the cursor of the next page under, see store_cursor_after
+    :return: Response
+    """
+    headers = dict(headers or {})
+    download_format = meta.get("format", 'csv')
+    batch_size = current_app.config.get('DATA_DOWNLOAD_STREAM_BATCH_SIZE')
+
+    if download_format == 'csv':
+        results = query(meta=meta, filters=filters, columns=export_columns, stream=True)
+        if after is not None:
+            results = store_cursor_after(results, meta, after)
+        body = result_generator(results)
+    else:
+        results = query(meta=meta, filters=filters, columns=columnar_export_columns,
+                        stream=True)
+        if after is not None:
+            results = store_cursor_after(results, meta, after)
+        rows = (row_to_list(r) for r in results)
+        if download_format == 'arrow':
+            body = arrow_encoder.encode_arrow(rows, columnar_export_columns, batch_size)
+        else:
+            body = arrow_encoder.encode_parquet(rows, columnar_export_columns, batch_size)
+        headers['Content-Disposition'] = 'attachment; filename=croplands.%s' % download_format
+
+    return Response(stream_with_context(body), headers=[(k, v) for k, v in headers.iteritems()],
+                    mimetype=download_formats[download_format])
+
+
 @data_blueprint.route("/download")
 @limiter.limit("10 per minute")
 def download():
     meta = get_meta(page_size=1000000)
     filters = get_filters()
 
-    results = query(meta=meta, filters=filters)
-    return Response(result_generator(results), mimetype='text/csv')
+    snapshot = get_snapshot_url(meta, filters)
+    if snapshot is not None:
+        return redirect(snapshot)
+
+    headers = {"Access-Control-Expose-Headers": "Query-Next"}
+
+    # the last row is only known once the body has been streamed, the next page resumes from
+    # the cursor stored under a token when the stream ends, an empty page ends the download
+    after = None
+    if meta["paging"] == 'cursor' and meta["limit"]:
+        after = uuid.uuid4().hex
+        headers['Query-Next'] = get_next_url(meta, filters, after=after)
+
+    return download_response(meta, filters, headers, after=after)
 
 
 @data_blueprint.route("/download/<country>")
@@ -339,5 +701,8 @@ def download_country(country):
     filters['country'] = [country]
     filters['delay'] = False
 
-    results = query(meta=meta, filters=filters)
-    return Response(result_generator(results), mimetype='text/csv')
+    snapshot = get_snapshot_url(meta, filters)
+    if snapshot is not None:
+        return redirect(snapshot)
+
+    return download_response(meta, filters)
@@ -1,8 +1,7 @@
-import datetime
-from flask import Blueprint, jsonify, request, Response
+from flask import Blueprint, jsonify, request, Response, current_app
 from croplands_api import limiter
-from croplands_api.utils.google.gee import extract, ee, get_map, build_url
-import requests
+from croplands_api.exceptions import FieldError
+from croplands_api.utils.google.gee import get_tile, time_series as get_time_series
 
 gee = Blueprint('gee', __name__, url_prefix='/gee')
 
@@ -18,13 +17,11 @@ def time_series():
     lat = request.args.get('lat', 31.74292, type=float)
     lon = request.args.get('lon', -110.051375, type=float)
     start = request.args.get('date_start', '2000-01-01', type=str)
-    end = request.args.get('date_end', datetime.date.today().isoformat(), type=str)
+    end = request.args.get('date_end', None, type=str)
     collection = request.args.get('collection', 'MODIS/MOD13Q1', type=str)
 
-    ee.ImageCollection(collection).filterDate(start, end)
-
     try:
-        results = {'results': extract(ee.Geometry.Point(lon, lat)),
+        results = {'results': get_time_series([(lat, lon)], collection, start, end)[0],
                    'lat': lat, 'lon': lon}
     except Exception as e:
         return jsonify({'status': 'error', 'message': e.message})
@@ -32,6 +29,39 @@ def time_series():
     return jsonify(results)
 
 
+@gee.route('/time_series', methods=['POST'])
+@limiter.limit("20 per minute")
+def time_series_batch():
+    """
+    Returns the time series of many points posted as json, e.g.
+    {"points": [{"lat": 31.7, "lon": -110.1}], "collection": "MODIS/MOD13Q1",
+    "date_start": "2000-01-01", "date_end": "2016-01-01"}. Cached points cost nothing, the
+    rest are extracted with one earth engine request.
+    :return: JSON
+    """
+    data = request.get_json(silent=True) or {}
+    start = data.get('date_start', '2000-01-01')
+    end = data.get('date_end')
+    collection = data.get('collection', 'MODIS/MOD13Q1')
+
+    try:
+        points = [(float(p['lat']), float(p['lon'])) for p in data.get('points', [])]
+    except (KeyError, TypeError, ValueError):
+        raise FieldError(description="Points require a lat and lon")
+
+    if not points or len(points) > current_app.config['TIME_SERIES_MAX_POINTS']:
+        raise FieldError(description="Between 1 and %d points are required" %
+                                     current_app.config['TIME_SERIES_MAX_POINTS'])
+
+    try:
+        series = get_time_series(points, collection, start, end)
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': e.message})
+
+    return jsonify({'results': [{'lat': lat, 'lon': lon, 'results': s}
+                                for (lat, lon), s in zip(points, series)]})
+
+
 def parse_request_args_values(values):
     """
     Takes in values for query parameters and returns a single
@@ -49,7 +79,8 @@ def parse_request_args_values(values):
 def tile_proxy(x, y, z, asset):
     """
     View handler for map tiles. Acts as a proxy to google earth engine which can
-    be cached with an additional layer such as AWS Cloudfront.
+    be cached with an additional layer such as AWS Cloudfront. Tiles are also cached
+    on this machine, see utils.tile_cache.
     :param x:
     :param y:
     :param z:
@@ -64,22 +95,5 @@ def tile_proxy(x, y, z, asset):
 
     map_args['asset'] = asset
 
-    # get the map information from google earth engine
-    print(map_args)
-    map = get_map(**map_args)
-
-
-    # build the url for tiles
-    url = build_url(map['mapid'], map['token'], int(x), int(y), int(z))
-    req = requests.get(url, stream=True)
-    print(url)
-
-    def generate():
-        """
-        returns response in pieces
-        :return:
-        """
-        for chunk in req.iter_content(2048):
-            yield chunk
-
-    return Response(generate(), content_type=req.headers['content-type'])
\ No newline at end of file
+    tile = get_tile(map_args, int(x), int(y), int(z))
+    return Response(tile.content, content_type=tile.content_type)
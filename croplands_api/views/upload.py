@@ -3,7 +3,7 @@ from flask_restless.helpers import to_dict
 from flask_jwt import current_user
 from werkzeug.utils import secure_filename
 from werkzeug.exceptions import BadRequest
-from croplands_api.utils.s3 import upload_image
+from croplands_api.tasks.images import store_raw_image, queue_image
 import uuid
 import cStringIO
 from croplands_api.models.location import Image, db
@@ -51,10 +51,12 @@ def image_view():
         # create key for file
         url = 'images/mobile/' + str(uuid.uuid4()) + '.jpg'
 
-        # upload image to s3 bucket
-        upload_image(f_io, encoded_image=False, filename=url)
+        # keep the original, it is resized and uploaded to url by a task
+        store_raw_image(f_io.getvalue(), url)
+        status = 'pending'
     elif 'url' in data:
         url = data['url']
+        status = 'ready'
     else:
         raise BadRequest(description='Not enough data')
 
@@ -62,7 +64,7 @@ def image_view():
 
     # save to database
     image = Image(location_id=data['location_id'], lat=data['lat'], lon=data['lon'],
-                  url=url,
+                  url=url, status=status,
                   date_acquired=data['date_acquired'])
 
     # get the user from the token
@@ -74,4 +76,8 @@ def image_view():
 
     db.session.add(image)
     db.session.commit()
+
+    if image.status == 'pending':
+        queue_image(image.id)
+
     return jsonify(to_dict(image)), 201
\ No newline at end of file
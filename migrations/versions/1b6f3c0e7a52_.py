@@ -0,0 +1,49 @@
+"""location geography
+
+Revision ID: 1b6f3c0e7a52
+Revises: 399d9d0e436f
+Create Date: 2026-10-18 10:02:17.551208
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '1b6f3c0e7a52'
+down_revision = '399d9d0e436f'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.execute("ALTER TABLE location ADD COLUMN geog geography(Point, 4326)")
+
+    # backfill before indexing
+    op.execute("UPDATE location SET geog = ST_SetSRID(ST_MakePoint(lon, lat), 4326)::geography")
+    op.execute("CREATE INDEX ix_location_geog ON location USING gist (geog)")
+
+    op.execute("""
+    CREATE OR REPLACE FUNCTION location_set_geog()
+        RETURNS trigger
+        AS
+        $location_set_geog$
+        BEGIN
+            NEW.geog := ST_SetSRID(ST_MakePoint(NEW.lon, NEW.lat), 4326)::geography;
+            RETURN NEW;
+        END;
+        $location_set_geog$
+        LANGUAGE plpgsql;
+
+    CREATE TRIGGER location_geog_trigger
+        BEFORE INSERT OR UPDATE OF lat, lon ON location
+        FOR EACH ROW
+        EXECUTE PROCEDURE location_set_geog();
+    """)
+
+
+def downgrade():
+    op.execute("""
+    DROP TRIGGER IF EXISTS location_geog_trigger ON location;
+    DROP FUNCTION IF EXISTS location_set_geog();
+    """)
+    op.drop_index('ix_location_geog', table_name='location')
+    op.drop_column('location', 'geog')
@@ -0,0 +1,60 @@
+"""ndvi refresh markers
+
+Revision ID: 2d5e8a1c4b90
+Revises: 1b6f3c0e7a52
+Create Date: 2026-10-18 11:24:05.318842
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '2d5e8a1c4b90'
+down_revision = '1b6f3c0e7a52'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+RECORD_SEARCH_COLUMNS = """location_id, year, month, land_use_type, crop_primary,
+                              crop_secondary, water, intensity, source_type,
+                              source_class, source_description, ndvi, date_created"""
+
+
+def upgrade():
+    op.add_column('record', sa.Column('ndvi_updated', sa.DateTime(), nullable=True))
+    op.add_column('record', sa.Column('ndvi_complete', sa.Boolean(), nullable=True))
+    op.add_column('record', sa.Column('ndvi_requested', sa.DateTime(), nullable=True))
+
+    # series fetched before this revision were rescheduled by the task itself, past years
+    # are complete and the rest are picked up again by refresh_ndvi
+    op.execute("""
+    UPDATE record
+    SET ndvi_updated = now(), ndvi_complete = year < extract(year FROM now())
+    WHERE ndvi IS NOT NULL
+    """)
+    op.execute("UPDATE record SET ndvi_complete = false WHERE ndvi IS NULL")
+    op.create_index(op.f('ix_record_ndvi_updated'), 'record', ['ndvi_updated'], unique=False)
+
+    # marker updates should not rewrite record_search rows
+    op.execute("""
+    DROP TRIGGER IF EXISTS record_search_record_trigger ON record;
+    CREATE TRIGGER record_search_record_trigger
+        AFTER INSERT OR UPDATE OF %s
+        ON record
+        FOR EACH ROW
+        EXECUTE PROCEDURE record_search_sync_record();
+    """ % RECORD_SEARCH_COLUMNS)
+
+
+def downgrade():
+    op.execute("""
+    DROP TRIGGER IF EXISTS record_search_record_trigger ON record;
+    CREATE TRIGGER record_search_record_trigger
+        AFTER INSERT OR UPDATE ON record
+        FOR EACH ROW
+        EXECUTE PROCEDURE record_search_sync_record();
+    """)
+
+    op.drop_index(op.f('ix_record_ndvi_updated'), table_name='record')
+    op.drop_column('record', 'ndvi_requested')
+    op.drop_column('record', 'ndvi_complete')
+    op.drop_column('record', 'ndvi_updated')
@@ -0,0 +1,123 @@
+"""record search table
+
+Revision ID: 399d9d0e436f
+Revises: 12ec6f6ad6d1
+Create Date: 2026-10-18 09:12:44.104523
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '399d9d0e436f'
+down_revision = '12ec6f6ad6d1'
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+def upgrade():
+    op.create_table('record_search',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('location_id', sa.Integer(), nullable=False),
+    sa.Column('year', sa.Integer(), nullable=False),
+    sa.Column('month', sa.Integer(), nullable=True),
+    sa.Column('land_use_type', sa.Integer(), nullable=True),
+    sa.Column('crop_primary', sa.Integer(), nullable=True),
+    sa.Column('crop_secondary', sa.Integer(), nullable=True),
+    sa.Column('water', sa.Integer(), nullable=True),
+    sa.Column('intensity', sa.Integer(), nullable=True),
+    sa.Column('source_type', sa.String(), nullable=True),
+    sa.Column('source_class', sa.String(), nullable=True),
+    sa.Column('source_description', sa.String(), nullable=True),
+    sa.Column('ndvi', postgresql.ARRAY(sa.Integer()), nullable=True),
+    sa.Column('date_created', sa.DateTime(), nullable=True),
+    sa.Column('lat', sa.Float(), nullable=False),
+    sa.Column('lon', sa.Float(), nullable=False),
+    sa.Column('country', sa.String(), nullable=True),
+    sa.Column('use_validation', sa.Boolean(), nullable=True),
+    sa.ForeignKeyConstraint(['id'], ['record.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['location_id'], ['location.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_record_search_location_id'), 'record_search', ['location_id'], unique=False)
+    op.create_index(op.f('ix_record_search_year'), 'record_search', ['year'], unique=False)
+    op.create_index(op.f('ix_record_search_land_use_type'), 'record_search', ['land_use_type'], unique=False)
+    op.create_index(op.f('ix_record_search_crop_secondary'), 'record_search', ['crop_secondary'], unique=False)
+    op.create_index(op.f('ix_record_search_water'), 'record_search', ['water'], unique=False)
+    op.create_index(op.f('ix_record_search_intensity'), 'record_search', ['intensity'], unique=False)
+    op.create_index(op.f('ix_record_search_source_type'), 'record_search', ['source_type'], unique=False)
+    op.create_index(op.f('ix_record_search_date_created'), 'record_search', ['date_created'], unique=False)
+    op.create_index(op.f('ix_record_search_use_validation'), 'record_search', ['use_validation'], unique=False)
+    op.create_index('ix_record_search_country_land_use_type_year', 'record_search', ['country', 'land_use_type', 'year'], unique=False)
+    op.create_index('ix_record_search_crop_primary_lat_lon', 'record_search', ['crop_primary', 'lat', 'lon'], unique=False)
+    op.create_index('ix_record_search_lat_lon_brin', 'record_search', ['lat', 'lon'], unique=False, postgresql_using='brin')
+
+    op.execute("""
+    CREATE OR REPLACE FUNCTION record_search_sync_record()
+        RETURNS trigger
+        AS
+        $record_search_sync_record$
+        BEGIN
+            DELETE FROM record_search WHERE id = NEW.id;
+            INSERT INTO record_search (id, location_id, year, month, land_use_type,
+                                       crop_primary, crop_secondary, water, intensity,
+                                       source_type, source_class, source_description, ndvi,
+                                       date_created, lat, lon, country, use_validation)
+            SELECT NEW.id, NEW.location_id, NEW.year, NEW.month, NEW.land_use_type,
+                   NEW.crop_primary, NEW.crop_secondary, NEW.water, NEW.intensity,
+                   NEW.source_type, NEW.source_class, NEW.source_description, NEW.ndvi,
+                   NEW.date_created, l.lat, l.lon, l.country, l.use_validation
+            FROM location l WHERE l.id = NEW.location_id;
+            RETURN NULL;
+        END;
+        $record_search_sync_record$
+        LANGUAGE plpgsql;
+
+    CREATE TRIGGER record_search_record_trigger
+        AFTER INSERT OR UPDATE ON record
+        FOR EACH ROW
+        EXECUTE PROCEDURE record_search_sync_record();
+
+    CREATE OR REPLACE FUNCTION record_search_sync_location()
+        RETURNS trigger
+        AS
+        $record_search_sync_location$
+        BEGIN
+            UPDATE record_search
+            SET lat = NEW.lat, lon = NEW.lon, country = NEW.country,
+                use_validation = NEW.use_validation
+            WHERE location_id = NEW.id;
+            RETURN NULL;
+        END;
+        $record_search_sync_location$
+        LANGUAGE plpgsql;
+
+    CREATE TRIGGER record_search_location_trigger
+        AFTER UPDATE OF lat, lon, country, use_validation ON location
+        FOR EACH ROW
+        EXECUTE PROCEDURE record_search_sync_location();
+    """)
+
+    # backfill
+    op.execute("""
+    INSERT INTO record_search (id, location_id, year, month, land_use_type, crop_primary,
+                               crop_secondary, water, intensity, source_type, source_class,
+                               source_description, ndvi, date_created,
+                               lat, lon, country, use_validation)
+    SELECT r.id, r.location_id, r.year, r.month, r.land_use_type, r.crop_primary,
+           r.crop_secondary, r.water, r.intensity, r.source_type, r.source_class,
+           r.source_description, r.ndvi, r.date_created,
+           l.lat, l.lon, l.country, l.use_validation
+    FROM record r
+    JOIN location l ON l.id = r.location_id
+    """)
+
+
+def downgrade():
+    op.execute("""
+    DROP TRIGGER IF EXISTS record_search_record_trigger ON record;
+    DROP TRIGGER IF EXISTS record_search_location_trigger ON location;
+    DROP FUNCTION IF EXISTS record_search_sync_record();
+    DROP FUNCTION IF EXISTS record_search_sync_location();
+    """)
+    op.drop_table('record_search')
@@ -0,0 +1,28 @@
+"""export state
+
+Revision ID: 4c7a91e2d3f6
+Revises: 2d5e8a1c4b90
+Create Date: 2026-10-18 12:06:41.902117
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '4c7a91e2d3f6'
+down_revision = '2d5e8a1c4b90'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table('export_state',
+    sa.Column('name', sa.String(), nullable=False),
+    sa.Column('partition', sa.String(), nullable=False),
+    sa.Column('fingerprint', sa.String(), nullable=False),
+    sa.Column('date_built', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('name', 'partition')
+    )
+
+
+def downgrade():
+    op.drop_table('export_state')
@@ -0,0 +1,71 @@
+"""record search ndvi envelope
+
+Revision ID: 5e2b7d9f1a38
+Revises: 4c7a91e2d3f6
+Create Date: 2026-10-18 13:18:52.640371
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '5e2b7d9f1a38'
+down_revision = '4c7a91e2d3f6'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.execute("CREATE EXTENSION IF NOT EXISTS cube")
+    op.execute("ALTER TABLE record_search ADD COLUMN ndvi_envelope cube")
+
+    op.execute("""
+    CREATE OR REPLACE FUNCTION ndvi_envelope(ndvi integer[])
+        RETURNS cube
+        AS
+        $ndvi_envelope$
+            SELECT cube(array_agg(s.low ORDER BY s.bucket) || array_agg(s.high ORDER BY s.bucket))
+            FROM (
+                SELECT b.bucket,
+                       CAST(coalesce(min(t.value), 32767) AS float8) AS low,
+                       CAST(coalesce(max(t.value), -32768) AS float8) AS high
+                FROM generate_series(0, 4 - 1) AS b (bucket)
+                LEFT JOIN unnest(ndvi) WITH ORDINALITY AS t (value, i)
+                    ON (t.i - 1) / 6 = b.bucket
+                GROUP BY b.bucket
+            ) s
+        $ndvi_envelope$
+        LANGUAGE sql IMMUTABLE;
+    """)
+
+    # backfill before indexing
+    op.execute("UPDATE record_search SET ndvi_envelope = ndvi_envelope(ndvi)")
+    op.execute("CREATE INDEX ix_record_search_ndvi_envelope ON record_search "
+               "USING gist (ndvi_envelope)")
+
+    op.execute("""
+    CREATE OR REPLACE FUNCTION record_search_set_ndvi_envelope()
+        RETURNS trigger
+        AS
+        $record_search_set_ndvi_envelope$
+        BEGIN
+            NEW.ndvi_envelope := ndvi_envelope(NEW.ndvi);
+            RETURN NEW;
+        END;
+        $record_search_set_ndvi_envelope$
+        LANGUAGE plpgsql;
+
+    CREATE TRIGGER record_search_ndvi_envelope_trigger
+        BEFORE INSERT OR UPDATE OF ndvi ON record_search
+        FOR EACH ROW
+        EXECUTE PROCEDURE record_search_set_ndvi_envelope();
+    """)
+
+
+def downgrade():
+    op.execute("""
+    DROP TRIGGER IF EXISTS record_search_ndvi_envelope_trigger ON record_search;
+    DROP FUNCTION IF EXISTS record_search_set_ndvi_envelope();
+    """)
+    op.drop_index('ix_record_search_ndvi_envelope', table_name='record_search')
+    op.execute("ALTER TABLE record_search DROP COLUMN ndvi_envelope")
+    op.execute("DROP FUNCTION IF EXISTS ndvi_envelope(integer[])")
@@ -0,0 +1,66 @@
+"""record random key
+
+Revision ID: 6f1d4b8e2c07
+Revises: 5e2b7d9f1a38
+Create Date: 2026-10-18 14:02:37.915204
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '6f1d4b8e2c07'
+down_revision = '5e2b7d9f1a38'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+SYNC_RECORD_SQL = """
+    CREATE OR REPLACE FUNCTION record_search_sync_record()
+        RETURNS trigger
+        AS
+        $record_search_sync_record$
+        BEGIN
+            DELETE FROM record_search WHERE id = NEW.id;
+            INSERT INTO record_search (id, location_id, year, month, land_use_type,
+                                       crop_primary, crop_secondary, water, intensity,
+                                       source_type, source_class, source_description, ndvi,
+                                       date_created, %(columns)s)
+            SELECT NEW.id, NEW.location_id, NEW.year, NEW.month, NEW.land_use_type,
+                   NEW.crop_primary, NEW.crop_secondary, NEW.water, NEW.intensity,
+                   NEW.source_type, NEW.source_class, NEW.source_description, NEW.ndvi,
+                   NEW.date_created, %(values)s
+            FROM location l WHERE l.id = NEW.location_id;
+            RETURN NULL;
+        END;
+        $record_search_sync_record$
+        LANGUAGE plpgsql;
+    """
+
+
+def upgrade():
+    # the volatile default is evaluated for every existing row
+    op.add_column('record', sa.Column('random_key', sa.Float(), nullable=False,
+                                      server_default=sa.text('random()')))
+    op.add_column('record_search', sa.Column('random_key', sa.Float(), nullable=True))
+
+    op.execute(SYNC_RECORD_SQL % {
+        'columns': 'random_key, lat, lon, country, use_validation',
+        'values': 'NEW.random_key, l.lat, l.lon, l.country, l.use_validation'})
+
+    # backfill before indexing
+    op.execute("""
+    UPDATE record_search s SET random_key = r.random_key
+    FROM record r WHERE r.id = s.id
+    """)
+    op.create_index(op.f('ix_record_search_random_key'), 'record_search', ['random_key'],
+                    unique=False)
+
+
+def downgrade():
+    op.execute(SYNC_RECORD_SQL % {
+        'columns': 'lat, lon, country, use_validation',
+        'values': 'l.lat, l.lon, l.country, l.use_validation'})
+
+    op.drop_index(op.f('ix_record_search_random_key'), table_name='record_search')
+    op.drop_column('record_search', 'random_key')
+    op.drop_column('record', 'random_key')
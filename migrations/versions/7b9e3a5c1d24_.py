@@ -0,0 +1,25 @@
+"""image processing status
+
+Revision ID: 7b9e3a5c1d24
+Revises: 6f1d4b8e2c07
+Create Date: 2026-10-18 14:47:11.203518
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '7b9e3a5c1d24'
+down_revision = '6f1d4b8e2c07'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column('image', sa.Column('status', sa.String(), nullable=False,
+                                     server_default='ready'))
+    op.create_index(op.f('ix_image_status'), 'image', ['status'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_image_status'), table_name='image')
+    op.drop_column('image', 'status')
@@ -1,8 +1,45 @@
 from unittest import TestCase
-from croplands_api import create_app, limiter
+from croplands_api import create_app, limiter, cache
 from croplands_api.models import db
-from croplands_api.utils.google.gee import extract
+from croplands_api.utils.google.gee import extract, build_cache_key, snap_to_grid, \
+    build_cached_map, extract_many, time_series
+import croplands_api.utils.google.gee as gee
 import ee
+import uuid
+
+
+class FakeCollection(object):
+    """
+    Collection answering getRegion with canned rows, one per pixel and image.
+    """
+
+    def __init__(self, rows=None):
+        self.rows = rows or []
+
+    def filterDate(self, start, end):
+        return self
+
+    def sort(self, prop, ascending):
+        return self
+
+    def getRegion(self, geometry, scale):
+        return self
+
+    def getInfo(self):
+        return [['id', 'longitude', 'latitude', 'time', 'NDVI']] + self.rows
+
+
+class FakeEE(object):
+    collection = FakeCollection()
+
+    @classmethod
+    def ImageCollection(cls, collection_id):
+        return cls.collection
+
+    class Geometry(object):
+        @staticmethod
+        def MultiPoint(coordinates):
+            return coordinates
 
 
 class TestGEE(TestCase):
@@ -34,3 +71,87 @@ class TestGEE(TestCase):
             results = extract(geometry, collection)
             self.assertEqual(len(results), 23)
             self.assertIn('NDVI', results[0])
+
+    def test_build_cache_key_is_canonical(self):
+        self.assertEqual(build_cache_key(asset='ndvi_landsat_7', year='2014'),
+                         build_cache_key(year=2014, asset='ndvi_landsat_7'))
+        self.assertNotEqual(build_cache_key(asset='ndvi_landsat_7', year='2014'),
+                            build_cache_key(asset='ndvi_landsat_7', month='2014'))
+        self.assertTrue(build_cache_key(asset='ndvi_landsat_7').startswith('map_'))
+
+    def test_snap_to_grid(self):
+        self.assertEqual(snap_to_grid(31.7431, -110.0511, 0.002), (31.743, -110.051))
+        self.assertEqual(snap_to_grid(31.7439, -110.0519, 0.002), (31.743, -110.051))
+        self.assertNotEqual(snap_to_grid(31.7441, -110.0511, 0.002), (31.743, -110.051))
+
+    def test_build_cached_map_keeps_lock_it_does_not_hold(self):
+        with self.app.app_context():
+            key = build_cache_key(asset='test_lock')
+            cache.delete(key)
+            cache.set(key + '_lock', 'other', timeout=60)
+            self.app.config['MAP_ID_LOCK_TIMEOUT'] = 1
+
+            build_map = gee.build_map
+            gee.build_map = lambda **kwargs: {'mapid': 'm', 'token': 't'}
+            try:
+                # gives up waiting and builds without the lock
+                self.assertEqual(build_cached_map(key, asset='test_lock')['mapid'], 'm')
+            finally:
+                gee.build_map = build_map
+                self.app.config['MAP_ID_LOCK_TIMEOUT'] = 60
+
+            self.assertEqual(cache.get(key + '_lock'), 'other')
+            cache.delete(key + '_lock')
+            cache.delete(key)
+
+    def test_extract_many_nearest_pixel(self):
+        ee_module = gee.ee
+        gee.ee = FakeEE
+        try:
+            collection = FakeCollection([['a', -110.051, 31.743, 1, 5000],
+                                         ['b', -110.051, 31.743, 2, 6000],
+                                         ['a', 10.001, 10.001, 1, 3000]])
+            results = extract_many({'near': (31.7431, -110.0512), 'far': (10.0, 10.0)},
+                                   collection)
+        finally:
+            gee.ee = ee_module
+
+        self.assertEqual([r['NDVI'] for r in results['near']], [5000, 6000])
+        self.assertEqual([r['NDVI'] for r in results['far']], [3000])
+
+    def test_time_series_extracts_only_missing_cells(self):
+        calls = []
+
+        def fake_extract_many(points, collection=None, scale=231.65):
+            calls.append(sorted(points))
+            return dict((cell, [{'NDVI': cell[0]}]) for cell in points)
+
+        originals = gee.extract_many, gee.ee
+        gee.extract_many, gee.ee = fake_extract_many, FakeEE
+        try:
+            with self.app.app_context():
+                size = self.app.config['TIME_SERIES_GRID_SIZE']
+                collection = 'test/' + uuid.uuid4().hex
+                points = [(31.7431, -110.0511), (31.7439, -110.0519), (10.0, 10.0)]
+
+                # points in the same cell share one extraction
+                first = time_series(points, collection, '2015-01-01', '2015-12-31')
+                self.assertEqual(len(calls), 1)
+                self.assertEqual(len(calls[0]), 2)
+                self.assertEqual(first[0], first[1])
+
+                # cached cells are not extracted again
+                second = time_series(points + [(20.0, 20.0)], collection, '2015-01-01',
+                                     '2015-12-31')
+                self.assertEqual(calls[1], [snap_to_grid(20.0, 20.0, size)])
+                self.assertEqual(second[:3], first)
+
+                time_series(points, collection, '2015-01-01', '2015-12-31')
+                self.assertEqual(len(calls), 2)
+
+                # series up to today share an open ended cache entry
+                time_series(points, collection, '2015-01-01')
+                time_series(points, collection, '2015-01-01', '2999-01-01')
+                self.assertEqual(len(calls), 3)
+        finally:
+            gee.extract_many, gee.ee = originals
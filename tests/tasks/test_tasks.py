@@ -1,7 +1,12 @@
 from unittest import TestCase
 from croplands_api import create_app, limiter
 from croplands_api.models import Location, db, Record
-from croplands_api.tasks.records import get_ndvi
+from croplands_api.tasks.records import get_ndvi, get_ndvi_batch, claim_ndvi_refresh, \
+    write_fusion_table_csvs, FUSION_TABLE_QUERY
+from croplands_api.tasks.maps import region_tiles, prewarm_tiles, prewarm_maps
+import croplands_api.tasks.maps as maps
+import csv
+from datetime import datetime, timedelta
 
 
 class TestTasks(TestCase):
@@ -40,3 +45,122 @@ class TestTasks(TestCase):
 
             # pass record.id
             get_ndvi(1)
+
+    def test_get_ndvi_batch(self):
+        with self.app.app_context():
+            records = []
+            for i in range(3):
+                location = Location(lat=40.00 + i, lon=-90.00)
+                db.session.add(location)
+                db.session.flush()
+
+                record = Record(location_id=location.id, year=2010 + i, month=2)
+                db.session.add(record)
+                records.append(record)
+            db.session.commit()
+
+            ids = [r.id for r in records]
+            self.assertEqual(get_ndvi_batch(ids), [])
+
+            for r in db.session.query(Record).filter(Record.id.in_(ids)):
+                self.assertEqual(len(r.ndvi), 23)
+                self.assertIsNotNone(r.ndvi_mean)
+
+            # matches the single record task
+            single = db.session.query(Record).get(ids[0])
+            series = list(single.ndvi)
+            get_ndvi(record=single)
+            self.assertEqual(db.session.query(Record).get(ids[0]).ndvi, series)
+
+    def test_claim_ndvi_refresh(self):
+        with self.app.app_context():
+            location = Location(lat=40.00, lon=-90.00)
+            db.session.add(location)
+            db.session.flush()
+
+            record = Record(location_id=location.id, year=2010, month=2)
+            db.session.add(record)
+            db.session.commit()
+            record_id = record.id
+
+            # missing series are claimed once
+            self.assertEqual(claim_ndvi_refresh(10), [record_id])
+            self.assertEqual(claim_ndvi_refresh(10), [])
+
+            get_ndvi_batch([record_id])
+            record = db.session.query(Record).get(record_id)
+            self.assertTrue(record.ndvi_complete)
+            self.assertIsNotNone(record.ndvi_updated)
+            self.assertIsNone(record.ndvi_requested)
+
+            # complete series are refreshed after NDVI_REFRESH_COMPLETE
+            self.assertEqual(claim_ndvi_refresh(10), [])
+            later = datetime.utcnow() + self.app.config['NDVI_REFRESH_COMPLETE'] + \
+                timedelta(days=1)
+            self.assertEqual(claim_ndvi_refresh(10, now=later), [record_id])
+
+    def test_write_fusion_table_csvs(self):
+        with self.app.app_context():
+            for i, use_validation in enumerate([False, True]):
+                location = Location(lat=40.00 + i, lon=-90.00, use_validation=use_validation,
+                                    country=u'C\xf4te d\'Ivoire')
+                db.session.add(location)
+                db.session.flush()
+                db.session.add(Record(location_id=location.id, year=2014, month=2))
+            db.session.commit()
+
+            training, validation, public = write_fusion_table_csvs(
+                db.engine.execute(FUSION_TABLE_QUERY))
+
+            training, validation, public = [list(csv.DictReader(f))
+                                            for f in (training, validation, public)]
+            self.assertEqual(len(training), 1)
+            self.assertEqual(len(validation), 1)
+            self.assertEqual(len(public), 2)
+            self.assertEqual(public[0]['country'], 'C\xc3\xb4te d\'Ivoire')
+            self.assertNotIn('use_private', public[0])
+
+    def test_prewarm_tiles(self):
+        world = (-90, -180, 90, 180)
+        self.assertEqual(list(region_tiles(world, 0)), [(0, 0)])
+        self.assertEqual(sorted(region_tiles(world, 1)), [(0, 0), (0, 1), (1, 0), (1, 1)])
+        self.assertEqual(len(list(region_tiles(world, 3))), 64)
+
+        # overlapping regions fetch each tile once, lowest zoom first
+        tiles = list(prewarm_tiles(['a', 'b'], [1, 0], [world, (0, 0, 10, 10)]))
+        self.assertEqual(len(tiles), 2 * (1 + 4))
+        self.assertEqual(tiles[0], ({'asset': 'a'}, 0, 0, 0))
+
+    def test_prewarm_maps_counts_failures(self):
+        fetched = []
+
+        def get_map(asset):
+            if asset == 'broken':
+                raise IOError('earth engine is down')
+
+        def get_tile(map_args, x, y, z):
+            if z == 1:
+                raise IOError('connection reset')
+            fetched.append((map_args['asset'], x, y, z))
+
+        originals = maps.ASSETS, maps.get_map, maps.get_tile
+        maps.ASSETS, maps.get_map, maps.get_tile = {'ok': {}, 'broken': {}}, get_map, get_tile
+        config = dict((k, self.app.config[k]) for k in ['TILE_CACHE_BACKEND', 'MAP_PREWARM_ZOOMS',
+                                                         'MAP_PREWARM_REGIONS'])
+        self.app.config.update(MAP_PREWARM_ZOOMS=[0, 1],
+                               MAP_PREWARM_REGIONS=[(-90, -180, 90, 180)])
+        try:
+            with self.app.app_context():
+                # a tile cache on the worker's disk is not prewarmed
+                self.app.config['TILE_CACHE_BACKEND'] = 'disk'
+                self.assertEqual(prewarm_maps(), {'maps': 1, 'maps_failed': 1, 'tiles': 0,
+                                                  'tiles_failed': 0})
+                self.assertEqual(fetched, [])
+
+                self.app.config['TILE_CACHE_BACKEND'] = 'redis'
+                self.assertEqual(prewarm_maps(), {'maps': 1, 'maps_failed': 1, 'tiles': 1,
+                                                  'tiles_failed': 4})
+                self.assertEqual(fetched, [('ok', 0, 0, 0)])
+        finally:
+            maps.ASSETS, maps.get_map, maps.get_tile = originals
+            self.app.config.update(config)
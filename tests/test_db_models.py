@@ -1,6 +1,9 @@
 from unittest import TestCase
-from croplands_api import create_app, limiter
-from croplands_api.models import Location, db, User
+from croplands_api import create_app, limiter, cache
+from croplands_api.models import Location, db, User, Record, RecordSearch
+from croplands_api.models.record import RECORD_COUNT_CACHE_KEY
+from croplands_api.views.data import query, cached_count
+from sqlalchemy import event
 from croplands_api.utils.geo import get_destination
 
 
@@ -101,3 +104,121 @@ class TestDatabase(TestCase):
             db.session.commit()
 
             self.assertEqual(True, l3.use_invalid)
+
+    def test_location_create_many(self):
+        with self.app.app_context():
+            l1 = Location(lat=40, lon=-110, use_validation=True)
+            db.session.add(l1)
+            db.session.commit()
+
+            pt1 = get_destination(l1.lat, l1.lon, 90, 1.5)  # in km
+            pt2 = get_destination(l1.lat, l1.lon, 90, .75)  # in km
+            pt3 = get_destination(l1.lat, l1.lon, 0, 5)  # in km
+
+            l2, l3, l4 = Location.create_many([
+                {'lat': pt1[0], 'lon': pt1[1], 'use_validation': False},
+                {'lat': pt2[0], 'lon': pt2[1], 'use_validation': False},
+                {'lat': pt3[0], 'lon': pt3[1], 'use_validation': False}
+            ])
+            db.session.commit()
+
+            # same outcome as test_location_nearby_mixed_use_three_samples
+            self.assertFalse(l2.use_invalid)
+            self.assertEqual(True, l3.use_invalid)
+            self.assertFalse(l4.use_invalid)
+            self.assertEqual(False, l4.use_validation)
+
+    def test_record_search_follows_records_and_locations(self):
+        with self.app.app_context():
+            location = Location(lat=40, lon=-110, country='Brazil', use_validation=False)
+            db.session.add(location)
+            db.session.flush()
+            record = Record(location_id=location.id, year=2015, month=6, land_use_type=1)
+            db.session.add(record)
+            db.session.commit()
+
+            row = RecordSearch.query.get(record.id)
+            self.assertIsNotNone(row)
+            self.assertEqual((row.year, row.month, row.land_use_type), (2015, 6, 1))
+            self.assertEqual((row.lat, row.lon, row.country), (40, -110, 'Brazil'))
+            self.assertFalse(row.use_validation)
+
+            record.crop_primary = 3
+            location.lat, location.lon = 41, -111
+            location.country = 'India'
+            location.use_validation = True
+            db.session.commit()
+            db.session.expire_all()
+
+            row = RecordSearch.query.get(record.id)
+            self.assertEqual(row.crop_primary, 3)
+            self.assertEqual((row.lat, row.lon, row.country), (41, -111, 'India'))
+            self.assertTrue(row.use_validation)
+
+            # the data api reads the same rows
+            meta = {'offset': 0, 'limit': 10, 'order_by': 'id', 'order_by_direction': 'desc'}
+            results = query(meta=meta, filters={'country': ['India']})
+            self.assertEqual([r.id for r in results], [record.id])
+            self.assertEqual(query(filters={'country': ['India']}, count_filtered=True), 1)
+            self.assertEqual(query(meta=meta, filters={'country': ['Brazil']}), [])
+
+    def test_record_search_rows_are_deleted(self):
+        with self.app.app_context():
+            location = Location(lat=40, lon=-110, country='Brazil', use_validation=False)
+            db.session.add(location)
+            db.session.flush()
+            records = [Record(location_id=location.id, year=year) for year in [2014, 2015]]
+            db.session.add_all(records)
+            db.session.commit()
+            ids = [r.id for r in records]
+
+            db.session.delete(records[0])
+            db.session.commit()
+            self.assertIsNone(RecordSearch.query.get(ids[0]))
+            self.assertIsNotNone(RecordSearch.query.get(ids[1]))
+
+            db.session.delete(location)
+            db.session.commit()
+            self.assertEqual(RecordSearch.query.count(), 0)
+
+    def test_record_count_cache_is_invalidated(self):
+        with self.app.app_context():
+            location = Location(lat=40, lon=-110)
+            db.session.add(location)
+            db.session.commit()
+
+            cache.set(RECORD_COUNT_CACHE_KEY, 123)
+            record = Record(location_id=location.id, year=2015)
+            db.session.add(record)
+            db.session.commit()
+            self.assertIsNone(cache.get(RECORD_COUNT_CACHE_KEY))
+            self.assertEqual(cached_count(), 1)
+
+            # updates do not change the count
+            record.month = 6
+            db.session.commit()
+            self.assertEqual(cache.get(RECORD_COUNT_CACHE_KEY), 1)
+
+            db.session.delete(record)
+            db.session.commit()
+            self.assertIsNone(cache.get(RECORD_COUNT_CACHE_KEY))
+            self.assertEqual(cached_count(), 0)
+
+    def test_estimated_count_does_not_count_rows(self):
+        with self.app.app_context():
+            statements = []
+
+            def record_statement(conn, cursor, statement, *args):
+                statements.append(statement.lower())
+
+            event.listen(db.engine, 'before_cursor_execute', record_statement)
+            try:
+                total = query(count_all=True, estimate=True)
+                filtered = query(filters={'country': ['Brazil']}, count_filtered=True,
+                                 estimate=True)
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', record_statement)
+
+            self.assertIsInstance(total, int)
+            self.assertIsInstance(filtered, int)
+            self.assertFalse([st for st in statements if 'count(' in st])
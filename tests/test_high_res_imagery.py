@@ -3,9 +3,48 @@ from croplands_api.models import User
 import unittest
 from croplands_api.tasks.classifications import build_classifications_result, \
     compute_image_classification_statistics
+from croplands_api.tasks.high_res_imagery import download_tile
+from croplands_api.exceptions import TileNotFound
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from PIL import Image as Img
+import StringIO
+import threading
+import tempfile
+import shutil
+import random
 import json
 
 
+def fake_wmts_server(blank=False):
+    """
+    Serves the same noisy jpeg, or a blank one, for every tile and counts the requests.
+    """
+    out = StringIO.StringIO()
+    image = Img.new('RGB', (256, 256))
+    image.putdata([tuple(random.randrange(256) for _ in range(3)) for _ in range(256 * 256)])
+    image.save(out, format='JPEG')
+    content = '' if blank else out.getvalue()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            self.server.requests.append(self.path)
+            self.send_response(200)
+            self.send_header('Content-Type', 'image/jpeg')
+            self.send_header('Content-Length', str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(('127.0.0.1', 0), Handler)
+    server.requests = []
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
 class TestHighResImage(unittest.TestCase):
     app = None
 
@@ -36,6 +75,32 @@ class TestHighResImage(unittest.TestCase):
     #         self.assertAlmostEqual(lat, image.lat, delta=0.001)
     #         self.assertAlmostEqual(lon, image.lon, delta=0.001)
 
+    def download_tiles_from(self, server):
+        tile_dir = tempfile.mkdtemp()
+        self.app.config['TILE_CACHE_DIR'] = tile_dir
+        self.app.config['DG_EV_URL'] = 'http://127.0.0.1:%d/wmts' % server.server_port
+        try:
+            with self.app.app_context():
+                for _ in range(2):
+                    try:
+                        download_tile(10, 20, 18)
+                    except TileNotFound:
+                        pass
+        finally:
+            server.shutdown()
+            shutil.rmtree(tile_dir)
+
+    def test_download_tile_is_cached(self):
+        server = fake_wmts_server()
+        self.download_tiles_from(server)
+        self.assertEqual(len(server.requests), 1)
+        self.assertIn('TileRow=20&TileCol=10', server.requests[0])
+
+    def test_download_blank_tile_is_not_cached(self):
+        server = fake_wmts_server(blank=True)
+        self.download_tiles_from(server)
+        self.assertEqual(len(server.requests), 2)
+
     def test_post_classification(self):
         with self.app.app_context():
             with self.app.test_client() as c:
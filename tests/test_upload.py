@@ -2,7 +2,9 @@ from unittest import TestCase
 import json
 import base64
 from croplands_api import create_app, db, limiter
-from croplands_api.models import User
+from croplands_api.models import User, Image
+from croplands_api.tasks.images import process_image, raw_image_key, claim_pending_images
+from croplands_api.utils.storage import get_storage
 from croplands_api.auth import make_jwt
 from StringIO import StringIO
 import os
@@ -68,6 +70,60 @@ class TestUpload(TestCase):
 
             self.assertEqual(r.status_code, 201)
 
+            # the original is stored and processed later
+            image = json.loads(r.data)
+            self.assertEqual(image['status'], 'pending')
+            with self.app.app_context():
+                self.assertEqual(get_storage().get(raw_image_key(image['url'])), img)
+
+    def test_process_image(self):
+        with self.app.test_client() as c:
+            location = self.create_location(c)
+            d = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+
+            with open(os.path.join(d, 'test.JPG'), 'r') as f:
+                img = f.read()
+
+            data = {
+                'location_id': location['id'], 'lat': 0.01, 'lon': 0.0123,
+                'date_acquired': '2012-10-01',
+                'file': (StringIO(img), 'hello_world.jpg'),
+            }
+            image_id = json.loads(c.post('/upload/image', data=data).data)['id']
+
+            with self.app.app_context():
+                process_image(image_id)
+                image = Image.query.get(image_id)
+                storage = get_storage()
+
+                self.assertEqual(image.status, 'ready')
+                self.assertIsNotNone(storage.get(image.url))
+                self.assertIsNone(storage.get(raw_image_key(image.url)))
+
+    def test_claim_pending_images(self):
+        with self.app.test_client() as c:
+            location = self.create_location(c)
+            d = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+
+            with open(os.path.join(d, 'test.JPG'), 'r') as f:
+                img = f.read()
+
+            data = {
+                'location_id': location['id'], 'lat': 0.01, 'lon': 0.0123,
+                'date_acquired': '2012-10-01',
+                'file': (StringIO(img), 'hello_world.jpg'),
+            }
+            image_id = json.loads(c.post('/upload/image', data=data).data)['id']
+
+            with self.app.app_context():
+                # recently queued images are left alone
+                self.assertEqual(claim_pending_images(10), [])
+
+                db.session.execute("UPDATE image SET date_modified = now() - interval '1 day'")
+                db.session.commit()
+                self.assertEqual(claim_pending_images(10), [image_id])
+                self.assertEqual(claim_pending_images(10), [])
+
     def test_image_upload_with_user(self):
         with self.app.test_client() as c:
             location = self.create_location(c)
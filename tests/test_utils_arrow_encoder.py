@@ -0,0 +1,35 @@
+from croplands_api.models import RecordSearch
+from croplands_api.utils.arrow_encoder import encode_arrow, encode_parquet
+import unittest
+import io
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+COLUMNS = [RecordSearch.id, RecordSearch.lat, RecordSearch.country,
+           RecordSearch.use_validation, RecordSearch.ndvi]
+ROWS = [(i, i * 1.5, u'C\xf4te' if i % 2 else None, i % 3 == 0,
+         None if i % 4 == 0 else [i] * 22 + [None]) for i in range(12)]
+
+
+@unittest.skipIf(pa is None, 'pyarrow is not installed')
+class TestUtilsArrowEncoder(unittest.TestCase):
+    def test_encode_arrow(self):
+        stream = b''.join(encode_arrow(ROWS, COLUMNS, batch_size=5))
+        table = pa.ipc.open_stream(stream).read_all()
+
+        self.assertEqual(table.num_rows, 12)
+        self.assertEqual(str(table.schema.field('ndvi').type),
+                         'fixed_size_list<item: int16>[23]')
+        self.assertEqual(table.column('ndvi').to_pylist()[0], [None] * 23)
+        self.assertEqual(table.column('ndvi').to_pylist()[1], [1] * 22 + [None])
+        self.assertEqual(table.column('country').to_pylist()[1], u'C\xf4te')
+
+    def test_encode_parquet(self):
+        f = pq.ParquetFile(io.BytesIO(b''.join(encode_parquet(ROWS, COLUMNS, batch_size=5))))
+
+        self.assertEqual(f.num_row_groups, 3)
+        self.assertEqual(f.read().column('id').to_pylist(), list(range(12)))
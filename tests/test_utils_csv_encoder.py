@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from croplands_api.utils.csv_encoder import encode_rows
+import unittest
+
+
+class TestUtilsCsvEncoder(unittest.TestCase):
+    def test_encode_rows_escapes(self):
+        rows = [(1, u'a,b', 'say "hi"', None, u'C\xf4te')]
+        output = ''.join(encode_rows(rows, headers=['id', 'a', 'b', 'c', 'd']))
+
+        self.assertEqual(output, 'id,a,b,c,d\n1,"a,b","say ""hi""",,C\xc3\xb4te\n')
+
+    def test_encode_rows_chunks(self):
+        blocks = list(encode_rows([(i,) for i in range(5)], headers=['id'], chunk_size=2))
+
+        self.assertEqual(blocks, ['id\n0\n1\n', '2\n3\n', '4\n'])
+
+    def test_encode_rows_headers_only(self):
+        self.assertEqual(list(encode_rows([], headers=['id'])), ['id\n'])
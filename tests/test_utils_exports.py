@@ -0,0 +1,95 @@
+from croplands_api import create_app, limiter
+from croplands_api.models import db, Location, Record
+from croplands_api.utils.exports import incremental_export
+import unittest
+
+FINGERPRINT = """
+    SELECT r.year, count(*), max(r.date_updated)
+    FROM record r
+    GROUP BY r.year
+    """
+
+
+class TestUtilsExports(unittest.TestCase):
+    app = None
+
+    def setUp(self):
+        self.app = TestUtilsExports.app
+        with self.app.app_context():
+            limiter.enabled = False
+            db.create_all()
+
+    def tearDown(self):
+        with self.app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    @classmethod
+    def setUpClass(cls):
+        super(TestUtilsExports, cls).setUpClass()
+        cls.app = create_app('Testing')
+
+    def test_incremental_export(self):
+        with self.app.app_context():
+            location = Location(lat=40.00, lon=-90.00)
+            db.session.add(location)
+            db.session.flush()
+            for year in [2014, 2015]:
+                db.session.add(Record(location_id=location.id, year=year))
+            db.session.commit()
+
+            built, removed = [], []
+
+            def run(force=False):
+                del built[:]
+                del removed[:]
+                incremental_export('test', FINGERPRINT, built.append, removed.append,
+                                   force=force)
+
+            run()
+            self.assertEqual(built, ['2014', '2015'])
+
+            # nothing changed
+            run()
+            self.assertEqual(built, [])
+
+            run(force=True)
+            self.assertEqual(built, ['2014', '2015'])
+
+            # only the changed partition
+            db.session.add(Record(location_id=location.id, year=2015, month=6))
+            db.session.commit()
+            run()
+            self.assertEqual(built, ['2015'])
+
+            # deleted partitions are removed
+            db.session.query(Record).filter(Record.year == 2014).delete()
+            db.session.commit()
+            run()
+            self.assertEqual(built, [])
+            self.assertEqual(removed, ['2014'])
+
+    def test_incremental_export_failed_build_is_retried(self):
+        with self.app.app_context():
+            location = Location(lat=40.00, lon=-90.00)
+            db.session.add(location)
+            db.session.flush()
+            for year in [2014, 2015]:
+                db.session.add(Record(location_id=location.id, year=year))
+            db.session.commit()
+
+            built, failures = [], ['2015']
+
+            def build(partition):
+                if partition in failures:
+                    failures.remove(partition)
+                    raise IOError('upload failed')
+                built.append(partition)
+
+            with self.assertRaises(IOError):
+                incremental_export('test_failed', FINGERPRINT, build)
+            self.assertEqual(built, ['2014'])
+
+            # only the failed partition is built again
+            incremental_export('test_failed', FINGERPRINT, build)
+            self.assertEqual(built, ['2014', '2015'])
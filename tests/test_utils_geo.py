@@ -0,0 +1,62 @@
+from croplands_api.utils.geo import distance, get_destination, calculate_bearing, \
+    degree_to_tile_number, tile_number_to_degree, vincenty_distances, haversine_distances, \
+    destinations, degrees_to_tile_numbers, spaced_along
+import numpy as np
+import unittest
+
+# Flinders Peak to Buninyong, Vincenty (1975)
+FLINDERS_PEAK = (-(37 + 57 / 60.0 + 3.72030 / 3600), 144 + 25 / 60.0 + 29.52440 / 3600)
+BUNINYONG = (-(37 + 39 / 60.0 + 10.15610 / 3600), 143 + 55 / 60.0 + 35.38390 / 3600)
+DISTANCE = 54972.271
+BEARING = 306 + 52 / 60.0 + 5.37 / 3600
+
+
+class TestUtilsGeo(unittest.TestCase):
+    def test_distance(self):
+        self.assertAlmostEqual(distance(*(FLINDERS_PEAK + BUNINYONG)), DISTANCE, delta=0.001)
+        self.assertEqual(distance(10, 10, 10, 10), 0)
+
+    def test_distance_does_not_converge(self):
+        with self.assertRaises(ValueError):
+            distance(0, 0, 0.5, 179.7)
+
+    def test_get_destination(self):
+        lat, lon = get_destination(FLINDERS_PEAK[0], FLINDERS_PEAK[1], BEARING, DISTANCE / 1000)
+
+        self.assertAlmostEqual(lat, BUNINYONG[0], delta=1e-8)
+        self.assertAlmostEqual(lon, BUNINYONG[1], delta=1e-8)
+        self.assertLess(get_destination(0, 179.9, 90, 100)[1], -179)
+
+    def test_calculate_bearing(self):
+        self.assertAlmostEqual(calculate_bearing(0, 0, 1, 0), 0, delta=1e-9)
+        self.assertAlmostEqual(calculate_bearing(0, 0, 0, -1), 270, delta=1e-9)
+
+    def test_tile_numbers(self):
+        self.assertEqual(degree_to_tile_number(45, -120, 10), (170, 368))
+
+        lat, lon = tile_number_to_degree(170, 368, 10)
+        self.assertEqual(degree_to_tile_number(lat - 1e-9, lon + 1e-9, 10), (170, 368))
+
+    def test_arrays_match_scalars(self):
+        lats, lons = np.array([-45.5, 0, 12.25, 60]), np.array([-170, 0.5, 77.1, 10])
+
+        expected = [distance(lat, lon, 1, 2) for lat, lon in zip(lats, lons)]
+        self.assertTrue(np.allclose(vincenty_distances(lats, lons, 1, 2), expected, rtol=0,
+                                    atol=1e-3))
+        self.assertTrue(np.allclose(haversine_distances(lats, lons, 1, 2), expected,
+                                    rtol=0.005))
+
+        lat, lon = destinations(lats, lons, 45, 10)
+        self.assertTrue(np.allclose(lat, [get_destination(a, b, 45, 10)[0]
+                                          for a, b in zip(lats, lons)]))
+
+        x, y = degrees_to_tile_numbers(lats, lons, 12)
+        self.assertEqual(list(zip(x, y)),
+                         [degree_to_tile_number(a, b, 12) for a, b in zip(lats, lons)])
+
+    def test_spaced_along(self):
+        # points 1km apart along the equator
+        lons = np.arange(11) * 1000 / 111195.08
+        self.assertEqual(spaced_along(np.zeros(11), lons, 2500), [3, 6, 9])
+        self.assertEqual(spaced_along(np.zeros(11), lons, 20000), [])
+        self.assertEqual(spaced_along([0, 0], [0, 1], 10), [])
@@ -0,0 +1,19 @@
+from croplands_api.utils.ndvi_svg import render_paths, render_svg
+import unittest
+
+
+class TestUtilsNdviSvg(unittest.TestCase):
+    def test_render_paths(self):
+        series = [[500, 600, 700] + [None] * 20, None, [None] * 21 + [2000, 0]]
+
+        self.assertEqual(render_paths(series), '<path d="M0 500L52 400 104 300"/>'
+                                               '<path d="M1095 0L1147 997"/>')
+
+    def test_render_paths_breaks_at_missing_values(self):
+        series = [[100, None, 200] + [None] * 20]
+
+        self.assertEqual(render_paths(series), '<path d="M0 900"/><path d="M104 800"/>')
+
+    def test_render_svg_empty(self):
+        self.assertIn('<g class="paths" fill="none" stroke="black" stroke-width="2" '
+                      'transform="translate(150,0)"></g>', render_svg([]))
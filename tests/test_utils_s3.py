@@ -1,5 +1,12 @@
 from croplands_api import create_app, db, limiter
+from croplands_api.utils.s3 import upload_file_to_s3, upload_stream_to_s3, delete_file_from_s3
+from croplands_api.utils.storage import get_storage, Storage, LocalStorage, ChunkReader, \
+    join_chunks
 import unittest
+import tempfile
+import shutil
+import gzip
+import StringIO
 
 
 class TestUtilsS3(unittest.TestCase):
@@ -7,11 +14,13 @@ class TestUtilsS3(unittest.TestCase):
 
     def setUp(self):
         self.app = TestUtilsS3.app
+        self.app.config['STORAGE_ROOT'] = tempfile.mkdtemp()
         with self.app.app_context():
             limiter.enabled = False
             db.create_all()
 
     def tearDown(self):
+        shutil.rmtree(self.app.config['STORAGE_ROOT'])
         with self.app.app_context():
             db.session.remove()
             db.drop_all()
@@ -35,3 +44,49 @@ class TestUtilsS3(unittest.TestCase):
         #         delete_image(f.key)
         #         get = requests.get(url.split('?')[0])
         #         self.assertEqual(get.status_code, 404)
+
+    def test_upload_file_to_local_storage(self):
+        with self.app.app_context():
+            storage = get_storage()
+            self.assertIsInstance(storage, LocalStorage)
+
+            upload_file_to_s3('a,b\n1,2\n', 'public/csv/test.csv', 'text/csv', max_age=60)
+            contents = gzip.GzipFile(fileobj=StringIO.StringIO(
+                storage.get('public/csv/test.csv'))).read()
+            self.assertEqual(contents, 'a,b\n1,2\n')
+            self.assertEqual(storage.metadata('public/csv/test.csv'),
+                             {'content-type': 'text/csv', 'cache-control': 'max-age=60',
+                              'content-encoding': 'gzip'})
+
+            delete_file_from_s3('public/csv/test.csv')
+            self.assertIsNone(storage.get('public/csv/test.csv'))
+
+    def test_local_storage_keys_stay_in_bucket(self):
+        with self.app.app_context():
+            with self.assertRaises(ValueError):
+                get_storage().put('../other/file', 'x')
+
+    def test_storage_requires_every_operation(self):
+        class PutOnly(Storage):
+            def put(self, key, contents, metadata=None, public=False):
+                pass
+
+        self.assertRaises(TypeError, PutOnly)
+        self.assertRaises(TypeError, Storage)
+
+    def test_upload_stream_to_local_storage(self):
+        chunks = ['%d,%s\n' % (i, 'x' * (i % 50)) for i in range(10000)]
+        with self.app.app_context():
+            upload_stream_to_s3(iter(chunks), 'public/csv/stream.csv', 'text/csv')
+            contents = gzip.GzipFile(fileobj=StringIO.StringIO(
+                get_storage().get('public/csv/stream.csv'))).read()
+            self.assertEqual(contents, ''.join(chunks))
+
+    def test_chunk_reader_and_parts(self):
+        chunks = ['a' * 3, '', 'b' * 10, 'c']
+        reader = ChunkReader(chunks)
+        self.assertEqual(reader.read(4), 'aaab')
+        self.assertEqual(reader.read(), 'b' * 9 + 'c')
+        self.assertEqual(reader.read(4), '')
+
+        self.assertEqual(list(join_chunks(chunks, 5)), ['aaabbbbbbbbbb', 'c'])
@@ -0,0 +1,82 @@
+from croplands_api.utils.tile_cache import DiskTileCache, SingleFlight, Tile, tile_key
+import unittest
+import threading
+import tempfile
+import shutil
+import time
+import os
+
+
+class TestUtilsTileCache(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_tile_key_is_canonical(self):
+        self.assertEqual(tile_key('gee', {'asset': 'a', 'year': '2014'}, 3, 1, 2),
+                         tile_key('gee', {'year': '2014', 'asset': 'a'}, 3, 1, 2))
+        self.assertNotEqual(tile_key('gee', {'year': '2014'}, 3, 1, 2),
+                            tile_key('gee', {'month': '2014'}, 3, 1, 2))
+
+    def test_disk_tile_cache_lru(self):
+        tile_cache = DiskTileCache(self.root, max_bytes=300)
+        tile_cache.set('aa1', Tile('x' * 100, 'image/png'))
+        tile_cache.set('aa2', Tile('y' * 100, 'image/png'))
+
+        # reading aa1 makes aa2 the least recently used
+        past = time.time() - 60
+        os.utime(tile_cache.path('aa2'), (past, past))
+        os.utime(tile_cache.path('aa1'), (past - 60, past - 60))
+        self.assertEqual(tile_cache.get('aa1').content, 'x' * 100)
+
+        tile_cache.set('aa3', Tile('z' * 100, 'image/jpeg'))
+        self.assertIsNone(tile_cache.get('aa2'))
+        self.assertIsNotNone(tile_cache.get('aa1'))
+        self.assertEqual(tile_cache.get('aa3').content_type, 'image/jpeg')
+
+    def test_disk_tile_cache_max_age(self):
+        tile_cache = DiskTileCache(self.root, max_bytes=1000, max_age=60)
+        tile_cache.set('bb1', Tile('x', 'image/png', created=time.time() - 120))
+        tile_cache.set('bb2', Tile('x', 'image/png'))
+        self.assertIsNone(tile_cache.get('bb1'))
+        self.assertIsNotNone(tile_cache.get('bb2'))
+
+    def test_disk_tile_cache_lock_files_are_striped(self):
+        tile_cache = DiskTileCache(self.root, max_bytes=10 ** 6)
+        keys = [tile_key('gee', i) for i in range(300)]
+        for key in keys:
+            with tile_cache.lock(key):
+                tile_cache.set(key, Tile('x', 'image/png'))
+
+        locks = [name for _, _, names in os.walk(self.root) for name in names
+                 if name.endswith('.lock')]
+        self.assertEqual(sorted(locks), sorted(set(key[:3] + '.lock' for key in keys)))
+
+    def test_single_flight(self):
+        flight = SingleFlight()
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+
+        def fetch():
+            calls.append(1)
+            started.set()
+            release.wait()
+            return 'tile'
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(flight.do('k', fetch)))
+                   for _ in range(5)]
+        threads[0].start()
+        started.wait()
+        for t in threads[1:]:
+            t.start()
+        time.sleep(0.1)
+        release.set()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ['tile'] * 5)
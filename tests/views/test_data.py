@@ -2,8 +2,19 @@ from flask import request
 import json
 from croplands_api import cache
 from croplands_api.auth import decode_token, make_jwt, load_user, allowed_roles
-from croplands_api.views.data import get_meta, get_filters
+from croplands_api.views.data import get_meta, get_filters, encode_cursor, filters_hash, \
+    get_snapshot_url, get_next_url, sample_start, store_cursor_after
+import croplands_api.views.data
+import croplands_api.tasks.snapshots
+from croplands_api.tasks.snapshots import build_snapshot
+from croplands_api.utils.snapshots import snapshot_partition, snapshot_url
+from croplands_api.exceptions import FieldError
+from croplands_api.models import RecordSearch
+from sqlalchemy.dialects import postgresql
+from collections import namedtuple
+import pytest
 import time
+import uuid
 
 
 def test_get_meta(request_ctx):
@@ -23,3 +34,160 @@ def test_get_filters_use_validation(request_ctx):
             assert filters['use_validation'] == [False, True]
         else:
             assert filters['use_validation'] == [False]
+
+
+def test_get_meta_cursor(app):
+    cursor = encode_cursor('Brazil', 42, 'country', 'desc')
+    with app.test_request_context('/?order_by=country&cursor=' + cursor):
+        meta = get_meta()
+
+    assert meta['paging'] == 'cursor'
+    assert meta['cursor'] == ('Brazil', 42)
+    assert meta['offset'] == 0
+
+
+def test_get_meta_cursor_of_another_order(app):
+    cursor = encode_cursor('Brazil', 42, 'country', 'desc')
+    for args in ['order_by=year', 'order_by=country&order_by_direction=asc']:
+        with app.test_request_context('/?%s&cursor=%s' % (args, cursor)):
+            with pytest.raises(FieldError):
+                get_meta()
+
+
+def test_get_meta_after_streamed_page(app):
+    Row = namedtuple('Row', ['id', 'country'])
+    meta = {'limit': 2, 'order_by': 'country', 'order_by_direction': 'desc'}
+    full, short, unknown = uuid.uuid4().hex, uuid.uuid4().hex, uuid.uuid4().hex
+
+    # the cursor is only stored once every row has been read
+    rows = store_cursor_after(iter([Row(1, 'India'), Row(2, 'Brazil')]), meta, full)
+    next(rows)
+    with app.test_request_context('/?order_by=country&after=' + full):
+        with pytest.raises(FieldError):
+            get_meta()
+    list(rows)
+    with app.test_request_context('/?order_by=country&after=' + full):
+        assert get_meta()['cursor'] == ('Brazil', 2)
+
+    # a short page was the last, the next one is empty
+    list(store_cursor_after(iter([Row(3, 'Algeria')]), meta, short))
+    with app.test_request_context('/?order_by=country&after=' + short):
+        assert get_meta()['limit'] == 0
+
+    with app.test_request_context('/?order_by=country&after=' + unknown):
+        with pytest.raises(FieldError):
+            get_meta()
+
+
+def test_get_meta_page_uses_offset(app):
+    with app.test_request_context('/?page=3&page_size=10'):
+        meta = get_meta()
+
+    assert meta['paging'] == 'offset'
+    assert meta['cursor'] is None
+    assert meta['offset'] == 20
+
+
+def test_filters_hash_is_canonical():
+    a = {'country': ['Brazil', 'India'], 'year': ['2015'], 'delay': False}
+    b = {'delay': False, 'year': ['2015'], 'country': ['India', 'Brazil']}
+
+    assert filters_hash(a) == filters_hash(b)
+    assert filters_hash(a) != filters_hash({'country': ['Brazil'], 'year': ['2015']})
+
+
+def test_get_snapshot_url(app, monkeypatch):
+    monkeypatch.setattr(croplands_api.views.data, 'snapshot_count',
+                        lambda partition: 10 if partition == u'Brazil|2015' else None)
+
+    meta = {'offset': 0, 'cursor': None, 'order_by': 'id', 'order_by_direction': 'desc',
+            'limit': 1000}
+    filters = {'country': [u'Brazil'], 'year': ['2015'], 'use_validation': [False],
+               'delay': True}
+
+    assert get_snapshot_url(meta, filters).endswith('public/snapshots/Brazil/2015.csv')
+
+    # the snapshot does not fit the page or the filters
+    assert get_snapshot_url(dict(meta, limit=5), filters) is None
+    assert get_snapshot_url(dict(meta, offset=1000), filters) is None
+    assert get_snapshot_url(dict(meta, order_by='year'), filters) is None
+    assert get_snapshot_url(meta, dict(filters, crop_primary=['1'])) is None
+    assert get_snapshot_url(meta, dict(filters, use_validation=[False, True])) is None
+    assert get_snapshot_url(meta, dict(filters, year=['2014'])) is None
+
+
+def test_snapshot_of_country_with_spaces(app, monkeypatch):
+    country = u"C\xf4te d'Ivoire"
+    partition = snapshot_partition(country, 2015)
+    uploaded = []
+    monkeypatch.setattr(croplands_api.tasks.snapshots, 'query', lambda **kwargs: [])
+    monkeypatch.setattr(croplands_api.tasks.snapshots, 'upload_stream_to_s3',
+                        lambda chunks, key, *args, **kwargs: uploaded.append(key))
+
+    # the object is stored under the plain name and the url quotes it once
+    build_snapshot(partition)
+    assert uploaded == ["public/snapshots/C\xc3\xb4te d'Ivoire/2015.csv"]
+    assert snapshot_url(partition).endswith('public/snapshots/C%C3%B4te%20d%27Ivoire/2015.csv')
+
+
+def test_get_meta_format(app):
+    with app.test_request_context('/'):
+        assert get_meta()['format'] == 'csv'
+
+    with app.test_request_context('/?format=xls'):
+        with pytest.raises(FieldError):
+            get_meta()
+
+
+def test_next_url_keeps_format(app):
+    pytest.importorskip('pyarrow')
+    Row = namedtuple('Row', ['id'])
+
+    with app.test_request_context('/data/download?format=parquet&page_size=10'):
+        next_url = get_next_url(get_meta(), {}, last_row=Row(5))
+
+    with app.test_request_context(next_url):
+        meta = get_meta()
+        assert meta['format'] == 'parquet'
+        assert meta['cursor'] == (5, 5)
+        assert 'format=parquet' in get_next_url(meta, {}, last_row=Row(3))
+
+
+def test_ndvi_envelope_filter():
+    lower = range(23)
+    upper = [v + 100 for v in lower]
+    compiled = RecordSearch.ndvi_envelope_filter(upper, lower).compile(
+        dialect=postgresql.dialect())
+
+    assert str(compiled).lower().startswith('record_search.ndvi_envelope <@ cube(')
+
+    low, high = sorted(compiled.params.values(), key=lambda v: v[0])
+    # season minimums of lower then unbounded maximums
+    assert low[:4] == [0, 6, 12, 18] and low[4] < -1000
+    # unbounded minimums then season maximums of upper
+    assert high[4:] == [105, 111, 117, 122] and high[0] > 1000
+
+
+def test_get_meta_rand_seed(app):
+    with app.test_request_context('/?order_by_direction=rand&seed=abc'):
+        meta = get_meta()
+        assert meta['seed'] == 'abc'
+        assert meta['paging'] == 'offset'
+        assert 'seed=abc' in get_next_url(meta, {}, count_filtered=5000)
+
+    # a seed is chosen when none is given so later pages continue the same sample
+    with app.test_request_context('/?order_by_direction=rand'):
+        meta = get_meta()
+        assert meta['seed']
+        assert 'seed=' + meta['seed'] in get_next_url(meta, {}, count_filtered=5000)
+
+    with app.test_request_context('/?order_by_direction=desc&seed=abc'):
+        assert get_meta()['seed'] is None
+
+
+def test_sample_start():
+    assert sample_start('abc') == sample_start(u'abc')
+    assert sample_start('abc') != sample_start('abd')
+    starts = [sample_start(i) for i in range(1000)]
+    assert all(0 <= s < 1 for s in starts)
+    assert 0.4 < sum(starts) / len(starts) < 0.6